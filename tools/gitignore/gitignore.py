@@ -1,7 +1,5 @@
 import re
 import os
-import itertools
-from six import itervalues, iteritems
 from collections import defaultdict
 
 
@@ -118,8 +116,84 @@ def parse_line(line):
     return invert, dir_only, literal, pattern
 
 
+class RuleSet(object):
+    """The rules that apply to either files or directories, compiled into
+    a small number of combined regexps.
+
+    Rules are split into generations by the exclude ("!") rules, so that
+    an exclude rule applies to every rule in an earlier generation. An
+    entry is ignored if the latest generation containing a rule that
+    matches it has no later exclude rule that also matches it; this gives
+    the same result as checking every rule in turn. Rules matching the
+    name and rules matching the path are combined separately, with one
+    capturing group per generation, newest first, so finding the latest
+    matching generation takes a single match against each.
+
+    :param rules: List of (generation, invert, name_only, regexp) tuples
+                  where regexp is the source of the regexp to match"""
+
+    # Python 2 limits the number of groups in a regexp
+    max_groups = 99
+
+    def __init__(self, rules):
+        self.name_matchers = self._compile_generations(
+            [(gen, regexp) for gen, invert, name_only, regexp in rules
+             if not invert and name_only])
+        self.path_matchers = self._compile_generations(
+            [(gen, regexp) for gen, invert, name_only, regexp in rules
+             if not invert and not name_only])
+
+        # Exclude rules that apply to each generation
+        generations = max([gen for gen, _, _, _ in rules] or [-1]) + 1
+        self.excludes = []
+        for generation in range(generations):
+            excludes = [(name_only, regexp) for gen, invert, name_only, regexp in rules
+                        if invert and gen >= generation]
+            self.excludes.append(
+                (self._compile_any([regexp for name_only, regexp in excludes if name_only]),
+                 self._compile_any([regexp for name_only, regexp in excludes if not name_only])))
+
+    def _compile_any(self, regexps):
+        if not regexps:
+            return None
+        return re.compile("|".join("(?:%s)" % regexp for regexp in regexps))
+
+    def _compile_generations(self, rules):
+        """Get a list of (regexp, generations) where generations maps the
+        index of each group in regexp to the generation it matches"""
+        by_generation = defaultdict(list)
+        for gen, regexp in rules:
+            by_generation[gen].append(regexp)
+        generations = sorted(by_generation, reverse=True)
+        rv = []
+        for i in range(0, len(generations), self.max_groups):
+            chunk = generations[i:i + self.max_groups]
+            regexp = "|".join("(%s)" % "|".join("(?:%s)" % item for item in by_generation[gen])
+                              for gen in chunk)
+            rv.append((re.compile(regexp), [None] + chunk))
+        return rv
+
+    def ignored(self, name, path):
+        generation = -1
+        for regexp, generations in self.name_matchers:
+            m = regexp.match(name)
+            if m:
+                generation = generations[m.lastindex]
+                break
+        for regexp, generations in self.path_matchers:
+            m = regexp.match(path)
+            if m:
+                generation = max(generation, generations[m.lastindex])
+                break
+        if generation == -1:
+            return False
+        exclude_name, exclude_path = self.excludes[generation]
+        return not ((exclude_name is not None and exclude_name.match(name)) or
+                    (exclude_path is not None and exclude_path.match(path)))
+
+
 class PathFilter(object):
-    def __init__(self, root, extras=None, cache=None):
+    def __init__(self, root, extras=None):
         if root:
             ignore_path = os.path.join(root, ".gitignore")
         else:
@@ -129,11 +203,8 @@ class PathFilter(object):
             return
         self.trivial = False
 
-        self.literals_file = defaultdict(dict)
-        self.literals_dir = defaultdict(dict)
-        self.patterns_file = []
-        self.patterns_dir = []
-        self.cache = cache or {}
+        # List of (invert, dir_only, name_only, regexp) for each rule, in order
+        self.rules = []
 
         if extras is None:
             extras = []
@@ -144,6 +215,9 @@ class PathFilter(object):
             args = None, extras
         self._read_ignore(*args)
 
+        self.rules_dir = self._rule_set(dirs=True)
+        self.rules_file = self._rule_set(dirs=False)
+
     def _read_ignore(self, ignore_path, extras):
         if ignore_path is not None:
             with open(ignore_path) as f:
@@ -158,85 +232,45 @@ class PathFilter(object):
             return
         invert, dir_only, literal, rule = parsed
 
-        if invert:
-            # For exclude rules, we attach the rules to all preceeding patterns, so
-            # that we can match patterns out of order and check if they were later
-            # overriden by an exclude rule
-            assert not literal
-            if not dir_only:
-                rules_iter = itertools.chain(
-                    itertools.chain(*(iteritems(item) for item in itervalues(self.literals_dir))),
-                    itertools.chain(*(iteritems(item) for item in itervalues(self.literals_file))),
-                    self.patterns_dir,
-                    self.patterns_file)
+        if literal:
+            if len(rule) == 1:
+                name_only, regexp = True, "^%s$" % re.escape(rule[0])
             else:
-                rules_iter = itertools.chain(
-                    itertools.chain(*(iteritems(item) for item in itervalues(self.literals_dir))),
-                    self.patterns_dir)
-
-            for rules in rules_iter:
-                rules[1].append(rule)
+                dir_name, name = rule
+                path = "%s/%s" % (dir_name, name) if dir_name else name
+                # Directory paths are matched with a trailing /
+                name_only, regexp = False, "^%s/?$" % re.escape(path)
         else:
-            if literal:
-                if len(rule) == 1:
-                    dir_name, pattern = None, rule[0]
-                else:
-                    dir_name, pattern = rule
-                self.literals_dir[dir_name][pattern] = []
-                if not dir_only:
-                    self.literals_file[dir_name][pattern] = []
-            else:
-                self.patterns_dir.append((rule, []))
-                if not dir_only:
-                    self.patterns_file.append((rule, []))
+            name_only, regexp = rule[0], rule[1].pattern
+        self.rules.append((invert, dir_only, name_only, regexp))
+
+    def _rule_set(self, dirs):
+        rules = []
+        generation = 0
+        for invert, dir_only, name_only, regexp in self.rules:
+            if dirs or not dir_only:
+                rules.append((generation, invert, name_only, regexp))
+            if invert:
+                generation += 1
+        return RuleSet(rules)
 
     def filter(self, iterator):
-        empty = {}
         for dirpath, dirnames, filenames in iterator:
             orig_dirpath = dirpath
             if os.path.sep != "/":
                 dirpath = dirpath.replace(os.path.sep, "/")
+            if dirpath:
+                prefix = dirpath + "/"
+            else:
+                prefix = ""
+
+            dir_ignored = self.rules_dir.ignored
+            dirnames[:] = [item for item in dirnames
+                           if not dir_ignored(item[0], prefix + item[0] + "/")]
+            file_ignored = self.rules_file.ignored
+            keep_files = [item for item in filenames
+                          if not file_ignored(item[0], prefix + item[0])]
 
-            keep_dirs = []
-            keep_files = []
-
-            for iter_items, literals, patterns, target, suffix in [
-                    (dirnames, self.literals_dir, self.patterns_dir, keep_dirs, "/"),
-                    (filenames, self.literals_file, self.patterns_file, keep_files, "")]:
-                for item in iter_items:
-                    name = item[0]
-                    if dirpath:
-                        path = "%s/%s" % (dirpath, name) + suffix
-                    else:
-                        path = name + suffix
-                    if path in self.cache:
-                        if not self.cache[path]:
-                            target.append(item)
-                        continue
-                    for rule_dir in [None, dirpath]:
-                        if name in literals.get(rule_dir, empty):
-                            exclude = literals[rule_dir][name]
-                            if not any(rule.match(path) for rule in exclude):
-                                # Skip this item
-                                self.cache[path] = True
-                                break
-                    else:
-                        for (component_only, pattern), exclude in patterns:
-                            if component_only:
-                                match = pattern.match(name)
-                            else:
-                                match = pattern.match(path)
-                            if match:
-                                if not any(rule.match(name if name_only else path)
-                                           for name_only, rule in exclude):
-                                    # Skip this item
-                                    self.cache[path] = True
-                                    break
-                        else:
-                            self.cache[path] = False
-                            target.append(item)
-
-            dirnames[:] = keep_dirs
             assert ".git" not in dirnames
             yield orig_dirpath, dirnames, keep_files
 
@@ -51,6 +51,27 @@ filter_data = [
     (["#foo", "", "a*", "!a.py"],
      [("", ["foo"], ["a", "a.foo", "a.py"])],
      [(["foo"], ["a.py"])]),
+    # Later rules override earlier exclude rules
+    (["*.py", "!a*", "ab.py"],
+     [("", [], ["a.py", "ab.py", "b.py", "ac"])],
+     [([], ["a.py", "ac"])]),
+    # Exclude rules for directories don't apply to files
+    (["a*", "!ab/"],
+     [("", ["ab", "ac"], ["ab", "ac", "b"])],
+     [(["ab"], ["b"])]),
+    # Exclude rules apply to literals
+    (["foo", "a/bar", "!f*"],
+     [("", ["foo", "bar"], ["foo"]),
+      ("a", ["bar"], ["bar", "foo"])],
+     [(["foo", "bar"], ["foo"]),
+      ([], ["foo"])]),
+    (["/a", "b/c/"],
+     [("", ["a", "b"], ["a", "c"]),
+      ("b", ["a", "c"], ["c"]),
+      ("b/c", ["a"], ["a"])],
+     [(["b"], ["c"]),
+      (["a"], ["c"]),
+      (["a"], ["a"])]),
 ]
 
 
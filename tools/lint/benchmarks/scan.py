@@ -0,0 +1,133 @@
+"""Benchmark the line regexps and whitelist matching used by the lint.
+
+Reads every file in the tree (or under the given paths) into memory,
+then times checking the line regexps with one search per regexp per
+line against the combined search used by check_regexp_line, and
+filtering one error of each whitelisted type for every path against
+the lint.whitelist entries one at a time against the compiled
+whitelist.
+
+Run as::
+
+  python tools/lint/benchmarks/scan.py [--repeat N] [PATH...]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+from six import BytesIO, iteritems
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, os.path.abspath(os.path.join(here, os.pardir, os.pardir, os.pardir)))
+
+from tools import localpaths  # noqa: F401
+from tools.lint import fnmatch, lint
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*",
+                        help="Paths relative to the repository root to read files from")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times to run each check")
+    return parser
+
+
+def read_files(repo_root, subdirs):
+    rv = []
+    for subdir in subdirs or [None]:
+        for path in lint.all_filesystem_paths(repo_root, subdir):
+            abs_path = os.path.join(repo_root, path)
+            if os.path.isfile(abs_path):
+                with open(abs_path, "rb") as f:
+                    rv.append((path, f.read()))
+    return rv
+
+
+def regexp_line_per_rule(path, f):
+    # check_regexp_line before the regexps were combined
+    errors = []
+    applicable_regexps = [regexp for regexp in lint.regexps if regexp.applies(path)]
+    for i, line in enumerate(f):
+        for regexp in applicable_regexps:
+            if regexp.search(line):
+                errors.append((regexp.error, regexp.description, path, i+1))
+    return errors
+
+
+def filter_whitelist_per_entry(data, errors):
+    # filter_whitelist_errors before the whitelist was compiled
+    rv = []
+    for error_type, msg, path, line in errors:
+        normpath = os.path.normcase(path)
+        whitelisted = False
+        if error_type in data and error_type != "IGNORED PATH":
+            for file_match, allowed_lines in iteritems(data[error_type]):
+                if None in allowed_lines or line in allowed_lines:
+                    if fnmatch.fnmatchcase(normpath, file_match):
+                        whitelisted = True
+        if not whitelisted:
+            rv.append((error_type, msg, path, line))
+    return rv
+
+
+def timed(name, repeat, func):
+    start = time.time()
+    for _ in range(repeat):
+        rv = func()
+    print("%s: %.3fs" % (name, (time.time() - start) / repeat))
+    return rv
+
+
+def run(repo_root, subdirs, repeat):
+    files = read_files(repo_root, subdirs)
+    print("%i files, %i lines" % (len(files),
+                                  sum(data.count(b"\n") for _, data in files)))
+
+    def check_lines(check):
+        return [check(path, BytesIO(data)) for path, data in files]
+
+    before = timed("line regexps, one search per regexp", repeat,
+                   lambda: check_lines(regexp_line_per_rule))
+    after = timed("line regexps, combined", repeat,
+                  lambda: check_lines(lambda path, f: lint.check_regexp_line(repo_root,
+                                                                             path, f)))
+    assert before == after
+
+    with open(os.path.join(repo_root, "lint.whitelist")) as f:
+        data, ignored_files = lint.parse_whitelist(f)
+    errors = [(error_type, "", path, 1)
+              for path, _ in files
+              for error_type in sorted(data)]
+    entries = sum(len(item) for item in data.values())
+    print("%i whitelist entries, %i errors" % (entries, len(errors)))
+
+    before = timed("whitelist, one match per entry", repeat,
+                   lambda: filter_whitelist_per_entry(data, errors))
+    after = timed("whitelist, compiled", repeat,
+                  lambda: lint.filter_whitelist_errors(lint.CompiledWhitelist(data), errors))
+    assert before == after
+
+    paths = [path for path, _ in files]
+    before = timed("ignored files, one match per pattern", repeat,
+                   lambda: [path for path in paths
+                            if any(fnmatch.fnmatch(path, file_match)
+                                   for file_match in ignored_files)])
+    ignored_re = fnmatch.compile_patterns(ignored_files)
+    after = timed("ignored files, compiled", repeat,
+                  lambda: [path for path in paths
+                           if ignored_re.match(os.path.normcase(path))])
+    assert before == after
+
+
+def main():
+    kwargs = vars(get_parser().parse_args())
+    run(localpaths.repo_root, kwargs["paths"], kwargs["repeat"])
+
+
+if __name__ == "__main__":
+    main()
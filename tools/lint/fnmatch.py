@@ -2,9 +2,10 @@ from __future__ import absolute_import
 
 import fnmatch as _stdlib_fnmatch
 import os
+import re
 
 
-__all__ = ["fnmatch", "fnmatchcase", "filter", "translate"]
+__all__ = ["fnmatch", "fnmatchcase", "filter", "translate", "compile_patterns"]
 
 
 def fnmatch(name, pat):
@@ -30,3 +31,19 @@ def filter(names, pat):
 
 
 translate = _stdlib_fnmatch.translate
+
+
+def _translate_body(pat):
+    """Translate a pattern to a regexp without the end anchor or flags"""
+    rv = translate(pat)
+    # Python 2 appends the flags, Python 3 wraps the pattern in them
+    if rv.endswith("\\Z(?ms)"):
+        return rv[:-len("\\Z(?ms)")]
+    assert rv.startswith("(?s:") and rv.endswith(")\\Z"), rv
+    return rv[len("(?s:"):-len(")\\Z")]
+
+
+def compile_patterns(pats):
+    """Compile a list of patterns into a single regexp whose match method
+    matches the same names as calling fnmatchcase with any of the patterns"""
+    return re.compile("(?s)(?:%s)\\Z" % "|".join(_translate_body(pat) for pat in sorted(pats)))
@@ -3,7 +3,9 @@ from __future__ import print_function, unicode_literals
 import abc
 import argparse
 import ast
+import hashlib
 import json
+import multiprocessing
 import os
 import re
 import subprocess
@@ -16,11 +18,13 @@ from . import fnmatch
 from .. import localpaths
 from ..gitignore.gitignore import PathFilter
 from ..wpt import testfiles
-from ..manifest.vcs import walk
+from ..manifest.vcs import (CacheFile, HashCache, MetadataCacheFile, default_cache_root,
+                            ensure_cache_root, output_patterns, walk)
 
 from manifest.sourcefile import SourceFile, js_meta_re, python_meta_re, space_chars, get_any_variants, get_default_any_variants
+import html5lib
 from six import binary_type, iteritems, itervalues
-from six.moves import range
+from six.moves import range, zip
 from six.moves.urllib.parse import urlsplit, urljoin
 
 import logging
@@ -62,8 +66,32 @@ you could add the following line to the lint.whitelist file.
 
 %s: %s"""
 
-def all_filesystem_paths(repo_root, subdir=None):
-    path_filter = PathFilter(repo_root, extras=[".git/"])
+# Dict of {path: exists} for files whose existence was checked while
+# linting the contents of a file, or None when not recording
+_checked_files = None
+
+
+def is_file(repo_root, path):
+    """
+    Checks if a file exists, for lints that depend on other files.
+
+    :param repo_root: the repository root
+    :param path: the path of the file within the repository
+    :returns: True if the file exists
+    """
+
+    rv = os.path.isfile(os.path.join(repo_root, path))
+    if _checked_files is not None:
+        _checked_files[path] = rv
+    return rv
+
+
+def all_filesystem_paths(repo_root, subdir=None, cache_root=None):
+    if cache_root is None:
+        cache_root = default_cache_root(repo_root)
+    # Don't lint the caches, which may be inside the repository
+    path_filter = PathFilter(repo_root,
+                             extras=[".git/"] + output_patterns(repo_root, cache_root=cache_root))
     if subdir:
         expanded_path = subdir
     else:
@@ -296,28 +324,58 @@ def parse_whitelist(f):
     return data, ignored_files
 
 
+class CompiledWhitelist(object):
+    """
+    Whitelist data from `parse_whitelist` compiled for matching errors.
+
+    For each error type, the file patterns that apply to every line are
+    combined into a single regexp, as are the patterns for each line
+    number, so that each error is matched against at most two regexps
+    rather than against every entry for its type.
+    """
+
+    def __init__(self, data):
+        self.rules = {}
+        for error_type, wl_files in iteritems(data):
+            any_line = set()
+            by_line = defaultdict(set)
+            for file_match, allowed_lines in iteritems(wl_files):
+                for line in allowed_lines:
+                    if line is None:
+                        any_line.add(file_match)
+                    else:
+                        by_line[line].add(file_match)
+            self.rules[error_type] = (
+                fnmatch.compile_patterns(any_line) if any_line else None,
+                {line: fnmatch.compile_patterns(file_matches)
+                 for line, file_matches in iteritems(by_line)})
+
+    def whitelisted(self, error_type, path, line):
+        # Allow whitelisting all lint errors except the IGNORED PATH lint,
+        # which explains how to fix it correctly and shouldn't be ignored.
+        if error_type not in self.rules or error_type == "IGNORED PATH":
+            return False
+        normpath = os.path.normcase(path)
+        any_line, by_line = self.rules[error_type]
+        if any_line is not None and any_line.match(normpath):
+            return True
+        line_re = by_line.get(line)
+        return line_re is not None and line_re.match(normpath) is not None
+
+
 def filter_whitelist_errors(data, errors):
     """
-    Filter out those errors that are whitelisted in `data`.
+    Filter out those errors that are whitelisted in `data`, which is either
+    the whitelist data from `parse_whitelist` or a `CompiledWhitelist`.
     """
 
     if not errors:
         return []
 
-    whitelisted = [False for item in range(len(errors))]
-
-    for i, (error_type, msg, path, line) in enumerate(errors):
-        normpath = os.path.normcase(path)
-        # Allow whitelisting all lint errors except the IGNORED PATH lint,
-        # which explains how to fix it correctly and shouldn't be ignored.
-        if error_type in data and error_type != "IGNORED PATH":
-            wl_files = data[error_type]
-            for file_match, allowed_lines in iteritems(wl_files):
-                if None in allowed_lines or line in allowed_lines:
-                    if fnmatch.fnmatchcase(normpath, file_match):
-                        whitelisted[i] = True
+    if not isinstance(data, CompiledWhitelist):
+        data = CompiledWhitelist(data)
 
-    return [item for i, item in enumerate(errors) if not whitelisted[i]]
+    return [item for item in errors if not data.whitelisted(item[0], item[2], item[3])]
 
 class Regexp(object):
     pattern = None
@@ -416,18 +474,56 @@ regexps = [item() for item in
             LayoutTestsRegexp,
             SpecialPowersRegexp]]
 
+# Cache of the regexps that apply to each file extension, along with the
+# combined regexps built from them
+_line_regexps = {}
+
+
+def get_line_regexps(path):
+    """
+    Gets the line regexps that apply to a path, along with a single regexp
+    that matches a line if any of them do.
+
+    :param path: the path of the file within the repository
+    :returns: a tuple of the list of applicable regexps, the combined
+              regexp for searching a line, and the combined regexp for
+              searching the whole file
+    """
+
+    ext = os.path.splitext(path)[1]
+    if ext not in _line_regexps:
+        applicable_regexps = [regexp for regexp in regexps if regexp.applies(path)]
+        pattern = b"|".join(b"(?:" + regexp.pattern + b")" for regexp in applicable_regexps)
+        _line_regexps[ext] = (applicable_regexps,
+                              re.compile(pattern),
+                              re.compile(pattern, re.MULTILINE))
+    return _line_regexps[ext]
+
+
 def check_regexp_line(repo_root, path, f):
     errors = []
 
-    applicable_regexps = [regexp for regexp in regexps if regexp.applies(path)]
+    applicable_regexps, combined, combined_multiline = get_line_regexps(path)
+
+    # Anything that one of the regexps matches within a line is also
+    # matched in the whole file with ^ and $ matching at line boundaries,
+    # so a file with no match at all doesn't need to be split into lines
+    if not combined_multiline.search(f.read()):
+        return errors
+    f.seek(0)
 
     for i, line in enumerate(f):
+        # Most lines don't match any of the regexps, so check them all in a
+        # single search, and only work out which ones matched otherwise
+        if not combined.search(line):
+            continue
         for regexp in applicable_regexps:
             if regexp.search(line):
                 errors.append((regexp.error, regexp.description, path, i+1))
 
     return errors
 
+
 def check_parsed(repo_root, path, f):
     source_file = SourceFile(repo_root, path, "/", contents=f.read())
 
@@ -484,10 +580,9 @@ def check_parsed(repo_root, path, f):
 
         assert ref_parts.path != ""
 
-        reference_file = os.path.join(repo_root, ref_parts.path[1:])
         reference_rel = reftest_node.attrib.get("rel", "")
 
-        if not os.path.isfile(reference_file):
+        if not is_file(repo_root, ref_parts.path[1:]):
             errors.append(("NON-EXISTENT-REF",
                      "Reference test with a non-existent '%s' relationship reference: '%s'" % (reference_rel, href), path, None))
 
@@ -789,18 +884,19 @@ def changed_files(wpt_root):
 
 
 def lint_paths(kwargs, wpt_root):
+    cache_root = kwargs.get("cache_root")
     if kwargs.get("paths"):
         paths = []
         for path in kwargs.get("paths"):
             if os.path.isdir(path):
-                path_dir = list(all_filesystem_paths(wpt_root, path))
+                path_dir = list(all_filesystem_paths(wpt_root, path, cache_root))
                 paths.extend(path_dir)
             elif os.path.isfile(path):
                 paths.append(os.path.relpath(os.path.abspath(path), wpt_root))
 
 
     elif kwargs["all"]:
-        paths = list(all_filesystem_paths(wpt_root))
+        paths = list(all_filesystem_paths(wpt_root, cache_root=cache_root))
     else:
         changed_paths = changed_files(wpt_root)
         force_all = False
@@ -810,7 +906,7 @@ def lint_paths(kwargs, wpt_root):
                 force_all = True
                 break
         paths = (list(changed_paths) if not force_all
-                 else list(all_filesystem_paths(wpt_root)))
+                 else list(all_filesystem_paths(wpt_root, cache_root=cache_root)))
 
     return paths
 
@@ -827,6 +923,12 @@ def create_parser():
                         "option if the lint script exists outside the repository")
     parser.add_argument("--all", action="store_true", help="If no paths are passed, try to lint the whole "
                         "working directory, not just files that changed")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes to use when linting files (default 1)")
+    parser.add_argument("--cache-root", help="Path in which to store the cache of lint results "
+                        "(default <repo-root>/.wptcache/)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Lint every file rather than using cached results for unchanged files")
     return parser
 
 
@@ -844,17 +946,205 @@ def main(**kwargs):
     if output_format == "markdown":
         setup_logging(True)
 
+    cache_root = None
+    if not kwargs.get("no_cache"):
+        cache_root = kwargs.get("cache_root") or default_cache_root(repo_root)
+        # Make sure git ignores an existing cache before finding the
+        # changed files
+        ensure_cache_root(cache_root)
+
     paths = lint_paths(kwargs, repo_root)
 
-    return lint(repo_root, paths, output_format)
+    return lint(repo_root, paths, output_format, jobs=kwargs.get("jobs", 1),
+                cache_root=cache_root)
 
 
-def lint(repo_root, paths, output_format):
+def lint_version():
+    """
+    Gets an identifier for the current lint rules, which changes whenever
+    the code of the lint or of the manifest code it uses to parse files
+    changes, or when running with a different version of Python or
+    html5lib.
+
+    :returns: a hex string
+    """
+
+    sha1 = hashlib.sha1(("%s.%s %s" % (sys.version_info[0], sys.version_info[1],
+                                       html5lib.__version__)).encode("ascii"))
+    here = os.path.dirname(os.path.abspath(__file__))
+    for dir_path in [here, os.path.join(here, os.pardir, "manifest")]:
+        for name in sorted(os.listdir(dir_path)):
+            if name.endswith(".py"):
+                with open(os.path.join(dir_path, name), "rb") as f:
+                    sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+class LintCache(CacheFile):
+    """
+    Cache of the errors from the file contents lints for each file.
+
+    Entries are keyed on the git blob hash of the file's contents, so a
+    file is only linted again when it changes, or when a file it refers
+    to is added or removed. The errors are stored before whitelist
+    filtering, so editing the whitelist doesn't invalidate them. The
+    whole cache is dropped when the result of :func:`lint_version`
+    changes. The properties of the files that are parsed are kept in
+    the same metadata cache as the manifest uses.
+    """
+
+    file_name = "lint.json"
+
+    def __init__(self, cache_root, repo_root, rebuild=False):
+        self.version = lint_version()
+        self.hash_cache = HashCache(cache_root, repo_root, rebuild)
+        self.metadata_cache = MetadataCacheFile(cache_root, repo_root, rebuild,
+                                                SourceFile.metadata_cache)
+        # Hash of each file when it was looked up
+        self._hashes = {}
+        super(LintCache, self).__init__(cache_root, repo_root, rebuild=rebuild)
+
+    def check_valid(self, data):
+        if (data.get("/tests_root") != self.tests_root or
+            data.get("/version") != self.version):
+            self.modified = True
+            data = {}
+        return data
+
+    def get(self, path):
+        """
+        Gets the cached errors for a file.
+
+        :param path: the path of the file within the repository
+        :returns: a list of error tuples, or None if the file has to be
+                  linted again
+        """
+
+        try:
+            file_hash = self.hash_cache.hash(path)
+        except (IOError, OSError):
+            return None
+        self._hashes[path] = file_hash
+        entry = self.data.get(path)
+        if entry is None or entry[0] != file_hash:
+            return None
+        _, errors, checked_files = entry
+        for rel_path, exists in iteritems(checked_files):
+            if os.path.isfile(os.path.join(self.tests_root, rel_path)) != exists:
+                return None
+        return [tuple(error) for error in errors]
+
+    def set(self, path, errors, checked_files):
+        """
+        Stores the errors for a file that was looked up with :meth:`get`.
+
+        :param path: the path of the file within the repository
+        :param errors: a list of error tuples
+        :param checked_files: a dict of {path: exists} for the other files
+                              that the errors depend on
+        """
+
+        file_hash = self._hashes.get(path)
+        if file_hash is None:
+            return
+        self.data[path] = [file_hash, errors, checked_files]
+        self.modified = True
+
+    def dump(self):
+        self.data["/tests_root"] = self.tests_root
+        self.data["/version"] = self.version
+        super(LintCache, self).dump()
+        self.hash_cache.dump()
+        self.metadata_cache.dump()
+
+
+def lint_file(args):
+    """
+    Runs the per-file lints for a single path.
+
+    :param args: a tuple of the repository root, the path of the file
+                 within the repository, and whether to check the file
+                 contents
+    :returns: a tuple of the errors from the path lints, the errors from
+              the file contents lints, or None if they weren't checked,
+              and a dict of {path: exists} for the other files that the
+              file contents errors depend on
+    """
+
+    global _checked_files
+
+    repo_root, path, check_contents = args
+    path_errors = check_path(repo_root, path)
+    contents_errors = None
+    checked_files = {}
+    abs_path = os.path.join(repo_root, path)
+    if os.path.isdir(abs_path):
+        contents_errors = []
+    elif check_contents:
+        _checked_files = checked_files
+        try:
+            with open(abs_path, 'rb') as f:
+                contents_errors = check_file_contents(repo_root, path, f)
+        finally:
+            _checked_files = None
+    return path_errors, contents_errors, checked_files
+
+
+def lint_files(repo_root, paths, jobs=1, cache=None):
+    """
+    Runs the per-file lints for each path, optionally in several processes.
+
+    :param repo_root: the repository root
+    :param paths: a list of paths within the repository
+    :param jobs: the number of processes to use
+    :param cache: a :class:`LintCache` to use for the file contents
+                  errors, or None
+    :returns: an iterator over (path errors, file contents errors) for
+              each path, in the same order as ``paths``
+    """
+
+    cached = {}
+    if cache is not None:
+        for path in paths:
+            errors = cache.get(path)
+            if errors is not None:
+                cached[path] = errors
+
+    work = [(repo_root, path, path not in cached) for path in paths]
+    if not jobs or jobs <= 1 or len(work) <= 1:
+        results = (lint_file(item) for item in work)
+        pool = None
+    else:
+        chunksize = max(1, min(64, len(work) // (jobs * 4)))
+        pool = multiprocessing.Pool(min(jobs, len(work)))
+        results = pool.imap(lint_file, work, chunksize)
+
+    try:
+        for path, (path_errors, contents_errors, checked_files) in zip(paths, results):
+            if contents_errors is None:
+                contents_errors = cached[path]
+            elif cache is not None and path not in cached:
+                cache.set(path, contents_errors, checked_files)
+            yield path_errors, contents_errors
+        if pool is not None:
+            pool.close()
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+
+
+def lint(repo_root, paths, output_format, jobs=1, cache_root=None):
     error_count = defaultdict(int)
     last = None
 
     with open(os.path.join(repo_root, "lint.whitelist")) as f:
         whitelist, ignored_files = parse_whitelist(f)
+    whitelist = CompiledWhitelist(whitelist)
+    ignored_re = fnmatch.compile_patterns(ignored_files) if ignored_files else None
 
     output_errors = {"json": output_errors_json,
                      "markdown": output_errors_markdown,
@@ -880,26 +1170,19 @@ def lint(repo_root, paths, output_format):
 
         return (errors[-1][0], path)
 
-    for path in paths[:]:
-        abs_path = os.path.join(repo_root, path)
-        if not os.path.exists(abs_path):
-            paths.remove(path)
-            continue
-
-        if any(fnmatch.fnmatch(path, file_match) for file_match in ignored_files):
-            paths.remove(path)
-            continue
+    paths = [path for path in paths
+             if os.path.exists(os.path.join(repo_root, path)) and
+             not (ignored_re is not None and ignored_re.match(os.path.normcase(path)))]
 
-        errors = check_path(repo_root, path)
-        last = process_errors(errors) or last
-
-        if not os.path.isdir(abs_path):
-            with open(abs_path, 'rb') as f:
-                errors = check_file_contents(repo_root, path, f)
-                last = process_errors(errors) or last
+    cache = LintCache(cache_root, repo_root) if cache_root is not None else None
+    for path_errors, contents_errors in lint_files(repo_root, paths, jobs, cache):
+        last = process_errors(path_errors) or last
+        last = process_errors(contents_errors) or last
 
     errors = check_all_paths(repo_root, paths)
     last = process_errors(errors) or last
+    if cache is not None:
+        cache.dump()
 
     if output_format in ("normal", "markdown"):
         output_error_count(error_count)
@@ -87,6 +87,27 @@ def test_cr_at_eol():
         assert errors == expected
 
 
+def test_multiple_line_errors():
+    content = b"\tconsole.log(1); \nok\n\tsetTimeout(f);\r\n"
+    errors = check_file_contents("", os.path.join("html", "test.js"), six.BytesIO(content))
+    check_errors(errors)
+    filename = os.path.join("html", "test.js")
+    assert errors == [
+        ("TRAILING WHITESPACE", "Whitespace at EOL", filename, 1),
+        ("INDENT TABS", "Tabs used for indentation", filename, 1),
+        ("CONSOLE", "Console logging API used", filename, 1),
+        ("INDENT TABS", "Tabs used for indentation", filename, 3),
+        ("CR AT EOL", "CR character in line separator", filename, 3),
+        ("SET TIMEOUT", "setTimeout used; step_timeout should typically be used instead",
+         filename, 3),
+    ]
+
+    # Rules that don't apply to the file type aren't reported
+    errors = check_file_contents("", os.path.join("html", "test.py"), six.BytesIO(content))
+    assert [error[0] for error in errors] == ["TRAILING WHITESPACE", "INDENT TABS",
+                                              "INDENT TABS", "CR AT EOL", "PARSE-FAILED"]
+
+
 def test_w3c_test_org():
     error_map = check_with_files(b"import('http://www.w3c-test.org/')")
 
@@ -1,13 +1,14 @@
 from __future__ import unicode_literals
 
 import os
+import shutil
 import sys
 
 import mock
 import six
 
 from ...localpaths import repo_root
-from .. import lint as lint_mod
+from .. import fnmatch, lint as lint_mod
 from ..lint import filter_whitelist_errors, parse_whitelist, lint, create_parser
 
 _dummy_repo = os.path.join(os.path.dirname(__file__), "dummy")
@@ -53,6 +54,17 @@ def test_filter_whitelist_errors():
     assert filtered == [['INDENT TABS', '', unfilteredfile, 11]]
 
 
+def test_compile_patterns():
+    patterns = ["svg/*", "*.pdf", "html/test?.js", "a/[!b]*", "exact.html", "dir/*/x.js"]
+    names = ["svg/test.html", "svg", "test.pdf", "a/test.pdf.js", "html/test1.js",
+             "html/test12.js", "a/c", "a/b", "exact.html", "exact.htm", "dir/a/b/x.js",
+             "dir/x.js", "svg/a\nb"]
+    regexp = fnmatch.compile_patterns(patterns)
+    for name in names:
+        expected = any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+        assert bool(regexp.match(name)) == expected, name
+
+
 def test_parse_whitelist():
     input_buffer = six.StringIO("""
 # Comment
@@ -155,6 +167,62 @@ def test_lint_failing(caplog):
     assert "broken.html:1" in caplog.text
 
 
+def test_lint_jobs(capsys):
+    paths = ["okay.html", "broken.html", "ref/absolute.html", "ref/same_file_path.html",
+             "css"]
+    serial_paths = paths[:]
+    rv = lint(_dummy_repo, serial_paths, "json")
+    assert rv == 3
+    assert serial_paths == paths
+    serial_output = capsys.readouterr()[0]
+    assert "broken.html" in serial_output
+    with mock.patch.object(lint_mod, "multiprocessing", wraps=lint_mod.multiprocessing) as mp:
+        assert lint(_dummy_repo, paths[:], "json", jobs=2) == rv
+        assert mp.Pool.called
+    assert capsys.readouterr()[0] == serial_output
+
+
+def test_lint_cache(tmpdir, capsys):
+    dummy_repo = str(tmpdir.join("dummy"))
+    shutil.copytree(_dummy_repo, dummy_repo)
+    cache_root = str(tmpdir.join("cache"))
+    paths = ["okay.html", "broken.html", "ref/non_existent_relative.html", "css"]
+
+    assert lint(dummy_repo, paths, "json", cache_root=cache_root) == 2
+    output = capsys.readouterr()[0]
+    assert "NON-EXISTENT-REF" in output
+
+    with _mock_lint("check_file_contents") as mocked_check_file_contents:
+        assert lint(dummy_repo, paths, "json", cache_root=cache_root) == 2
+        assert not mocked_check_file_contents.called
+    assert capsys.readouterr()[0] == output
+
+    # Errors are cached before they're filtered by the whitelist
+    with open(os.path.join(dummy_repo, "lint.whitelist"), "a") as f:
+        f.write("TRAILING WHITESPACE:broken.html\n")
+    with _mock_lint("check_file_contents") as mocked_check_file_contents:
+        assert lint(dummy_repo, paths, "json", cache_root=cache_root) == 1
+        assert not mocked_check_file_contents.called
+
+    # Adding the missing reference means the file is linted again
+    open(os.path.join(dummy_repo, "ref", "non_existent_file.html"), "w").close()
+    with _mock_lint("check_file_contents") as mocked_check_file_contents:
+        assert lint(dummy_repo, paths, "json", cache_root=cache_root) == 0
+        assert mocked_check_file_contents.call_count == 1
+
+    with open(os.path.join(dummy_repo, "okay.html"), "a") as f:
+        f.write("trailing whitespace \n")
+    with _mock_lint("check_file_contents") as mocked_check_file_contents:
+        assert lint(dummy_repo, paths, "json", cache_root=cache_root) == 1
+        assert mocked_check_file_contents.call_count == 1
+
+    # Changing the lint code invalidates every entry
+    with _mock_lint("lint_version", return_value="0"):
+        with _mock_lint("check_file_contents") as mocked_check_file_contents:
+            assert lint(dummy_repo, paths, "json", cache_root=cache_root) == 1
+            assert mocked_check_file_contents.call_count == 3
+
+
 def test_ref_existent_relative(caplog):
     with _mock_lint("check_path") as mocked_check_path:
         with _mock_lint("check_file_contents") as mocked_check_file_contents:
@@ -415,6 +483,22 @@ def test_all_filesystem_paths():
                        os.path.join('dir_a', 'file_d')]
 
 
+def test_all_filesystem_paths_cache(tmpdir):
+    for path in ["file_a", "dir_a/file_b", ".wptcache/lint.json", "cache/lint.json"]:
+        tmpdir.join(path).write("", ensure=True)
+    repo_root = str(tmpdir)
+
+    assert sorted(lint_mod.all_filesystem_paths(repo_root)) == [
+        "cache/lint.json".replace("/", os.path.sep),
+        "dir_a/file_b".replace("/", os.path.sep),
+        "file_a"]
+    assert sorted(lint_mod.all_filesystem_paths(repo_root,
+                                                cache_root=os.path.join(repo_root, "cache"))) == [
+        ".wptcache/lint.json".replace("/", os.path.sep),
+        "dir_a/file_b".replace("/", os.path.sep),
+        "file_a"]
+
+
 def test_filesystem_paths_subdir():
     with mock.patch(
             'tools.lint.lint.walk',
@@ -443,7 +527,8 @@ def test_main_with_args():
                 m.assert_called_once_with(repo_root,
                                           [os.path.relpath(os.path.join(os.getcwd(), x), repo_root)
                                            for x in ['a', 'b', 'c']],
-                                          "normal")
+                                          "normal", jobs=1,
+                                          cache_root=os.path.join(repo_root, ".wptcache"))
     finally:
         sys.argv = orig_argv
 
@@ -455,7 +540,8 @@ def test_main_no_args():
         with _mock_lint('lint', return_value=True) as m:
             with _mock_lint('changed_files', return_value=['foo', 'bar']):
                 lint_mod.main(**vars(create_parser().parse_args()))
-                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal")
+                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal", jobs=1,
+                                          cache_root=os.path.join(repo_root, ".wptcache"))
     finally:
         sys.argv = orig_argv
 
@@ -467,6 +553,7 @@ def test_main_all():
         with _mock_lint('lint', return_value=True) as m:
             with _mock_lint('all_filesystem_paths', return_value=['foo', 'bar']):
                 lint_mod.main(**vars(create_parser().parse_args()))
-                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal")
+                m.assert_called_once_with(repo_root, ['foo', 'bar'], "normal", jobs=1,
+                                          cache_root=os.path.join(repo_root, ".wptcache"))
     finally:
         sys.argv = orig_argv
@@ -0,0 +1,100 @@
+"""Benchmark loading a manifest in the JSON and compact formats.
+
+Writes the manifest in each format to a temporary directory, then times
+loading it and listing the testharness tests, which is what a test run
+restricted to testharness tests does. Without --manifest a synthetic
+manifest is used, with roughly the proportions of each item type in the
+upstream repository.
+
+Run as::
+
+  python tools/manifest/benchmarks/load.py [--manifest PATH] [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, os.path.abspath(os.path.join(here, os.pardir, os.pardir)))
+
+import localpaths  # noqa: F401
+from manifest import manifest
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--manifest",
+                        help="Path to an existing manifest in either format")
+    parser.add_argument("--files", type=int, default=20000,
+                        help="Number of testharness files in the synthetic manifest")
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="Number of times to load each manifest")
+    return parser
+
+
+def synthetic_manifest(files):
+    items = {"testharness": {}, "reftest": {}, "reftest_node": {}, "support": {}}
+    paths = {}
+    for i in range(files):
+        dir_name = "dir%i/sub%i" % (i // 500, i // 50)
+        path = "%s/test%i.html" % (dir_name, i)
+        items["testharness"][path] = [["/%s?%i" % (path, j), {"timeout": "long"}]
+                                      for j in range(1 + i % 3)]
+        paths[path] = ["%040x" % i, "testharness"]
+
+        path = "%s/reftest%i.html" % (dir_name, i)
+        ref = "%s/reftest%i-ref.html" % (dir_name, i)
+        items["reftest"][path] = [["/" + path, [["/" + ref, "=="]], {}]]
+        paths[path] = ["%040x" % i, "reftest"]
+        items["reftest_node"][ref] = [["/" + ref, [], {}]]
+        paths[ref] = ["%040x" % i, "reftest_node"]
+
+        for j in range(3):
+            path = "%s/support%i-%i.js" % (dir_name, i, j)
+            items["support"][path] = [[None, {}]]
+            paths[path] = ["%040x" % i, "support"]
+    return manifest.Manifest.from_json(localpaths.repo_root,
+                                       {"version": manifest.CURRENT_VERSION,
+                                        "url_base": "/",
+                                        "paths": paths,
+                                        "items": items})
+
+
+def load_testharness(path):
+    m = manifest.load(localpaths.repo_root, path, types=["testharness"])
+    return sum(1 for _ in m.itertypes("testharness"))
+
+
+def run(manifest_path, files, repeat):
+    if manifest_path is not None:
+        m = manifest.load(localpaths.repo_root, manifest_path)
+    else:
+        m = synthetic_manifest(files)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for name, compact_format in [("json", False), ("compact", True)]:
+            path = os.path.join(tmp_dir, "MANIFEST.%s" % name)
+            manifest.write(m, path, compact_format=compact_format)
+            start = time.time()
+            for _ in range(repeat):
+                count = load_testharness(path)
+            elapsed = time.time() - start
+            print("%s: %i bytes, %i testharness files, %.1fms/load" %
+                  (name, os.path.getsize(path), count, 1000 * elapsed / repeat))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def main():
+    kwargs = vars(get_parser().parse_args())
+    run(kwargs["manifest"], kwargs["files"], kwargs["repeat"])
+
+
+if __name__ == "__main__":
+    main()
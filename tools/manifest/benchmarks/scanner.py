@@ -0,0 +1,77 @@
+"""Benchmark classifying HTML files with and without the metadata scanner.
+
+Runs SourceFile.manifest_items() over every HTML file under a tests root,
+once using the streaming scanner (falling back to a full parse where it
+can't be used) and once always building the full tree.
+
+Run as::
+
+  python tools/manifest/benchmarks/scanner.py [--tests-root PATH] [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, os.path.abspath(os.path.join(here, os.pardir, os.pardir)))
+
+import localpaths  # noqa: F401
+from manifest import scanner
+from manifest.sourcefile import SourceFile
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tests-root", default=localpaths.repo_root,
+                        help="Directory containing the files to classify")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of times to classify each file")
+    return parser
+
+
+def html_files(tests_root):
+    for dir_path, dir_names, file_names in os.walk(tests_root):
+        dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1] in (".html", ".htm"):
+                yield os.path.relpath(os.path.join(dir_path, file_name), tests_root)
+
+
+def classify(tests_root, paths, contents, use_scanner):
+    for rel_path in paths:
+        source_file = SourceFile(tests_root, rel_path, "/", contents=contents[rel_path])
+        source_file.use_scanner = use_scanner
+        # Use the content-based checks even for files in support directories
+        source_file.in_non_test_dir = lambda: False
+        source_file.manifest_items()
+
+
+def run(tests_root, repeat):
+    paths = sorted(html_files(tests_root))
+    contents = {}
+    for rel_path in paths:
+        with open(os.path.join(tests_root, rel_path), "rb") as f:
+            contents[rel_path] = f.read()
+
+    fallback = sum(1 for rel_path in paths if scanner.scan(contents[rel_path]) is None)
+    print("%i files, %i need a full parse" % (len(paths), fallback))
+
+    for name, use_scanner in [("full parse", False), ("scanner", True)]:
+        start = time.time()
+        for _ in range(repeat):
+            classify(tests_root, paths, contents, use_scanner)
+        elapsed = time.time() - start
+        print("%s: %.2fs, %.3fms/file" % (name, elapsed, 1000 * elapsed / (repeat * len(paths))))
+
+
+def main():
+    kwargs = vars(get_parser().parse_args())
+    run(**kwargs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Compact on-disk format for manifests.
+
+The JSON manifest has to be parsed in full before anything can be read
+from it, even when only one type of test is needed. This format stores
+the same data as a series of sections, each of which is a JSON document
+preceded by its length as a 4-byte big-endian integer, after a fixed
+magic string:
+
+ ``meta``
+   Dict with the ``version``, ``url_base`` and ``commit`` of the
+   manifest and the list of the names of the following sections.
+
+ ``paths``
+   Sorted list of every path in the manifest, in the same form as in
+   the JSON format. Other sections refer to paths by their index in
+   this list.
+
+ ``hashes``
+   List of ``[hash, item_type]`` for each path in the path table, or
+   null for paths that don't have a hash.
+
+ ``items/<item_type>``
+   List of ``[path_index, items]`` for each path with items of the
+   given type, where ``items`` is the list from the JSON format.
+
+Since the sections are length-prefixed the file can be memory-mapped
+and each section parsed only when it is needed.
+"""
+
+import mmap
+import struct
+
+from six import iteritems, itervalues, text_type
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+MAGIC = b"WPTMANIFEST\x00"
+
+_length = struct.Struct(">I")
+
+_items_prefix = "items/"
+
+
+def is_compact(data):
+    """Check if the start of a file is in the compact format.
+
+    :param data: Bytes from the start of a file"""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def is_compact_file(path):
+    try:
+        with open(path, "rb") as f:
+            return is_compact(f.read(len(MAGIC)))
+    except IOError:
+        return False
+
+
+def _section(obj):
+    data = json.dumps(obj)
+    if isinstance(data, text_type):
+        data = data.encode("utf8")
+    return _length.pack(len(data)) + data
+
+
+def dumps(obj):
+    """Convert a manifest in JSON form to the compact format.
+
+    :param obj: Manifest as returned by Manifest.to_json()
+    :returns: Bytes of the compact manifest"""
+    paths = set(obj["paths"])
+    for type_paths in itervalues(obj["items"]):
+        paths |= set(type_paths)
+    paths = sorted(paths)
+    path_index = {path: i for i, path in enumerate(paths)}
+
+    hashes = [obj["paths"].get(path) for path in paths]
+
+    item_types = sorted(obj["items"])
+    names = ["paths", "hashes"] + [_items_prefix + item_type for item_type in item_types]
+    meta = {"version": obj.get("version"),
+            "url_base": obj.get("url_base", "/"),
+            "commit": obj.get("commit"),
+            "sections": names}
+
+    parts = [MAGIC, _section(meta), _section(paths), _section(hashes)]
+    for item_type in item_types:
+        type_paths = obj["items"][item_type]
+        parts.append(_section(sorted([path_index[path], items]
+                                     for path, items in iteritems(type_paths))))
+    return b"".join(parts)
+
+
+def loads(data):
+    """Convert a manifest in the compact format to its JSON form.
+
+    :param data: Bytes of the compact manifest
+    :returns: Manifest in the form returned by Manifest.to_json()"""
+    reader = Reader(data)
+    rv = {"version": reader.meta["version"],
+          "url_base": reader.meta["url_base"],
+          "paths": reader.path_hash(),
+          "items": {item_type: reader.items(item_type)
+                    for item_type in reader.item_types()}}
+    if reader.meta.get("commit") is not None:
+        rv["commit"] = reader.meta["commit"]
+    return rv
+
+
+class Reader(object):
+    """Read sections of a compact manifest on demand.
+
+    :param data: Bytes or mmap of the manifest, starting with MAGIC
+
+    Each section can be read once. If data is an mmap it's closed once
+    every section has been either read or skipped."""
+
+    def __init__(self, data):
+        if not is_compact(data):
+            raise ValueError("Not a compact manifest")
+        self._data = data
+        self._offsets = []
+        pos = len(MAGIC)
+        while pos < len(data):
+            if pos + _length.size > len(data):
+                raise ValueError("Truncated section length")
+            length, = _length.unpack(data[pos:pos + _length.size])
+            start = pos + _length.size
+            pos = start + length
+            if pos > len(data):
+                raise ValueError("Truncated section")
+            self._offsets.append((start, pos))
+
+        if not self._offsets:
+            raise ValueError("Missing meta section")
+        self.meta = self._load(0)
+        names = self.meta["sections"]
+        if len(names) != len(self._offsets) - 1:
+            raise ValueError("Expected %i sections, got %i" % (len(names) + 1,
+                                                               len(self._offsets)))
+        self._sections = {name: i + 1 for i, name in enumerate(names)}
+        self._unread = set(names)
+        self._paths = None
+
+    def _load(self, index):
+        start, end = self._offsets[index]
+        return json.loads(self._data[start:end].decode("utf8"))
+
+    def _read(self, name):
+        try:
+            self._unread.remove(name)
+        except KeyError:
+            raise ValueError("Section %s already read or missing" % name)
+        rv = self._load(self._sections[name])
+        self._maybe_close()
+        return rv
+
+    def _maybe_close(self):
+        if not self._unread and isinstance(self._data, mmap.mmap):
+            self._data.close()
+            self._data = None
+
+    def skip(self, name):
+        """Mark a section as not going to be read."""
+        self._unread.discard(name)
+        self._maybe_close()
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            self._paths = self._read("paths")
+        return self._paths
+
+    def item_types(self):
+        return [name[len(_items_prefix):] for name in self.meta["sections"]
+                if name.startswith(_items_prefix)]
+
+    def path_hash(self):
+        """Get a dict of {path: [hash, item_type]}"""
+        return {path: value for path, value in zip(self.paths, self._read("hashes"))
+                if value is not None}
+
+    def items(self, item_type):
+        """Get a dict of {path: items} for a single item type"""
+        paths = self.paths
+        return {paths[path_index]: items
+                for path_index, items in self._read(_items_prefix + item_type)}
+
+    def skip_items(self, item_type):
+        self.skip(_items_prefix + item_type)
+
+
+def load_file(f):
+    """Create a Reader for an open binary file, memory-mapping it where
+    possible."""
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError):
+        # Not a real file, or it can't be mapped
+        f.seek(0)
+        data = f.read()
+    return Reader(data)
@@ -1,13 +1,20 @@
 import itertools
+import multiprocessing
 import os
+import platform
+import tempfile
+from bisect import bisect_left
 from collections import defaultdict
+from functools import partial
 from six import iteritems, iterkeys, itervalues, string_types
+from six.moves.urllib.parse import urljoin
 
-from . import vcs
+from . import compact, vcs
 from .item import (ManualTest, WebDriverSpecTest, Stub, RefTestNode, RefTest,
                    TestharnessTest, SupportFile, ConformanceCheckerTest, VisualTest)
 from .log import get_logger
-from .utils import from_os_path, to_os_path
+from .sourcefile import SourceFile
+from .utils import from_os_path, rel_path_to_url, to_os_path
 
 try:
     import ujson as json
@@ -25,6 +32,62 @@ class ManifestVersionMismatch(ManifestError):
     pass
 
 
+class ReftestGraph(object):
+    """Index of the references between reftest-type items.
+
+    For each path this records the url of each item and the urls it
+    refers to, along with the number of references to each url and the
+    paths with an item at each url. Adding or removing the items for a
+    path returns the urls whose items changed from being referenced to
+    not being referenced or vice versa, which are the only ones that
+    have to be reclassified as reftests or reftest nodes."""
+
+    def __init__(self):
+        self.path_edges = {}
+        self.inbound = defaultdict(int)
+        self.url_paths = defaultdict(set)
+
+    def has_inbound(self, url):
+        return url in self.inbound
+
+    def add(self, rel_path, edges):
+        """Add the items for a path.
+
+        :param rel_path: Path of the file containing the items
+        :param edges: List of (url, ref_urls) for each item
+        :returns: Set of urls that went from having no references to
+                  having some"""
+        assert rel_path not in self.path_edges
+        self.path_edges[rel_path] = edges
+        flipped = set()
+        for url, ref_urls in edges:
+            self.url_paths[url].add(rel_path)
+            for ref_url in ref_urls:
+                if ref_url not in self.inbound:
+                    flipped.add(ref_url)
+                self.inbound[ref_url] += 1
+        return flipped
+
+    def remove(self, rel_path):
+        """Remove the items for a path, if any.
+
+        :returns: Set of urls that no longer have any references"""
+        edges = self.path_edges.pop(rel_path, [])
+        flipped = set()
+        for url, ref_urls in edges:
+            paths = self.url_paths.get(url)
+            if paths is not None:
+                paths.discard(rel_path)
+                if not paths:
+                    del self.url_paths[url]
+            for ref_url in ref_urls:
+                self.inbound[ref_url] -= 1
+                if not self.inbound[ref_url]:
+                    del self.inbound[ref_url]
+                    flipped.add(ref_url)
+        return flipped
+
+
 def iterfilter(filters, iter):
     for f in filters:
         iter = f(iter)
@@ -54,21 +117,45 @@ class TypeData(object):
         subclass when the test is accessed. In order to remain
         API-compatible with consumers that depend on getting an Item
         from iteration, we do egerly load all items when iterating
-        over the class."""
+        over the values of the class.
+
+        Membership tests and iterating over the paths only need the
+        keys, so don't load any items. A sorted list of the paths is
+        built on first use and kept until the set of paths changes, to
+        allow iterating in order and querying subdirectories without
+        looking at every path.
+
+        For compact manifests the raw json itself is only read when the
+        type is first accessed."""
         self.manifest = manifest
         self.type_cls = type_cls
-        self.json_data = {}
+        self._json_data = {}
+        self._json_loader = None
         self.tests_root = None
         self.data = {}
         self.meta_filters = meta_filters or []
+        self._sorted_paths = None
 
     def __getitem__(self, key):
         if key not in self.data:
             self.load(key)
         return self.data[key]
 
+    @property
+    def json_data(self):
+        if self._json_loader is not None:
+            loader = self._json_loader
+            self._json_loader = None
+            self._json_data = loader()
+        return self._json_data
+
+    @json_data.setter
+    def json_data(self, value):
+        self._json_loader = None
+        self._json_data = value
+
     def __bool__(self):
-        return bool(self.data)
+        return bool(self.data) or bool(self.json_data)
 
     def __len__(self):
         rv = len(self.data)
@@ -77,18 +164,31 @@ class TypeData(object):
         return rv
 
     def __delitem__(self, key):
-        del self.data[key]
+        if key in self.data:
+            del self.data[key]
+        elif self.json_data is not None:
+            del self.json_data[from_os_path(key)]
+        else:
+            raise KeyError(key)
+        self._sorted_paths = None
 
     def __setitem__(self, key, value):
+        if key not in self:
+            self._sorted_paths = None
         self.data[key] = value
 
     def __contains__(self, key):
-        self.load_all()
-        return key in self.data
+        if key in self.data:
+            return True
+        if not self.json_data:
+            return False
+        try:
+            return from_os_path(key) in self.json_data
+        except ValueError:
+            return False
 
     def __iter__(self):
-        self.load_all()
-        return self.data.__iter__()
+        return iter(self.sorted_paths())
 
     def pop(self, key, default=None):
         try:
@@ -97,6 +197,7 @@ class TypeData(object):
             value = default
         else:
             del self.data[key]
+            self._sorted_paths = None
         return value
 
     def get(self, key, default=None):
@@ -160,6 +261,14 @@ class TypeData(object):
             raise ValueError("Got a %s expected a dict" % (type(data)))
         self.tests_root = tests_root
         self.json_data = data
+        self._sorted_paths = None
+
+    def set_json_loader(self, tests_root, loader):
+        """Set a function returning the raw json for this type, to be
+        called when it's first needed"""
+        self.tests_root = tests_root
+        self._json_loader = loader
+        self._sorted_paths = None
 
     def paths(self):
         """Get a list of all paths containing items of this type,
@@ -169,6 +278,24 @@ class TypeData(object):
             rv |= set(to_os_path(item) for item in iterkeys(self.json_data))
         return rv
 
+    def sorted_paths(self):
+        """Get a sorted list of all paths containing items of this
+        type. The list is cached, so must not be modified."""
+        if self._sorted_paths is None:
+            self._sorted_paths = sorted(self.paths())
+        return self._sorted_paths
+
+    def iterdir(self, dir_name):
+        """Iterate in sorted order over the paths containing items of
+        this type that are under dir_name, which must end with a path
+        separator"""
+        paths = self.sorted_paths()
+        # All the paths with a given prefix are adjacent in sorted order
+        for i in range(bisect_left(paths, dir_name), len(paths)):
+            if not paths[i].startswith(dir_name):
+                break
+            yield paths[i]
+
 
 class ManifestData(dict):
     def __init__(self, manifest, meta_filters=None):
@@ -200,7 +327,25 @@ class Manifest(object):
         self._path_hash = {}
         self._data = ManifestData(self, meta_filters)
         self._reftest_nodes_by_url = None
+        self._reftest_graph = None
         self.url_base = url_base
+        # Commit the manifest was generated from, if it was built from git
+        self.commit = None
+
+    @property
+    def _path_hash(self):
+        # Only needed when updating or writing the manifest, so compact
+        # manifests don't read the hashes until then
+        if self._path_hash_loader is not None:
+            loader = self._path_hash_loader
+            self._path_hash_loader = None
+            self._path_hash_data = loader()
+        return self._path_hash_data
+
+    @_path_hash.setter
+    def _path_hash(self, value):
+        self._path_hash_loader = None
+        self._path_hash_data = value
 
     def __iter__(self):
         return self.itertypes()
@@ -209,23 +354,39 @@ class Manifest(object):
         if not types:
             types = sorted(self._data.keys())
         for item_type in types:
-            for path in sorted(self._data[item_type]):
-                tests = self._data[item_type][path]
-                yield item_type, path, tests
+            type_tests = self._data[item_type]
+            # Every item is going to be created anyway
+            type_tests.load_all()
+            for path in type_tests.sorted_paths():
+                yield item_type, path, type_tests[path]
+
+    def iterpaths(self, *types):
+        """Iterate over (item_type, path) in the same order as itertypes,
+        without loading the test items"""
+        if not types:
+            types = sorted(self._data.keys())
+        for item_type in types:
+            for path in self._data[item_type].sorted_paths():
+                yield item_type, path
+
+    def paths(self):
+        """Set of all the paths in the manifest, including those without any
+        items"""
+        return set(iterkeys(self._path_hash))
 
     def iterpath(self, path):
         for type_tests in self._data.values():
-            for test in type_tests.get(path, set()):
-                yield test
+            if path in type_tests:
+                for test in type_tests[path]:
+                    yield test
 
     def iterdir(self, dir_name):
         if not dir_name.endswith(os.path.sep):
             dir_name = dir_name + os.path.sep
         for type_tests in self._data.values():
-            for path, tests in type_tests.iteritems():
-                if path.startswith(dir_name):
-                    for test in tests:
-                        yield test
+            for path in type_tests.iterdir(dir_name):
+                for test in type_tests[path]:
+                    yield test
 
     @property
     def reftest_nodes_by_url(self):
@@ -239,27 +400,52 @@ class Manifest(object):
         return self._reftest_nodes_by_url
 
     def get_reference(self, url):
-        return self.reftest_nodes_by_url.get(url)
-
-    def update(self, tree):
+        if self._reftest_nodes_by_url is not None:
+            return self._reftest_nodes_by_url.get(url)
+
+        # Reftests and reftest nodes have the url of the file they come
+        # from, so rather than loading every reftest to build the index,
+        # only look at the items for the path corresponding to the url
+        url_prefix = rel_path_to_url("", self.url_base)
+        if not url.startswith(url_prefix):
+            return None
+        try:
+            path = to_os_path(url[len(url_prefix):])
+        except ValueError:
+            return None
+        for item_type in ("reftest", "reftest_node"):
+            type_tests = self._data[item_type]
+            if path in type_tests:
+                for node in type_tests[path]:
+                    if node.url == url:
+                        return node
+        return None
+
+    def update(self, tree, jobs=1):
         """Update the manifest given an iterable of items that make up the updated manifest.
 
         The iterable must either generate tuples of the form (SourceFile, True) for paths
         that are to be updated, or (path, False) for items that are not to be updated. This
         unusual API is designed as an optimistaion meaning that SourceFile items need not be
         constructed in the case we are not updating a path, but the absence of an item from
-        the iterator may be used to remove defunct entries from the manifest."""
-        reftest_nodes = []
+        the iterator may be used to remove defunct entries from the manifest.
+
+        :param jobs: Number of processes used to hash and classify the updated
+                     files. With more than one job the whole tree is read up front
+                     and the results are merged in tree order, so the resulting
+                     manifest is the same as for a serial update."""
+        # {path: items} for files of reftest types that changed, with
+        # None for files that are no longer of a reftest type
+        changed_reftests = {}
         seen_files = set()
 
         changed = False
-        reftest_changes = False
 
         prev_files = self._data.paths()
 
         reftest_types = ("reftest", "reftest_node")
 
-        for source_file, update in tree:
+        for source_file, update, classified in self._classify(tree, jobs):
             if not update:
                 rel_path = source_file
                 seen_files.add(rel_path)
@@ -267,7 +453,11 @@ class Manifest(object):
                 rel_path = source_file.rel_path
                 seen_files.add(rel_path)
 
-                file_hash = source_file.hash
+                if classified is None:
+                    file_hash = source_file.hash
+                    get_items = source_file.manifest_items
+                else:
+                    file_hash, get_items = classified
 
                 is_new = rel_path not in self._path_hash
                 hash_changed = False
@@ -275,39 +465,37 @@ class Manifest(object):
                 if not is_new:
                     old_hash, old_type = self._path_hash[rel_path]
                     if old_hash != file_hash:
-                        new_type, manifest_items = source_file.manifest_items()
+                        new_type, manifest_items = get_items()
                         hash_changed = True
                     else:
-                        new_type, manifest_items = old_type, self._data[old_type][rel_path]
-                    if old_type in reftest_types and new_type != old_type:
-                        reftest_changes = True
+                        new_type, manifest_items = old_type, None
+                    if old_type in reftest_types and new_type not in reftest_types:
+                        changed_reftests.setdefault(rel_path, None)
                 else:
-                    new_type, manifest_items = source_file.manifest_items()
-
-                if new_type in ("reftest", "reftest_node"):
-                    reftest_nodes.extend(manifest_items)
-                    if is_new or hash_changed:
-                        reftest_changes = True
-                elif new_type:
-                    self._data[new_type][rel_path] = set(manifest_items)
-
-                self._path_hash[rel_path] = (file_hash, new_type)
+                    new_type, manifest_items = get_items()
 
                 if is_new or hash_changed:
+                    if new_type in reftest_types:
+                        changed_reftests[rel_path] = manifest_items
+                    elif new_type:
+                        self._data[new_type][rel_path] = set(manifest_items)
                     changed = True
 
+                self._path_hash[rel_path] = (file_hash, new_type)
+
         deleted = prev_files - seen_files
         if deleted:
             changed = True
             for rel_path in deleted:
                 if rel_path in self._path_hash:
                     _, old_type = self._path_hash[rel_path]
-                    if old_type in reftest_types:
-                        reftest_changes = True
                     try:
                         del self._path_hash[rel_path]
                     except KeyError:
                         pass
+                    if old_type in reftest_types:
+                        changed_reftests[rel_path] = None
+                        continue
                     try:
                         del self._data[old_type][rel_path]
                     except KeyError:
@@ -317,42 +505,164 @@ class Manifest(object):
                         if rel_path in test_data:
                             del test_data[rel_path]
 
-        if reftest_changes:
-            reftests, reftest_nodes, changed_hashes = self._compute_reftests(reftest_nodes)
-            self._data["reftest"].data = reftests
-            self._data["reftest_node"].data = reftest_nodes
-            self._path_hash.update(changed_hashes)
+        if changed_reftests:
+            self._update_reftests(changed_reftests)
 
         return changed
 
-    def _compute_reftests(self, reftest_nodes):
-        self._reftest_nodes_by_url = {}
-        has_inbound = set()
-        for item in reftest_nodes:
-            for ref_url, ref_type in item.references:
-                has_inbound.add(ref_url)
-
-        reftests = defaultdict(set)
-        references = defaultdict(set)
-        changed_hashes = {}
-
-        for item in reftest_nodes:
-            if item.url in has_inbound:
-                # This is a reference
-                if isinstance(item, RefTest):
-                    item = item.to_RefTestNode()
-                    changed_hashes[item.source_file.rel_path] = (item.source_file.hash,
-                                                                 item.item_type)
-                references[item.source_file.rel_path].add(item)
+    def _classify(self, tree, jobs):
+        """Iterate over (source_file, update, classified) for each entry in tree.
+
+        In the serial case classified is always None and the SourceFile is
+        hashed and classified lazily by the caller. Otherwise it is None for
+        entries that aren't updated, and a tuple of (hash, manifest_items) for
+        the others, where manifest_items is a function returning the
+        (item_type, items) pair computed in a worker process."""
+        if not jobs or jobs <= 1:
+            for source_file, update in tree:
+                yield source_file, update, None
+            return
+
+        entries = list(tree)
+        work = [(source_file.tests_root,
+                 source_file.rel_path,
+                 source_file.url_base,
+                 source_file._hash,
+                 source_file.contents,
+                 self._path_hash.get(source_file.rel_path, (None, None))[0])
+                for source_file, update in entries if update]
+        if not work:
+            for source_file, update in entries:
+                yield source_file, update, None
+            return
+
+        chunksize = max(1, min(256, len(work) // (jobs * 4)))
+        pool = multiprocessing.Pool(min(jobs, len(work)))
+        try:
+            results = pool.imap(_classify_source_file, work, chunksize)
+            for source_file, update in entries:
+                if not update:
+                    yield source_file, update, None
+                    continue
+                file_hash, data = next(results)
+                source_file._hash = file_hash
+                yield source_file, update, (file_hash,
+                                            partial(self._items_from_json,
+                                                    source_file, data))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _items_from_json(self, source_file, data):
+        """Recreate the items for a file classified in a worker process,
+        attached to the SourceFile in this process."""
+        item_type, items_json = data
+        cls = item_classes[item_type]
+        path = from_os_path(source_file.rel_path)
+        items = []
+        for obj in items_json:
+            manifest_item = cls.from_json(self, source_file.tests_root, path, obj)
+            manifest_item.source_file = source_file
+            items.append(manifest_item)
+        return item_type, items
+
+    def _get_reftest_graph(self):
+        """Get the graph of references between reftest-type items,
+        building it from the current items on first use."""
+        if self._reftest_graph is None:
+            graph = ReftestGraph()
+            edges = defaultdict(list)
+            for item_type in ("reftest", "reftest_node"):
+                type_tests = self._data[item_type]
+                for path, items in iteritems(type_tests.data):
+                    edges[path].extend((item.url, [ref_url for ref_url, _ in item.references])
+                                       for item in items)
+                # Read the references from the json so that items don't
+                # have to be created for files that aren't affected
+                for path, items in iteritems(type_tests.json_data or {}):
+                    edges[to_os_path(path)].extend(
+                        (urljoin(self.url_base, obj[0]), [ref_url for ref_url, _ in obj[1]])
+                        for obj in iterfilter(type_tests.meta_filters, items))
+            for path, path_edges in iteritems(edges):
+                graph.add(path, path_edges)
+            self._reftest_graph = graph
+        return self._reftest_graph
+
+    def _update_reftests(self, changed_reftests):
+        """Update the reftest and reftest_node items for a set of
+        changed files.
+
+        An item is a reftest_node if any other item refers to its url,
+        and a reftest otherwise. Besides the changed files themselves,
+        only files with an item whose url gained its first reference or
+        lost its last one need to be reclassified.
+
+        :param changed_reftests: Dict of {path: items} for the changed
+                                 files, where items is None for files
+                                 that are no longer of a reftest type"""
+        graph = self._get_reftest_graph()
+        reftests = self._data["reftest"]
+        reftest_nodes = self._data["reftest_node"]
+        by_url = self._reftest_nodes_by_url
+
+        def pop_items(rel_path):
+            rv = []
+            for type_tests in (reftests, reftest_nodes):
+                if rel_path in type_tests:
+                    rv.extend(type_tests[rel_path])
+                    del type_tests[rel_path]
+            if by_url is not None:
+                for item in rv:
+                    if by_url.get(item.url) is item:
+                        del by_url[item.url]
+            return rv
+
+        flipped = set()
+        for rel_path, items in iteritems(changed_reftests):
+            flipped |= graph.remove(rel_path)
+            if by_url is not None:
+                pop_items(rel_path)
             else:
-                if isinstance(item, RefTestNode):
+                # Avoid creating the old items just to delete them
+                for type_tests in (reftests, reftest_nodes):
+                    if rel_path in type_tests:
+                        del type_tests[rel_path]
+            if items is not None:
+                flipped |= graph.add(rel_path, [(item.url,
+                                                 [ref_url for ref_url, _ in item.references])
+                                                for item in items])
+
+        affected = {rel_path: items for rel_path, items in iteritems(changed_reftests)
+                    if items is not None}
+        for url in flipped:
+            for rel_path in graph.url_paths.get(url, ()):
+                if rel_path not in affected:
+                    affected[rel_path] = pop_items(rel_path)
+
+        for rel_path, items in iteritems(affected):
+            path_reftests = set()
+            path_nodes = set()
+            for item in items:
+                if graph.has_inbound(item.url):
+                    item = item.to_RefTestNode()
+                    path_nodes.add(item)
+                else:
                     item = item.to_RefTest()
-                    changed_hashes[item.source_file.rel_path] = (item.source_file.hash,
-                                                                 item.item_type)
-                reftests[item.source_file.rel_path].add(item)
-            self._reftest_nodes_by_url[item.url] = item
-
-        return reftests, references, changed_hashes
+                    path_reftests.add(item)
+                if by_url is not None:
+                    by_url[item.url] = item
+            if path_reftests:
+                reftests[rel_path] = path_reftests
+            if path_nodes:
+                reftest_nodes[rel_path] = path_nodes
+            file_hash, item_type = self._path_hash[rel_path]
+            new_type = "reftest" if path_reftests else "reftest_node"
+            if (items and item_type in ("reftest", "reftest_node") and
+                item_type != new_type):
+                self._path_hash[rel_path] = (file_hash, new_type)
 
     def to_json(self):
         out_items = {
@@ -367,6 +677,8 @@ class Manifest(object):
               "paths": {from_os_path(k): v for k, v in iteritems(self._path_hash)},
               "items": out_items,
               "version": CURRENT_VERSION}
+        if self.commit is not None:
+            rv["commit"] = self.commit
         return rv
 
     @classmethod
@@ -379,6 +691,8 @@ class Manifest(object):
         if not hasattr(obj, "items") and hasattr(obj, "paths"):
             raise ManifestError
 
+        self.commit = obj.get("commit")
+
         self._path_hash = {to_os_path(k): v for k, v in iteritems(obj["paths"])}
 
         for test_type, type_paths in iteritems(obj["items"]):
@@ -392,6 +706,48 @@ class Manifest(object):
 
         return self
 
+    @classmethod
+    def from_compact(cls, tests_root, reader, types=None, meta_filters=None):
+        """Create a manifest from a compact.Reader. The items of each
+        type are only read from the reader when first used."""
+        meta = reader.meta
+        if meta.get("version") != CURRENT_VERSION:
+            raise ManifestVersionMismatch
+
+        self = cls(url_base=meta.get("url_base", "/"), meta_filters=meta_filters)
+        self.commit = meta.get("commit")
+
+        self._path_hash_loader = lambda: {to_os_path(k): v
+                                          for k, v in iteritems(reader.path_hash())}
+
+        for test_type in reader.item_types():
+            if test_type not in item_classes:
+                raise ManifestError
+
+            if types and test_type not in types:
+                reader.skip_items(test_type)
+                continue
+
+            self._data[test_type].set_json_loader(tests_root,
+                                                  partial(reader.items, test_type))
+
+        return self
+
+
+def _classify_source_file(args):
+    """Hash and classify a single file in a worker process.
+
+    Returns a tuple of (hash, data) where data is None if the hash matches
+    the previous hash of the file, or (item_type, items) with the items in
+    their JSON form so that they can be sent back to the parent process."""
+    tests_root, rel_path, url_base, file_hash, contents, old_hash = args
+    source_file = SourceFile(tests_root, rel_path, url_base, file_hash, contents=contents)
+    file_hash = source_file.hash
+    if file_hash == old_hash:
+        return file_hash, None
+    item_type, items = source_file.manifest_items()
+    return file_hash, (item_type, [item.to_json() for item in items])
+
 
 def load(tests_root, manifest, types=None, meta_filters=None):
     logger = get_logger()
@@ -401,18 +757,27 @@ def load(tests_root, manifest, types=None, meta_filters=None):
 
 
 def _load(logger, tests_root, manifest, types=None, meta_filters=None):
-    # "manifest" is a path or file-like object.
+    # "manifest" is a path or file-like object, in either the JSON or
+    # the compact format.
     if isinstance(manifest, string_types):
         if os.path.exists(manifest):
             logger.debug("Opening manifest at %s" % manifest)
         else:
             logger.debug("Creating new manifest at %s" % manifest)
         try:
-            with open(manifest) as f:
-                rv = Manifest.from_json(tests_root,
-                                        json.load(f),
-                                        types=types,
-                                        meta_filters=meta_filters)
+            if compact.is_compact_file(manifest):
+                with open(manifest, "rb") as f:
+                    reader = compact.load_file(f)
+                rv = Manifest.from_compact(tests_root,
+                                           reader,
+                                           types=types,
+                                           meta_filters=meta_filters)
+            else:
+                with open(manifest) as f:
+                    rv = Manifest.from_json(tests_root,
+                                            json.load(f),
+                                            types=types,
+                                            meta_filters=meta_filters)
         except IOError:
             return None
         except ValueError:
@@ -420,8 +785,14 @@ def _load(logger, tests_root, manifest, types=None, meta_filters=None):
             return None
         return rv
 
+    data = manifest.read()
+    if isinstance(data, bytes) and compact.is_compact(data):
+        return Manifest.from_compact(tests_root,
+                                     compact.Reader(data),
+                                     types=types,
+                                     meta_filters=meta_filters)
     return Manifest.from_json(tests_root,
-                              json.load(manifest),
+                              json.loads(data),
                               types=types,
                               meta_filters=meta_filters)
 
@@ -436,7 +807,15 @@ def load_and_update(tests_root,
                     working_copy=False,
                     types=None,
                     meta_filters=None,
-                    write_manifest=True):
+                    write_manifest=True,
+                    jobs=1,
+                    compact_format=None):
+    """Load a manifest and update it from the tests in tests_root.
+
+    :param compact_format: Write the manifest in the compact format if True,
+                           or as JSON if False, converting an existing
+                           manifest in the other format. None keeps the
+                           format of the existing manifest."""
     logger = get_logger()
 
     manifest = None
@@ -460,18 +839,66 @@ def load_and_update(tests_root,
     if update:
         tree = vcs.get_tree(tests_root, manifest, manifest_path, cache_root,
                             working_copy, rebuild)
-        changed = manifest.update(tree)
-        if write_manifest and changed:
-            write(manifest, manifest_path)
+        changed = manifest.update(tree, jobs=jobs)
+        if manifest.commit != tree.commit:
+            manifest.commit = tree.commit
+            changed = True
+        if write_manifest:
+            is_compact = compact.is_compact_file(manifest_path)
+            if compact_format is None:
+                compact_format = is_compact
+            if changed or is_compact != compact_format:
+                write(manifest, manifest_path, compact_format=compact_format)
         tree.dump_caches()
 
     return manifest
 
 
-def write(manifest, manifest_path):
+def write(manifest, manifest_path, compact_format=False):
+    """Write a manifest to a file.
+
+    The data is written to a temporary file that is then renamed over
+    manifest_path, so that readers never see a partially written
+    manifest.
+
+    :param manifest: Manifest to write
+    :param manifest_path: Path to the manifest file
+    :param compact_format: Write the manifest in the compact format
+                           rather than JSON"""
     dir_name = os.path.dirname(manifest_path)
     if not os.path.exists(dir_name):
         os.makedirs(dir_name)
-    with open(manifest_path, "wb") as f:
-        json.dump(manifest.to_json(), f, sort_keys=True, indent=1)
-        f.write("\n")
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name,
+                                    prefix=".%s." % os.path.basename(manifest_path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if compact_format:
+                f.write(compact.dumps(manifest.to_json()))
+            else:
+                json.dump(manifest.to_json(), f, sort_keys=True, indent=1)
+                f.write("\n")
+        os.chmod(tmp_path, _file_mode(manifest_path))
+        _replace(tmp_path, manifest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _file_mode(path):
+    """Get the permissions to use for a file replacing path"""
+    try:
+        return os.stat(path).st_mode & 0o777
+    except OSError:
+        # Reading the umask means setting it, which isn't safe while other
+        # threads create files, so use the usual mode for a new file
+        return 0o644
+
+
+def _replace(src, dest):
+    if hasattr(os, "replace"):
+        os.replace(src, dest)
+        return
+    if platform.system() == "Windows" and os.path.exists(dest):
+        # On Python 2 rename can't replace an existing file on Windows
+        os.unlink(dest)
+    os.rename(src, dest)
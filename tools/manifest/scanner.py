@@ -0,0 +1,206 @@
+"""Streaming extraction of metadata elements from HTML files.
+
+Classifying a file only needs the ``<meta>``, ``<link>`` and ``<script>``
+elements it contains, so rather than building a complete tree with
+html5lib this tokenizes just enough of the document to find their start
+tags, skipping over text, comments and the contents of raw text elements.
+
+The tokenization follows the rules html5lib uses, but the tree
+construction stage can drop or reorder elements in some contexts (e.g.
+foreign content, ``<select>`` or foster parenting in tables), and
+character references in attribute values need decoding. Rather than
+replicate that, :func:`scan` returns None for any document where it
+can't be sure of giving the same answer as the full parser, and the
+caller is expected to fall back to that.
+"""
+
+import re
+
+metadata_elements = frozenset(["meta", "link", "script"])
+
+# Elements whose presence means the tree builder might not put metadata
+# elements where the tokenizer finds them
+unsupported_elements = frozenset(["frameset", "math", "select", "svg", "template"])
+
+raw_text_elements = frozenset(["iframe", "noembed", "noframes", "script", "style",
+                               "textarea", "title", "xmp"])
+
+tag_name_re = re.compile(r"[a-zA-Z][^\t\n\f\r />]*")
+before_attr_name_re = re.compile(r"[\t\n\f\r /]*")
+attr_name_re = re.compile(r"[^\t\n\f\r />][^\t\n\f\r /=>]*")
+space_re = re.compile(r"[\t\n\f\r ]*")
+unquoted_value_re = re.compile(r"[^\t\n\f\r >]*")
+
+raw_text_end_res = {name: re.compile(r"</%s[\t\n\f\r />]" % name, re.IGNORECASE)
+                    for name in raw_text_elements}
+
+
+class ScannedElement(object):
+    """A metadata element found by :func:`scan`.
+
+    This provides the same ``tag`` (without a namespace) and ``attrib``
+    as the corresponding ElementTree Element would have."""
+
+    __slots__ = ("tag", "attrib")
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+
+    def __repr__(self):
+        return "<ScannedElement %s %r>" % (self.tag, self.attrib)
+
+
+class Ambiguous(Exception):
+    pass
+
+
+def scan(data):
+    """Find the metadata elements in an HTML document.
+
+    :param data: Bytes of the document
+    :returns: List of :class:`ScannedElement` in document order, or None
+              if the document has to be parsed in full to be sure of
+              getting the same result."""
+    if data.startswith((b"\xfe\xff", b"\xff\xfe")) or b"\x00" in data or b"\x1b" in data:
+        # Not an ASCII-compatible encoding, or needs replacement characters
+        return None
+    if data.startswith(b"\xef\xbb\xbf"):
+        data = data[3:]
+
+    # Bytes are mapped 1:1 to code points; anything that's not ASCII only
+    # matters if it ends up in an attribute value, and that is rejected below
+    text = data.decode("latin-1").replace(u"\r\n", u"\n").replace(u"\r", u"\n")
+
+    try:
+        return list(_scan(text))
+    except Ambiguous:
+        return None
+
+
+def _scan(text):
+    end = len(text)
+    pos = 0
+    seen_table = False
+
+    while True:
+        pos = text.find(u"<", pos)
+        if pos == -1 or pos + 1 >= end:
+            return
+
+        c = text[pos + 1]
+        if c == u"!":
+            if text.startswith(u"<!--", pos):
+                pos = _comment_end(text, pos + 4)
+            else:
+                # DOCTYPE or bogus comment
+                pos = _bogus_comment_end(text, pos + 2)
+        elif c == u"?":
+            pos = _bogus_comment_end(text, pos + 1)
+        elif c == u"/":
+            if text.startswith(u"</>", pos):
+                pos += 3
+            elif tag_name_re.match(text, pos + 2):
+                # End tags can have attributes, but they are ignored
+                _, _, pos = _parse_tag(text, pos + 2)
+                if pos is None:
+                    return
+            else:
+                pos = _bogus_comment_end(text, pos + 2)
+        elif tag_name_re.match(text, pos + 1):
+            tag_start = pos
+            name, attrib, pos = _parse_tag(text, pos + 1)
+            if pos is None:
+                # EOF in a tag; html5lib drops the token
+                return
+
+            if name in unsupported_elements:
+                raise Ambiguous
+            if name == u"table":
+                seen_table = True
+            elif name == u"plaintext":
+                # Everything after this is text
+                return
+            elif name in metadata_elements:
+                if seen_table and name != u"script":
+                    # Might be foster parented out of the table
+                    raise Ambiguous
+                if any(ord(char) > 0x7f for char in text[tag_start:pos]):
+                    raise Ambiguous
+                if any(u"&" in value for value in attrib.values()):
+                    # Character references would need decoding
+                    raise Ambiguous
+                yield ScannedElement(name, attrib)
+
+            if name in raw_text_elements:
+                m = raw_text_end_res[name].search(text, pos)
+                if not m:
+                    return
+                if name == u"script" and u"<!--" in text[pos:m.start()]:
+                    # Escaped script data may not end at the first </script>
+                    raise Ambiguous
+                pos = m.start()
+        else:
+            pos += 1
+
+
+def _comment_end(text, pos):
+    if text.startswith(u">", pos):
+        return pos + 1
+    if text.startswith(u"->", pos):
+        return pos + 2
+    ends = [i for i in (text.find(u"-->", pos), text.find(u"--!>", pos)) if i != -1]
+    if not ends:
+        return len(text)
+    end = min(ends)
+    return end + (3 if text.startswith(u"-->", end) else 4)
+
+
+def _bogus_comment_end(text, pos):
+    end = text.find(u">", pos)
+    if end == -1:
+        return len(text)
+    return end + 1
+
+
+def _parse_tag(text, pos):
+    """Parse a tag starting at the tag name.
+
+    :returns: Tuple of (name, attrib, pos) where pos is the index just after
+              the end of the tag, or None if the tag wasn't closed."""
+    end = len(text)
+    m = tag_name_re.match(text, pos)
+    name = m.group(0).lower()
+    pos = m.end()
+    attrib = {}
+
+    while True:
+        pos = before_attr_name_re.match(text, pos).end()
+        if pos >= end:
+            return name, attrib, None
+        if text[pos] == u">":
+            return name, attrib, pos + 1
+
+        m = attr_name_re.match(text, pos)
+        attr_name = m.group(0).lower()
+        pos = space_re.match(text, m.end()).end()
+
+        value = u""
+        if text.startswith(u"=", pos):
+            pos = space_re.match(text, pos + 1).end()
+            if pos >= end:
+                return name, attrib, None
+            quote = text[pos]
+            if quote in (u"\"", u"'"):
+                value_end = text.find(quote, pos + 1)
+                if value_end == -1:
+                    return name, attrib, None
+                value = text[pos + 1:value_end]
+                pos = value_end + 1
+            elif quote != u">":
+                m = unquoted_value_re.match(text, pos)
+                value = m.group(0)
+                pos = m.end()
+
+        # The first occurrence of an attribute wins
+        attrib.setdefault(attr_name, value)
@@ -1,7 +1,8 @@
 import hashlib
 import re
 import os
-from six import binary_type
+import sys
+from six import binary_type, iteritems
 from six.moves.urllib.parse import urljoin
 from fnmatch import fnmatch
 try:
@@ -11,7 +12,7 @@ except ImportError:
 
 import html5lib
 
-from . import XMLParser
+from . import XMLParser, scanner
 from .item import Stub, ManualTest, WebDriverSpecTest, RefTestNode, TestharnessTest, SupportFile, ConformanceCheckerTest, VisualTest
 from .utils import rel_path_to_url, ContextManagerBytesIO, cached_property
 
@@ -19,6 +20,9 @@ wd_pattern = "*.py"
 js_meta_re = re.compile(b"//\s*META:\s*(\w*)=(.*)$")
 python_meta_re = re.compile(b"#\s*META:\s*(\w*)=(.*)$")
 
+# Size of the chunks that files are read in when hashing them
+hash_chunk_size = 1024 * 1024
+
 reference_file_re = re.compile(r'(^|[\-_])(not)?ref[0-9]*([\-_]|$)')
 
 space_chars = u"".join(html5lib.constants.spaceCharacters)
@@ -140,6 +144,162 @@ def _parse_xml(f):
         return ElementTree.parse(f, XMLParser.XMLParser())
 
 
+def _blob_header(size):
+    return ("blob %d\0" % size).encode("ascii")
+
+
+def blob_hash(data):
+    """Return the git blob hash of a byte string"""
+    return hashlib.sha1(_blob_header(len(data)) + data).hexdigest()
+
+
+def file_blob_hash(path):
+    """Return the git blob hash of the contents of a file.
+
+    The file is read in chunks of hash_chunk_size bytes, so that large
+    files don't have to be held in memory."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= hash_chunk_size:
+            return blob_hash(f.read())
+        sha1 = hashlib.sha1(_blob_header(size))
+        read = 0
+        while True:
+            chunk = f.read(hash_chunk_size)
+            if not chunk:
+                break
+            sha1.update(chunk)
+            read += len(chunk)
+        if read != size:
+            # The file changed while it was being read
+            f.seek(0)
+            return blob_hash(f.read())
+    return sha1.hexdigest()
+
+
+def _script_metadata_to_json(value):
+    if value is None:
+        return None
+    return [[key.decode("latin-1"), item.decode("latin-1")] for key, item in value]
+
+
+def _script_metadata_from_json(value):
+    if value is None:
+        return None
+    return [(key.encode("latin-1"), item.encode("latin-1")) for key, item in value]
+
+
+def metadata_version():
+    """Return an identifier for the code used to compute the properties
+    stored in a :class:`MetadataCache`, which changes whenever that code
+    changes or when running with a different version of Python"""
+    sha1 = hashlib.sha1(("%s.%s %s" % (sys.version_info[0], sys.version_info[1],
+                                       html5lib.__version__)).encode("ascii"))
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ["sourcefile.py", "scanner.py", "XMLParser.py"]:
+        with open(os.path.join(here, name), "rb") as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+class MetadataCache(object):
+    """Cache of the properties of SourceFiles that are derived from the file
+    contents, so that each version of a file is only read and parsed once
+    per process, however many SourceFile objects are created for it.
+
+    Entries are keyed on the tests root and the path of the file relative
+    to it, and hold the git blob hash and url that the properties were
+    computed for, along with the value of each property in a form that
+    can be stored as JSON, so the entries for each tests root can also be
+    kept on disk (see :class:`vcs.MetadataCacheFile`)."""
+
+    # Functions converting the value of each cached property to and from
+    # the form stored in the cache, or None where the value is stored as
+    # it is
+    converters = {"has_markup": None,
+                  "script_metadata": (_script_metadata_to_json, _script_metadata_from_json),
+                  "timeout": None,
+                  "viewport_size": None,
+                  "dpi": None,
+                  "content_is_testharness": None,
+                  "has_testdriver": None,
+                  "test_variants": (list, list),
+                  "references": (lambda value: [list(item) for item in value],
+                                 lambda value: [tuple(item) for item in value]),
+                  "css_flags": (sorted, set),
+                  "spec_links": (sorted, set)}
+
+    def __init__(self):
+        # Map of tests root: {path: entry}
+        self.data = {}
+        self.modified = False
+
+    def entries(self, tests_root):
+        """Get the entries for the files under a tests root"""
+        return self.data.setdefault(tests_root, {})
+
+    def get(self, source_file, name, compute):
+        """Get the value of a property of a SourceFile, calling
+        compute(source_file) if it isn't already cached for the current
+        contents of the file."""
+        converters = self.converters[name]
+        entries = self.data.get(source_file.tests_root)
+        if entries is None:
+            entries = self.data[source_file.tests_root] = {}
+        entry = entries.get(source_file.rel_path)
+        if entry is None or entry[0] != source_file.hash or entry[1] != source_file.url:
+            entry = [source_file.hash, source_file.url, {}]
+            entries[source_file.rel_path] = entry
+        properties = entry[2]
+        if name in properties:
+            value = properties[name]
+            return converters[1](value) if converters else value
+
+        value = compute(source_file)
+        properties[name] = converters[0](value) if converters else value
+        self.modified = True
+        return value
+
+    def update(self, tests_root, data):
+        """Add the entries from data, e.g. as loaded from disk, for paths
+        under tests_root that don't already have an entry"""
+        entries = self.entries(tests_root)
+        for rel_path, entry in iteritems(data):
+            if rel_path not in entries:
+                entries[rel_path] = entry
+
+    def retain(self, tests_root, rel_paths):
+        """Drop the entries for files under tests_root not in rel_paths"""
+        entries = self.entries(tests_root)
+        for rel_path in list(entries.keys()):
+            if rel_path not in rel_paths:
+                del entries[rel_path]
+                self.modified = True
+
+
+# Cache shared by all SourceFiles in this process
+metadata_cache = MetadataCache()
+
+
+class content_property(cached_property):
+    """cached_property for properties that only depend on the contents and
+    url of the file, which are also stored in the SourceFile's
+    metadata_cache (if any)"""
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+
+        if self.name not in obj.__dict__:
+            if obj.metadata_cache is None:
+                value = self.func(obj)
+            else:
+                value = obj.metadata_cache.get(obj, self.name, self.func)
+            obj.__dict__[self.name] = value
+            obj.__dict__.setdefault("__cached_properties__", set()).add(self.name)
+        return obj.__dict__[self.name]
+
+
 class SourceFile(object):
     parsers = {"html":lambda x:html5lib.parse(x, treebuilder="etree", useChardet=False),
                "xhtml":_parse_xml,
@@ -155,6 +315,26 @@ class SourceFile(object):
                          ("css", "CSS2", "archive"),
                          ("css", "common")}
 
+    # Get the metadata for HTML files from the streaming scanner rather than
+    # a full parse where possible
+    use_scanner = True
+
+    # MetadataCache for the properties derived from the file contents, or
+    # None to always compute them
+    metadata_cache = metadata_cache
+
+    # (tag, attribute, value) for the elements making up each kind of
+    # metadata, in the order that they're returned by the *_nodes properties
+    metadata_queries = {"timeout": [("meta", "name", "timeout")],
+                        "viewport": [("meta", "name", "viewport-size")],
+                        "dpi": [("meta", "name", "device-pixel-ratio")],
+                        "testharness": [("script", "src", "/resources/testharness.js")],
+                        "variant": [("meta", "name", "variant")],
+                        "testdriver": [("script", "src", "/resources/testdriver.js")],
+                        "reftest": [("link", "rel", "match"), ("link", "rel", "mismatch")],
+                        "css_flag": [("meta", "name", "flags")],
+                        "spec_link": [("link", "rel", "help")]}
+
     def __init__(self, tests_root, rel_path, url_base, hash=None, contents=None):
         """Object representing a file in a source tree.
 
@@ -239,10 +419,10 @@ class SourceFile(object):
     @cached_property
     def hash(self):
         if not self._hash:
-            with self.open() as f:
-                content = f.read()
-            data = "".join(("blob ", str(len(content)), "\0", content))
-            self._hash = hashlib.sha1(data).hexdigest()
+            if self.contents is not None:
+                self._hash = blob_hash(self.contents)
+            else:
+                self._hash = file_blob_hash(self.path)
         return self._hash
 
     def in_non_test_dir(self):
@@ -377,13 +557,45 @@ class SourceFile(object):
 
         return root
 
+    @cached_property
+    def scanned_elements(self):
+        """List of the metadata elements in an HTML file found by the streaming
+        scanner, or None if the file isn't HTML or has to be parsed in full to
+        reliably find them"""
+        if not self.use_scanner or self.markup_type != "html":
+            return None
+
+        with self.open() as f:
+            return scanner.scan(f.read())
+
+    @content_property
+    def has_markup(self):
+        """Boolean indicating whether the file contains markup that could be
+        parsed"""
+        return self.scanned_elements is not None or self.root is not None
+
+    def metadata_nodes(self, kind):
+        """List of nodes for a kind of metadata (e.g. "timeout" for the nodes
+        in timeout_nodes), taken from the scanner output if available so that
+        the file doesn't need to be parsed in full. The nodes provide the same
+        attrib as the ElementTree Elements, but aren't part of a tree."""
+        elements = self.scanned_elements
+        if elements is None:
+            return getattr(self, "%s_nodes" % kind)
+
+        rv = []
+        for tag, attr, value in self.metadata_queries[kind]:
+            rv.extend(element for element in elements
+                      if element.tag == tag and element.attrib.get(attr) == value)
+        return rv
+
     @cached_property
     def timeout_nodes(self):
         """List of ElementTree Elements corresponding to nodes in a test that
         specify timeouts"""
         return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='timeout']")
 
-    @cached_property
+    @content_property
     def script_metadata(self):
         if self.name_is_worker or self.name_is_multi_global or self.name_is_window:
             regexp = js_meta_re
@@ -395,7 +607,7 @@ class SourceFile(object):
         with self.open() as f:
             return list(read_script_metadata(f, regexp))
 
-    @cached_property
+    @content_property
     def timeout(self):
         """The timeout of a test or reference file. "long" if the file has an extended timeout
         or None otherwise"""
@@ -403,11 +615,12 @@ class SourceFile(object):
             if any(m == (b"timeout", b"long") for m in self.script_metadata):
                 return "long"
 
-        if self.root is None:
+        if not self.has_markup:
             return None
 
-        if self.timeout_nodes:
-            timeout_str = self.timeout_nodes[0].attrib.get("content", None)
+        timeout_nodes = self.metadata_nodes("timeout")
+        if timeout_nodes:
+            timeout_str = timeout_nodes[0].attrib.get("content", None)
             if timeout_str and timeout_str.lower() == "long":
                 return "long"
 
@@ -419,16 +632,17 @@ class SourceFile(object):
         specify viewport sizes"""
         return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='viewport-size']")
 
-    @cached_property
+    @content_property
     def viewport_size(self):
         """The viewport size of a test or reference file"""
-        if self.root is None:
+        if not self.has_markup:
             return None
 
-        if not self.viewport_nodes:
+        viewport_nodes = self.metadata_nodes("viewport")
+        if not viewport_nodes:
             return None
 
-        return self.viewport_nodes[0].attrib.get("content", None)
+        return viewport_nodes[0].attrib.get("content", None)
 
     @cached_property
     def dpi_nodes(self):
@@ -436,16 +650,17 @@ class SourceFile(object):
         specify device pixel ratios"""
         return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='device-pixel-ratio']")
 
-    @cached_property
+    @content_property
     def dpi(self):
         """The device pixel ratio of a test or reference file"""
-        if self.root is None:
+        if not self.has_markup:
             return None
 
-        if not self.dpi_nodes:
+        dpi_nodes = self.metadata_nodes("dpi")
+        if not dpi_nodes:
             return None
 
-        return self.dpi_nodes[0].attrib.get("content", None)
+        return dpi_nodes[0].attrib.get("content", None)
 
     @cached_property
     def testharness_nodes(self):
@@ -453,13 +668,13 @@ class SourceFile(object):
         testharness.js script"""
         return self.root.findall(".//{http://www.w3.org/1999/xhtml}script[@src='/resources/testharness.js']")
 
-    @cached_property
+    @content_property
     def content_is_testharness(self):
         """Boolean indicating whether the file content represents a
         testharness.js test"""
-        if self.root is None:
+        if not self.has_markup:
             return None
-        return bool(self.testharness_nodes)
+        return bool(self.metadata_nodes("testharness"))
 
     @cached_property
     def variant_nodes(self):
@@ -467,7 +682,7 @@ class SourceFile(object):
         test variant"""
         return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='variant']")
 
-    @cached_property
+    @content_property
     def test_variants(self):
         rv = []
         if self.ext == ".js":
@@ -475,7 +690,7 @@ class SourceFile(object):
                 if key == b"variant":
                     rv.append(value.decode("utf-8"))
         else:
-            for element in self.variant_nodes:
+            for element in self.metadata_nodes("variant"):
                 if "content" in element.attrib:
                     variant = element.attrib["content"]
                     rv.append(variant)
@@ -494,13 +709,13 @@ class SourceFile(object):
         testdriver.js script"""
         return self.root.findall(".//{http://www.w3.org/1999/xhtml}script[@src='/resources/testdriver.js']")
 
-    @cached_property
+    @content_property
     def has_testdriver(self):
         """Boolean indicating whether the file content represents a
         testharness.js test"""
-        if self.root is None:
+        if not self.has_markup:
             return None
-        return bool(self.testdriver_nodes)
+        return bool(self.metadata_nodes("testdriver"))
 
     @cached_property
     def reftest_nodes(self):
@@ -513,13 +728,13 @@ class SourceFile(object):
         mismatch_links = self.root.findall(".//{http://www.w3.org/1999/xhtml}link[@rel='mismatch']")
         return match_links + mismatch_links
 
-    @cached_property
+    @content_property
     def references(self):
         """List of (ref_url, relation) tuples for any reftest references specified in
         the file"""
         rv = []
         rel_map = {"match": "==", "mismatch": "!="}
-        for item in self.reftest_nodes:
+        for item in self.metadata_nodes("reftest"):
             if "href" in item.attrib:
                 ref_url = urljoin(self.url, item.attrib["href"].strip(space_chars))
                 ref_type = rel_map[item.attrib["rel"]]
@@ -540,11 +755,11 @@ class SourceFile(object):
             return []
         return self.root.findall(".//{http://www.w3.org/1999/xhtml}meta[@name='flags']")
 
-    @cached_property
+    @content_property
     def css_flags(self):
         """Set of flags specified in the file"""
         rv = set()
-        for item in self.css_flag_nodes:
+        for item in self.metadata_nodes("css_flag"):
             if "content" in item.attrib:
                 for flag in item.attrib["content"].split():
                     rv.add(flag)
@@ -554,7 +769,7 @@ class SourceFile(object):
     def content_is_css_manual(self):
         """Boolean indicating whether the file content represents a
         CSS WG-style manual test"""
-        if self.root is None:
+        if not self.has_markup:
             return None
         # return True if the intersection between the two sets is non-empty
         return bool(self.css_flags & {"animated", "font", "history", "interact", "paged", "speech", "userstyle"})
@@ -567,11 +782,11 @@ class SourceFile(object):
             return []
         return self.root.findall(".//{http://www.w3.org/1999/xhtml}link[@rel='help']")
 
-    @cached_property
+    @content_property
     def spec_links(self):
         """Set of spec links specified in the file"""
         rv = set()
-        for item in self.spec_link_nodes:
+        for item in self.metadata_nodes("spec_link"):
             if "href" in item.attrib:
                 rv.add(item.attrib["href"].strip(space_chars))
         return rv
@@ -580,7 +795,7 @@ class SourceFile(object):
     def content_is_css_visual(self):
         """Boolean indicating whether the file content represents a
         CSS WG-style visual test"""
-        if self.root is None:
+        if not self.has_markup:
             return None
         return bool(self.ext in {'.xht', '.html', '.xhtml', '.htm', '.xml', '.svg'} and
                     self.spec_links)
@@ -0,0 +1,163 @@
+import json
+import os
+import sys
+
+import mock
+import pytest
+from six import BytesIO
+
+from .. import compact, item, manifest
+from .test_manifest import SourceFileWithTest, SourceFileWithTests
+
+
+def make_manifest():
+    m = manifest.Manifest()
+    sources = [SourceFileWithTest("a/ref.html", "0"*40, item.RefTest, [("/a/ref-ref.html", "==")]),
+               SourceFileWithTest("a/ref-ref.html", "1"*40, item.SupportFile),
+               SourceFileWithTests("a/test.html", "2"*40, item.TestharnessTest,
+                                   [("/a/test.html?1",), ("/a/test.html?2",)]),
+               SourceFileWithTest("b/test.html", "3"*40, item.TestharnessTest)]
+    m.update([(s, True) for s in sources])
+    m.commit = "4"*40
+    return m
+
+
+def normalize(obj):
+    # Convert tuples to lists
+    return json.loads(json.dumps(obj))
+
+
+def test_roundtrip():
+    obj = normalize(make_manifest().to_json())
+    data = compact.dumps(obj)
+    assert compact.is_compact(data)
+    assert compact.loads(data) == obj
+
+
+def test_roundtrip_no_commit():
+    m = make_manifest()
+    m.commit = None
+    obj = normalize(m.to_json())
+    assert compact.loads(compact.dumps(obj)) == obj
+
+
+def test_from_compact():
+    m = make_manifest()
+    data = compact.dumps(m.to_json())
+
+    loaded = manifest.Manifest.from_compact("/", compact.Reader(data))
+    assert loaded.commit == m.commit
+    assert normalize(loaded.to_json()) == normalize(m.to_json())
+    assert ([(item_type, path, sorted(test.id for test in tests))
+             for item_type, path, tests in loaded] ==
+            [(item_type, path, sorted(test.id for test in tests))
+             for item_type, path, tests in m])
+
+
+def test_from_compact_lazy():
+    data = compact.dumps(make_manifest().to_json())
+    reader = compact.Reader(data)
+
+    with mock.patch.object(compact.Reader, "items", autospec=True,
+                           side_effect=compact.Reader.items) as items:
+        loaded = manifest.Manifest.from_compact("/", reader, types=["testharness", "reftest"])
+        assert items.call_count == 0
+
+        assert ([test.id for test in loaded.iterdir("b")] == ["/b/test.html"])
+        assert items.call_count == 2
+
+        assert ([(item_type, path) for item_type, path, _ in loaded.itertypes("testharness")] ==
+                [("testharness", "a/test.html"), ("testharness", "b/test.html")])
+        assert items.call_count == 2
+        assert sorted(call[0][1] for call in items.call_args_list) == ["reftest", "testharness"]
+
+    assert not loaded._data["support"]
+    # The hashes are only needed to update the manifest
+    assert reader._unread == {"hashes"}
+    assert loaded.paths() == {"a/ref.html", "a/ref-ref.html", "a/test.html", "b/test.html"}
+    assert reader._unread == set()
+
+
+def test_reader_invalid():
+    data = compact.dumps(make_manifest().to_json())
+    with pytest.raises(ValueError):
+        compact.Reader(b"{}")
+    with pytest.raises(ValueError):
+        compact.Reader(data[:-1])
+    with pytest.raises(ValueError):
+        compact.Reader(compact.MAGIC)
+
+
+def test_load_file_object():
+    m = make_manifest()
+    data = compact.dumps(m.to_json())
+    loaded = manifest.load("/", BytesIO(data))
+    assert normalize(loaded.to_json()) == normalize(m.to_json())
+
+
+def test_load_version_mismatch():
+    obj = make_manifest().to_json()
+    obj["version"] = manifest.CURRENT_VERSION - 1
+    with pytest.raises(manifest.ManifestVersionMismatch):
+        manifest.load("/", BytesIO(compact.dumps(obj)))
+
+
+def test_write_compact(tmpdir):
+    m = make_manifest()
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    manifest.write(m, manifest_path, compact_format=True)
+
+    assert os.listdir(str(tmpdir)) == ["MANIFEST.json"]
+    assert compact.is_compact_file(manifest_path)
+    loaded = manifest.load("/", manifest_path, types=["testharness"])
+    assert ([path for _, path, _ in loaded.itertypes("testharness")] ==
+            ["a/test.html", "b/test.html"])
+    assert not loaded._data["reftest"]
+
+
+def test_load_corrupt(tmpdir):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    with open(manifest_path, "wb") as f:
+        f.write(compact.dumps(make_manifest().to_json())[:-10])
+    assert manifest.load("/", manifest_path) is None
+
+
+@pytest.mark.xfail(sys.version_info >= (3,),
+                   reason="manifest.write only works on Py2")
+def test_write_json_roundtrip(tmpdir):
+    m = make_manifest()
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    manifest.write(m, manifest_path)
+    assert not compact.is_compact_file(manifest_path)
+    with open(manifest_path) as f:
+        assert normalize(json.load(f)) == normalize(m.to_json())
+
+
+def test_write_atomic(tmpdir):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    manifest.write(make_manifest(), manifest_path, compact_format=True)
+    with open(manifest_path, "rb") as f:
+        before = f.read()
+
+    with mock.patch.object(compact, "dumps", side_effect=KeyboardInterrupt):
+        with pytest.raises(KeyboardInterrupt):
+            manifest.write(manifest.Manifest(), manifest_path, compact_format=True)
+
+    with open(manifest_path, "rb") as f:
+        assert f.read() == before
+    assert os.listdir(str(tmpdir)) == ["MANIFEST.json"]
+
+
+@pytest.mark.skipif(sys.platform == "win32",
+                    reason="file modes are only partly supported on Windows")
+def test_write_mode(tmpdir):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    with mock.patch("os.umask") as umask:
+        manifest.write(make_manifest(), manifest_path, compact_format=True)
+        assert not umask.called
+    assert os.stat(manifest_path).st_mode & 0o777 == 0o644
+
+    # The mode of an existing manifest is kept
+    os.chmod(manifest_path, 0o664)
+    manifest.write(make_manifest(), manifest_path, compact_format=True)
+    assert os.stat(manifest_path).st_mode & 0o777 == 0o664
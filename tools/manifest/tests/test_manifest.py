@@ -1,3 +1,4 @@
+import hashlib
 import os
 
 import mock
@@ -7,7 +8,7 @@ import hypothesis.strategies as hs
 
 import pytest
 
-from .. import manifest, item, utils
+from .. import manifest, item, sourcefile, utils
 
 
 def SourceFileWithTest(path, hash, cls, *args):
@@ -339,6 +340,66 @@ def test_reftest_node_by_url():
                                       "/test2": test2_node}
 
 
+def test_iterdir():
+    m = manifest.Manifest()
+
+    sources = [SourceFileWithTest("a/b/test1", "0"*40, item.TestharnessTest),
+               SourceFileWithTest("a/bc/test2", "0"*40, item.TestharnessTest),
+               SourceFileWithTest("a/test3", "0"*40, item.RefTest, [("/a/b/test1", "==")]),
+               SourceFileWithTest("b/test4", "0"*40, item.TestharnessTest)]
+    m.update([(s, True) for s in sources])
+
+    for manifest_obj in [m, manifest.Manifest.from_json("/", m.to_json())]:
+        assert [test.url for test in manifest_obj.iterdir("a/b")] == ["/a/b/test1"]
+        assert [test.url for test in manifest_obj.iterdir("a/b/")] == ["/a/b/test1"]
+        assert (sorted(test.url for test in manifest_obj.iterdir("a")) ==
+                ["/a/b/test1", "/a/bc/test2", "/a/test3"])
+        assert list(manifest_obj.iterdir("c")) == []
+        assert list(manifest_obj.iterpaths()) == [("reftest", "a/test3"),
+                                                  ("testharness", "a/b/test1"),
+                                                  ("testharness", "a/bc/test2"),
+                                                  ("testharness", "b/test4")]
+
+
+def test_lookup_without_loading():
+    m = manifest.Manifest()
+
+    s1 = SourceFileWithTest("test1", "0"*40, item.RefTest, [("/test2", "==")])
+    s2 = SourceFileWithTest("test2", "0"*40, item.TestharnessTest)
+    m.update([(s1, True), (s2, True)])
+
+    loaded = manifest.Manifest.from_json("/", m.to_json())
+    reftests = loaded._data["reftest"]
+    assert "test1" in reftests
+    assert "test2" not in reftests
+    assert list(reftests) == ["test1"]
+    assert list(loaded.iterpath("missing")) == []
+    assert [test.url for test in loaded.iterpath("test2")] == ["/test2"]
+    # None of the reftests have been created
+    assert reftests.data == {}
+    assert loaded.to_json() == m.to_json()
+
+    assert loaded.get_reference("/test1").url == "/test1"
+    assert loaded.get_reference("/test2") is None
+    assert loaded.get_reference("/missing") is None
+    assert loaded.get_reference("http://example.org/test1") is None
+    assert loaded._reftest_nodes_by_url is None
+
+
+def test_itertypes_after_update():
+    m = manifest.Manifest()
+
+    s1 = SourceFileWithTest("d/b", "0"*40, item.TestharnessTest)
+    s2 = SourceFileWithTest("d/c", "0"*40, item.TestharnessTest)
+    m.update([(s1, True), (s2, True)])
+    assert [path for _, path, _ in m.itertypes("testharness")] == ["d/b", "d/c"]
+
+    s3 = SourceFileWithTest("d/a", "0"*40, item.TestharnessTest)
+    m.update([(s2, True), (s3, True)])
+    assert [path for _, path, _ in m.itertypes("testharness")] == ["d/a", "d/c"]
+    assert [test.url for test in m.iterdir("d")] == ["/d/a", "/d/c"]
+
+
 def test_no_update():
     m = manifest.Manifest()
 
@@ -378,3 +439,126 @@ def test_no_update_delete():
     test1_1 = s1_1.manifest_items()[1][0]
 
     assert list(m) == [("testharness", test1_1.path, {test1_1})]
+
+
+def write_tree(root, files):
+    for rel_path, contents in files.items():
+        path = os.path.join(str(root), rel_path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(contents)
+
+
+def source_tree(root, files):
+    # Supply the hash like vcs.Git does, since SourceFile.hash only works on
+    # Python 2
+    return [(sourcefile.SourceFile(str(root), rel_path, "/",
+                                   hashlib.sha1(contents).hexdigest()), True)
+            for rel_path, contents in sorted(files.items())]
+
+
+parallel_files = {
+    "a/test.html": b"<script src=/resources/testharness.js></script>",
+    "a/test.any.js": b"// META: timeout=long\ntest(function() {});",
+    "a/ref.html": b"<link rel=match href=ref-ref.html>",
+    "a/ref-ref.html": b"<p>ref</p>",
+    "a/manual-manual.html": b"",
+    "b/support.js": b"",
+}
+
+
+def test_update_parallel(tmpdir):
+    write_tree(tmpdir, parallel_files)
+
+    serial = manifest.Manifest()
+    assert serial.update(source_tree(tmpdir, parallel_files), jobs=1) is True
+
+    parallel = manifest.Manifest()
+    assert parallel.update(source_tree(tmpdir, parallel_files), jobs=2) is True
+
+    assert parallel.to_json() == serial.to_json()
+    assert ([(item_type, path, sorted(test.id for test in tests))
+             for item_type, path, tests in parallel] ==
+            [(item_type, path, sorted(test.id for test in tests))
+             for item_type, path, tests in serial])
+    ref = parallel.get_reference("/a/ref.html")
+    assert ref.source_file.rel_path == "a/ref.html"
+
+
+def test_update_parallel_changes(tmpdir):
+    write_tree(tmpdir, parallel_files)
+
+    m = manifest.Manifest()
+    m.update(source_tree(tmpdir, parallel_files), jobs=2)
+    assert m.update(source_tree(tmpdir, parallel_files), jobs=2) is False
+
+    files = dict(parallel_files)
+    files["a/ref.html"] = b"<script src=/resources/testharness.js></script>"
+    del files["b/support.js"]
+    write_tree(tmpdir, files)
+    assert m.update(source_tree(tmpdir, files), jobs=2) is True
+
+    expected = manifest.Manifest()
+    expected.update(source_tree(tmpdir, files))
+    assert m.to_json() == expected.to_json()
+    assert [path for _, path, _ in m.itertypes("testharness")] == [
+        "a/ref.html", "a/test.any.js", "a/test.html"]
+    assert list(m.itertypes("reftest")) == []
+
+
+def reftest_chain_sources(refs):
+    # refs is a list of (path, hash, ref_path) for reftests
+    return [SourceFileWithTest(path, hash, item.RefTest,
+                               [(utils.rel_path_to_url(ref), "==")])
+            for path, hash, ref in refs]
+
+
+def reftest_types(m):
+    return sorted((item_type, path, sorted(test.url for test in tests))
+                  for item_type, path, tests in m)
+
+
+def test_reftest_incremental_update():
+    refs = [("a", "0"*40, "b"),
+            ("b", "0"*40, "c"),
+            ("c", "0"*40, "x"),
+            ("d", "0"*40, "e"),
+            ("e", "0"*40, "x")]
+    m = manifest.Manifest()
+    m.update([(s, True) for s in reftest_chain_sources(refs)])
+    assert m.reftest_nodes_by_url["/b"].item_type == "reftest_node"
+
+    # d changes to refer to c rather than e, so e becomes a reftest and
+    # c becomes a reftest node
+    refs[3] = ("d", "1"*40, "c")
+    sources = reftest_chain_sources(refs)
+    tree = [(s, True) if s.rel_path == "d" else (s.rel_path, False)
+            for s in sources]
+
+    loaded = manifest.Manifest.from_json("/", m.to_json())
+    for manifest_obj in [m, loaded]:
+        assert manifest_obj.update(tree) is True
+
+        expected = manifest.Manifest()
+        expected.update([(s, True) for s in sources])
+        assert reftest_types(manifest_obj) == reftest_types(expected)
+        assert manifest_obj.to_json() == expected.to_json()
+        assert manifest_obj.reftest_nodes_by_url == expected.reftest_nodes_by_url
+
+
+def test_reftest_incremental_update_lazy():
+    refs = [("a", "0"*40, "b"),
+            ("b", "0"*40, "x"),
+            ("c", "0"*40, "y")]
+    m = manifest.Manifest()
+    m.update([(s, True) for s in reftest_chain_sources(refs)])
+    loaded = manifest.Manifest.from_json("/", m.to_json())
+
+    # Deleting a only affects b, which is no longer referenced
+    assert loaded.update([("b", False), ("c", False)]) is True
+    assert loaded._path_hash["b"] == ("0"*40, "reftest")
+    # c wasn't affected, so its item was never created
+    assert "c" in loaded._data["reftest"].json_data
+    assert reftest_types(loaded) == [("reftest", "b", ["/b"]),
+                                     ("reftest", "c", ["/c"])]
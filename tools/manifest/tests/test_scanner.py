@@ -0,0 +1,132 @@
+import os
+
+import html5lib
+import pytest
+
+from .. import scanner
+from ..sourcefile import SourceFile
+
+here = os.path.dirname(__file__)
+wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir, os.pardir))
+
+xhtml_ns = "{http://www.w3.org/1999/xhtml}"
+
+
+def parsed_elements(data):
+    root = html5lib.parse(data, treebuilder="etree", useChardet=False)
+    return [(element.tag[len(xhtml_ns):], dict(element.attrib))
+            for element in root.iter()
+            if element.tag in {xhtml_ns + name for name in scanner.metadata_elements}]
+
+
+def scanned_elements(data):
+    rv = scanner.scan(data)
+    if rv is None:
+        return None
+    return [(element.tag, element.attrib) for element in rv]
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"<",
+    b"<meta name=timeout content=long>",
+    b"<META NAME=timeout Content=long>",
+    b"<meta name=a name=b content=x>",
+    b"<meta name=\"a\"content='b'>",
+    b"<meta =a b=c>",
+    b"<meta name=a/>",
+    b"<meta / name = 'a' / >",
+    b"<meta name=\"a>b\">",
+    b"<meta name='x\r\ny'>",
+    b"<meta name=\"unclosed",
+    b"<meta name=unclosed",
+    b"\xef\xbb\xbf<meta name=bom>",
+    b"<!-- <meta name=a> --> <meta name=b>",
+    b"<!--> <meta name=a>",
+    b"<!---> <meta name=a>",
+    b"<!----> <meta name=a>",
+    b"<!-- a --!> <meta name=b>",
+    b"<!-- a -- > <meta name=b> -->",
+    b"<!-- unclosed <meta name=a>",
+    b"<!DOCTYPE html><meta name=a>",
+    b"<!doctype html PUBLIC \"a\"><meta name=a>",
+    b"<![CDATA[ <meta name=a> ]]><meta name=b>",
+    b"<? <meta name=a> ?><meta name=b>",
+    b"</ <meta name=a>><meta name=b>",
+    b"</><meta name=a>",
+    b"</p <meta name=a>><meta name=b>",
+    b"</p name='>'><meta name=b>",
+    b"< meta name=a>",
+    b"<3<meta name=a>",
+    b"<script>'<meta name=a>'</script><meta name=b>",
+    b"<script>'</scripty><meta name=a>'</script ><meta name=b>",
+    b"<script src=/resources/testharness.js /><meta name=a></script>",
+    b"<SCRIPT>x</SCRIPT><meta name=b>",
+    b"<script><meta name=a>",
+    b"<style><link rel=match href=a></style><link rel=match href=b>",
+    b"<title><meta name=a></title><meta name=b>",
+    b"<textarea><meta name=a></textarea><meta name=b>",
+    b"<xmp><meta name=a></xmp><iframe><meta name=b></iframe><meta name=c>",
+    b"<noembed><meta name=a></noembed><noframes><meta name=b></noframes>",
+    b"<noscript><link rel=match href=a></noscript><meta name=b>",
+    b"<head></head><meta name=a><body><meta name=b></body></html><meta name=c>",
+    b"<plaintext><meta name=a>",
+    b"<p><b><meta name=a></p><link rel=match href=b></b>",
+])
+def test_scan_matches_parser(data):
+    expected = parsed_elements(data)
+    assert scanned_elements(data) == expected
+
+
+@pytest.mark.parametrize("data", [
+    b"<meta name=\"a&amp;b\">",
+    b"<meta name=\"\xc3\xa9\">",
+    b"\xff\xfe<\x00m\x00",
+    b"<meta name=a\x00>",
+    b"<svg><meta name=a></svg>",
+    b"<math><meta name=a></math>",
+    b"<select><meta name=a></select>",
+    b"<template><meta name=a></template>",
+    b"<frameset><meta name=a></frameset>",
+    b"<table><tr><td><meta name=a></table>",
+    b"<script><!--<script></script><meta name=a>--></script>",
+])
+def test_scan_ambiguous(data):
+    assert scanner.scan(data) is None
+
+
+def test_scan_table_script():
+    data = b"<table><script src=/resources/testharness.js></script></table>"
+    assert scanned_elements(data) == parsed_elements(data)
+
+
+def html_files():
+    for dir_path, dir_names, file_names in os.walk(wpt_root):
+        dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1] in (".html", ".htm"):
+                yield os.path.relpath(os.path.join(dir_path, file_name), wpt_root)
+
+
+@pytest.mark.parametrize("rel_path", sorted(html_files()))
+def test_repository_conformance(rel_path):
+    with open(os.path.join(wpt_root, rel_path), "rb") as f:
+        data = f.read()
+    scanned = scanned_elements(data)
+    if scanned is not None:
+        assert scanned == parsed_elements(data)
+
+    scanned_file = SourceFile(wpt_root, rel_path, "/")
+    parsed_file = SourceFile(wpt_root, rel_path, "/")
+    parsed_file.use_scanner = False
+    # Compute the properties for both files rather than sharing them
+    scanned_file.metadata_cache = None
+    parsed_file.metadata_cache = None
+
+    def items_json(source_file):
+        item_type, items = source_file.manifest_items()
+        return item_type, sorted(item.to_json() for item in items)
+
+    assert items_json(scanned_file) == items_json(parsed_file)
+    assert scanned_file.spec_links == parsed_file.spec_links
+    assert scanned_file.css_flags == parsed_file.css_flags
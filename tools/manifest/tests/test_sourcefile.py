@@ -1,10 +1,13 @@
+import json
 import os
 
+import mock
 import pytest
 
 from six import BytesIO
 from ...lint.lint import check_global_metadata
-from ..sourcefile import SourceFile, read_script_metadata, js_meta_re, python_meta_re
+from .. import scanner
+from ..sourcefile import MetadataCache, SourceFile, read_script_metadata, js_meta_re, python_meta_re
 
 def create(filename, contents=b""):
     assert isinstance(contents, bytes)
@@ -766,3 +769,53 @@ def test_spec_links_whitespace(url):
     content = b"<link rel=help href='%s'>" % url
     s = create("foo/test.html", content)
     assert s.spec_links == {"http://example.com/"}
+
+
+def test_metadata_cache():
+    content = (b"<link rel=match href=ref.html><link rel=help href=http://example.com/>"
+               b"<meta name=timeout content=long><meta name=flags content='ahem paged'>")
+    cache = MetadataCache()
+
+    def properties(s):
+        s.metadata_cache = cache
+        return (s.type, s.references, s.spec_links, s.css_flags, s.timeout,
+                s.test_variants, s.script_metadata)
+
+    expected = ("manual", [("/foo/ref.html", "==")], {"http://example.com/"},
+                {"ahem", "paged"}, "long", [""], None)
+    with mock.patch.object(scanner, "scan", wraps=scanner.scan) as scan:
+        assert properties(create("foo/test.html", content)) == expected
+        assert scan.call_count == 1
+
+        # The same contents aren't scanned again, even after a round trip
+        # through JSON
+        assert properties(create("foo/test.html", content)) == expected
+        cache.data = json.loads(json.dumps(cache.data))
+        assert properties(create("foo/test.html", content)) == expected
+        assert scan.call_count == 1
+
+        # Changing the contents or the url means the file is scanned again
+        assert properties(create("foo/test.html", content + b" ")) == expected
+        assert scan.call_count == 2
+        s = SourceFile("/", "foo/test.html", "/base/", contents=content)
+        assert properties(s)[1] == [("/base/foo/ref.html", "==")]
+        assert scan.call_count == 3
+
+
+def test_metadata_cache_script_metadata():
+    content = (b"// META: timeout=long\n// META: title=\xc3\xa9\n// META: variant=?a\n"
+               b"importScripts('/resources/testharness.js')\n")
+    cache = MetadataCache()
+    s = create("html/test.any.js", content)
+    s.metadata_cache = cache
+    items = s.manifest_items()[1]
+    cache.data = json.loads(json.dumps(cache.data))
+
+    s = create("html/test.any.js", content)
+    s.metadata_cache = cache
+    with mock.patch.object(SourceFile, "open") as open_file:
+        assert s.script_metadata == [(b"timeout", b"long"),
+                                     (b"title", b"\xc3\xa9"),
+                                     (b"variant", b"?a")]
+        assert [item.to_json() for item in s.manifest_items()[1]] == [item.to_json() for item in items]
+        assert not open_file.called
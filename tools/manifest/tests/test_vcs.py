@@ -0,0 +1,441 @@
+import json
+import os
+import subprocess
+import sys
+
+import mock
+import pytest
+from six import iteritems
+
+from gitignore import gitignore
+from .. import compact, manifest, sourcefile, vcs
+
+
+def make_tree(root, paths):
+    for path in paths:
+        path = os.path.join(str(root), path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, "w").close()
+
+
+def age_dirs(root, mtime=1000000000):
+    # Make every directory old enough to be cached
+    for dir_path, _, _ in os.walk(str(root)):
+        os.utime(dir_path, (mtime, mtime))
+
+
+def tree_names(tree):
+    return sorted((dirpath, sorted(name for name, _ in dirnames),
+                   sorted(name for name, _ in filenames))
+                  for dirpath, dirnames, filenames in tree)
+
+
+@pytest.fixture
+def tests_root(tmpdir):
+    root = tmpdir.join("tests")
+    make_tree(root, ["a/test.html", "a/b/test.html", "a/b/ignored.pyc", "c/test.html",
+                     "build/test.html", "test.html"])
+    root.join(".gitignore").write("*.pyc\n/build/\n")
+    age_dirs(root)
+    return str(root)
+
+
+def dir_cache(tmpdir, tests_root):
+    return vcs.DirectoryCache(str(tmpdir.join("cache")), tests_root)
+
+
+def filtered_walk(tests_root):
+    path_filter = gitignore.PathFilter(tests_root, extras=[".git/"])
+    return tree_names(path_filter(vcs.walk(tests_root)))
+
+
+def cached_walk(cache, tests_root):
+    path_filter = gitignore.PathFilter(tests_root, extras=[".git/"])
+    rv = tree_names(cache.walk(tests_root, path_filter))
+    cache.dump()
+    return rv
+
+
+def test_directory_cache_walk(tmpdir, tests_root):
+    expected = filtered_walk(tests_root)
+    assert ("a/b", [], ["test.html"]) in expected
+    assert "build" not in [dirpath for dirpath, _, _ in expected]
+
+    cache = dir_cache(tmpdir, tests_root)
+    assert cached_walk(cache, tests_root) == expected
+    assert cache.data["a"][1:] == [["b"], ["test.html"]]
+
+    # Second walk uses the cached listings
+    cache = dir_cache(tmpdir, tests_root)
+    assert "a" in cache.data
+    assert cached_walk(cache, tests_root) == expected
+    assert not cache.modified
+
+
+def test_directory_cache_changes(tmpdir, tests_root):
+    cache = dir_cache(tmpdir, tests_root)
+    cached_walk(cache, tests_root)
+
+    make_tree(tests_root, ["a/b/new.html", "d/test.html"])
+    os.unlink(os.path.join(tests_root, "c", "test.html"))
+    os.rmdir(os.path.join(tests_root, "c"))
+    age_dirs(tests_root, 1000000010)
+
+    cache = dir_cache(tmpdir, tests_root)
+    assert cached_walk(cache, tests_root) == filtered_walk(tests_root)
+    assert "c" not in cache.data
+    assert sorted(cache.data["a/b"][2]) == ["new.html", "test.html"]
+
+
+def test_directory_cache_modified_file(tmpdir, tests_root):
+    cache = dir_cache(tmpdir, tests_root)
+    cached_walk(cache, tests_root)
+
+    path = os.path.join(tests_root, "a", "test.html")
+    os.utime(path, (2000000000, 2000000000))
+    age_dirs(tests_root)
+
+    cache = dir_cache(tmpdir, tests_root)
+    path_filter = gitignore.PathFilter(tests_root, extras=[".git/"])
+    stats = {os.path.join(dirpath, name): path_stat.st_mtime
+             for dirpath, _, filenames in cache.walk(tests_root, path_filter)
+             for name, path_stat in filenames}
+    assert stats[os.path.join("a", "test.html")] == 2000000000
+
+
+def test_directory_cache_racy(tmpdir, tests_root):
+    now_dir = os.path.join(tests_root, "a")
+    os.utime(now_dir, None)
+
+    cache = dir_cache(tmpdir, tests_root)
+    cached_walk(cache, tests_root)
+    assert "a" not in cache.data
+    assert "c" in cache.data
+
+
+def test_directory_cache_gitignore_change(tmpdir, tests_root):
+    cache = dir_cache(tmpdir, tests_root)
+    cached_walk(cache, tests_root)
+
+    ignore_path = os.path.join(tests_root, ".gitignore")
+    with open(ignore_path, "w") as f:
+        f.write("/build/\n")
+    os.utime(ignore_path, (1000000020, 1000000020))
+
+    cache = dir_cache(tmpdir, tests_root)
+    assert "a" not in cache.data
+    assert ("a/b", [], ["ignored.pyc", "test.html"]) in cached_walk(cache, tests_root)
+
+
+def test_file_blob_hash(tmpdir):
+    path = str(tmpdir.join("file"))
+    content = b"abc\0" * 1000
+    with open(path, "wb") as f:
+        f.write(content)
+    expected = sourcefile.blob_hash(content)
+    assert sourcefile.file_blob_hash(path) == expected
+    with mock.patch.object(sourcefile, "hash_chunk_size", 7):
+        assert sourcefile.file_blob_hash(path) == expected
+
+    # The hash of an empty blob in git
+    assert sourcefile.blob_hash(b"") == "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+
+
+def hash_cache(tmpdir, tests_root):
+    return vcs.HashCache(str(tmpdir.join("cache")), tests_root)
+
+
+def test_hash_cache(tmpdir, tests_root):
+    path = os.path.join(tests_root, "a", "test.html")
+    rel_path = os.path.join("a", "test.html")
+    with open(path, "w") as f:
+        f.write("test")
+    os.utime(path, (1000000000, 1000000000))
+    expected = sourcefile.blob_hash(b"test")
+
+    cache = hash_cache(tmpdir, tests_root)
+    assert cache.hash(rel_path) == expected
+    cache.dump()
+
+    cache = hash_cache(tmpdir, tests_root)
+    with mock.patch.object(vcs, "file_blob_hash") as file_blob_hash:
+        assert cache.hash(rel_path) == expected
+        assert not file_blob_hash.called
+
+    # Changing the mtime means the file is hashed again
+    os.utime(path, (1000000010, 1000000010))
+    with mock.patch.object(vcs, "file_blob_hash", return_value="1" * 40) as file_blob_hash:
+        assert cache.hash(rel_path) == "1" * 40
+        assert file_blob_hash.called
+
+
+def test_hash_cache_racy(tmpdir, tests_root):
+    rel_path = os.path.join("a", "test.html")
+    cache = hash_cache(tmpdir, tests_root)
+    cache.hash(rel_path)
+    assert rel_path not in cache.data
+
+
+def test_hash_cache_source_file(tmpdir, tests_root):
+    rel_path = os.path.join("a", "test.html")
+    path = os.path.join(tests_root, rel_path)
+    os.utime(path, (1000000000, 1000000000))
+    path_stat = os.stat(path)
+
+    cache = hash_cache(tmpdir, tests_root)
+    source_file = cache.source_file(rel_path, path_stat, "/")
+    assert source_file._hash is None
+    assert source_file.hash == sourcefile.blob_hash(b"")
+    cache.retain({rel_path})
+    cache.dump()
+
+    cache = hash_cache(tmpdir, tests_root)
+    assert cache.source_file(rel_path, path_stat, "/")._hash == sourcefile.blob_hash(b"")
+    cache.retain(set())
+    assert rel_path not in cache.data
+
+
+def test_filesystem_hash_cache(tmpdir, tests_root):
+    age_dirs(tests_root)
+    for dir_path, _, file_names in os.walk(tests_root):
+        for name in file_names:
+            os.utime(os.path.join(dir_path, name), (1000000000, 1000000000))
+    cache_root = str(tmpdir.join("cache"))
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+
+    tree = vcs.FileSystem(tests_root, "/", cache_root, manifest_path)
+    hashes = {source_file.rel_path: source_file.hash for source_file, _ in tree}
+    tree.dump_caches()
+    assert len(hashes) == 5
+
+    # With a new mtime cache every file is updated, but none are read
+    tree = vcs.FileSystem(tests_root, "/", cache_root, manifest_path, rebuild=True)
+    tree.hash_cache = hash_cache(tmpdir, tests_root)
+    with mock.patch.object(sourcefile, "file_blob_hash") as file_blob_hash:
+        assert {source_file.rel_path: source_file.hash
+                for source_file, update in tree if update} == hashes
+        assert not file_blob_hash.called
+
+
+def test_metadata_cache_file(tmpdir, tests_root):
+    cache_root = str(tmpdir.join("cache"))
+    path = os.path.join(tests_root, "a", "test.html")
+    with open(path, "w") as f:
+        f.write("<script src=/resources/testharness.js></script><meta name=timeout content=long>")
+
+    def source_file(cache_file):
+        rv = sourcefile.SourceFile(tests_root, os.path.join("a", "test.html"), "/")
+        rv.metadata_cache = cache_file.metadata_cache
+        return rv
+
+    cache_file = vcs.MetadataCacheFile(cache_root, tests_root,
+                                       metadata_cache=sourcefile.MetadataCache())
+    assert source_file(cache_file).timeout == "long"
+    cache_file.dump()
+
+    # A new process doesn't read the file again
+    cache_file = vcs.MetadataCacheFile(cache_root, tests_root,
+                                       metadata_cache=sourcefile.MetadataCache())
+    with mock.patch.object(sourcefile.SourceFile, "open") as open_file:
+        assert source_file(cache_file).timeout == "long"
+        assert not open_file.called
+
+    cache_file.retain(set())
+    cache_file.dump()
+    cache_file = vcs.MetadataCacheFile(cache_root, tests_root,
+                                       metadata_cache=sourcefile.MetadataCache())
+    assert cache_file.metadata_cache.entries(tests_root) == {}
+
+    # Only the entries for files under the tests root are stored
+    other_root = str(tmpdir.join("other"))
+    make_tree(other_root, ["a/test.html"])
+    other_file = sourcefile.SourceFile(other_root, os.path.join("a", "test.html"), "/")
+    other_file.metadata_cache = cache_file.metadata_cache
+    other_file.timeout
+    cache_file.dump()
+    with open(os.path.join(cache_root, "metadata.json")) as f:
+        assert json.load(f) == {"/version": cache_file.version}
+
+    # The cache is dropped when the code computing the properties changes
+    source_file(cache_file).timeout
+    cache_file.dump()
+    with mock.patch.object(vcs, "metadata_version", return_value="changed"):
+        cache_file = vcs.MetadataCacheFile(cache_root, tests_root,
+                                           metadata_cache=sourcefile.MetadataCache())
+    assert cache_file.metadata_cache.entries(tests_root) == {}
+
+
+def git(repo_root, *args):
+    return subprocess.check_output(["git",
+                                    "-c", "user.name=Test",
+                                    "-c", "user.email=test@example.org"] + list(args),
+                                   cwd=repo_root)
+
+
+def commit_tree(repo_root, files, message="Update"):
+    for rel_path, contents in iteritems(files):
+        path = os.path.join(repo_root, rel_path)
+        if contents is None:
+            os.unlink(path)
+            continue
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(contents)
+    git(repo_root, "add", "-A")
+    git(repo_root, "commit", "-q", "-m", message)
+
+
+@pytest.fixture
+def git_root(tmpdir):
+    repo_root = str(tmpdir.join("repo"))
+    os.makedirs(repo_root)
+    git(repo_root, "init", "-q")
+    commit_tree(repo_root, {
+        "a/test.html": b"<script src=/resources/testharness.js></script>",
+        "a/ref.html": b"<link rel=match href=ref-ref.html>",
+        "a/ref-ref.html": b"<p>ref</p>",
+        "b/test.any.js": b"test(function() {});",
+        "b/old.html": b"<script src=/resources/testharness.js></script>",
+    }, "Initial commit")
+    return repo_root
+
+
+def load_and_update(git_root, manifest_path, rebuild=False, compact_format=None):
+    return manifest.load_and_update(git_root, manifest_path, "/",
+                                    rebuild=rebuild,
+                                    cache_root=os.path.join(git_root, ".wptcache"),
+                                    working_copy=False,
+                                    compact_format=compact_format)
+
+
+def items_json(m):
+    rv = json.loads(json.dumps(m.to_json()))
+    del rv["commit"]
+    return rv
+
+
+py2_only = pytest.mark.xfail(sys.version_info >= (3,),
+                             reason="manifest.write only works on Py2")
+
+
+@py2_only
+def test_git_records_commit(tmpdir, git_root):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    m = load_and_update(git_root, manifest_path)
+    # The caches inside the repository are ignored by git
+    assert git(git_root, "status", "--porcelain", "--untracked-files=all") == b""
+    head = git(git_root, "rev-parse", "HEAD").decode("ascii").strip()
+    assert m.commit == head
+
+    with open(manifest_path) as f:
+        assert json.load(f)["commit"] == head
+
+
+@py2_only
+def test_git_incremental(tmpdir, git_root):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    load_and_update(git_root, manifest_path)
+
+    commit_tree(git_root, {
+        "a/test.html": b"<meta name=timeout content=long>"
+                       b"<script src=/resources/testharness.js></script>",
+        "a/ref.html": b"<script src=/resources/testharness.js></script>",
+        "b/old.html": None,
+        "c/new.html": b"<link rel=mismatch href=/a/ref-ref.html>",
+    })
+
+    with mock.patch.object(vcs.Git, "_all_files") as all_files:
+        m = load_and_update(git_root, manifest_path)
+        assert not all_files.called
+
+    expected = load_and_update(git_root, str(tmpdir.join("expected.json")), rebuild=True)
+    assert items_json(m) == items_json(expected)
+    assert m.commit == expected.commit
+    assert [path for _, path, _ in m.itertypes("testharness")] == [
+        "a/ref.html", "a/test.html", "b/test.any.js"]
+    assert [path for _, path, _ in m.itertypes("reftest")] == ["c/new.html"]
+
+
+@py2_only
+def test_git_metadata_cache(tmpdir, git_root):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    metadata_path = os.path.join(git_root, ".wptcache", "metadata.json")
+    with mock.patch.object(sourcefile.SourceFile, "metadata_cache", sourcefile.MetadataCache()):
+        load_and_update(git_root, manifest_path)
+        with open(metadata_path) as f:
+            assert os.path.join("b", "old.html") in json.load(f)
+
+        # Entries for deleted files are dropped
+        commit_tree(git_root, {"b/old.html": None})
+        load_and_update(git_root, manifest_path)
+    with open(metadata_path) as f:
+        assert sorted(json.load(f)) == ["/version",
+                                        os.path.join("a", "ref-ref.html"),
+                                        os.path.join("a", "ref.html"),
+                                        os.path.join("a", "test.html"),
+                                        os.path.join("b", "test.any.js")]
+
+
+@py2_only
+def test_git_unchanged(tmpdir, git_root):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    load_and_update(git_root, manifest_path)
+    os.utime(manifest_path, (1000000000, 1000000000))
+
+    with mock.patch.object(vcs, "SourceFile") as source_file:
+        load_and_update(git_root, manifest_path)
+        assert not source_file.called
+    assert os.path.getmtime(manifest_path) == 1000000000
+
+
+@py2_only
+def test_git_keeps_format(tmpdir, git_root):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    load_and_update(git_root, manifest_path, compact_format=True)
+    assert compact.is_compact_file(manifest_path)
+    os.utime(manifest_path, (1000000000, 1000000000))
+
+    # An unchanged manifest isn't written back in another format unless
+    # one is asked for
+    load_and_update(git_root, manifest_path)
+    assert compact.is_compact_file(manifest_path)
+    assert os.path.getmtime(manifest_path) == 1000000000
+
+    load_and_update(git_root, manifest_path, compact_format=False)
+    assert not compact.is_compact_file(manifest_path)
+
+
+@py2_only
+def test_git_local_changes(tmpdir, git_root):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    load_and_update(git_root, manifest_path)
+
+    commit_tree(git_root, {"a/test.html": b"<script src=/resources/testharness.js></script>"
+                                          b"<meta name=timeout content=long>"})
+    # The manifest is built from HEAD, so uncommitted changes are ignored
+    with open(os.path.join(git_root, "a", "test.html"), "wb") as f:
+        f.write(b"<p>Not a test</p>")
+
+    m = load_and_update(git_root, manifest_path)
+    test, = m.iterpath(os.path.join("a", "test.html"))
+    assert test.item_type == "testharness"
+    assert test.timeout == "long"
+
+
+@py2_only
+def test_git_missing_commit(tmpdir, git_root):
+    manifest_path = str(tmpdir.join("MANIFEST.json"))
+    m = load_and_update(git_root, manifest_path)
+    m.commit = "0" * 40
+    manifest.write(m, manifest_path)
+
+    commit_tree(git_root, {"b/old.html": None})
+
+    with mock.patch.object(vcs.Git, "_all_files", autospec=True,
+                           side_effect=vcs.Git._all_files) as all_files:
+        m = load_and_update(git_root, manifest_path)
+        assert all_files.called
+    expected = load_and_update(git_root, str(tmpdir.join("expected.json")), rebuild=True)
+    assert items_json(m) == items_json(expected)
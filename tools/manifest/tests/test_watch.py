@@ -0,0 +1,165 @@
+import json
+import os
+import platform
+import shutil
+import sys
+import threading
+import time
+
+import pytest
+
+from gitignore import gitignore
+from .. import watch
+
+py2_only = pytest.mark.xfail(sys.version_info >= (3,),
+                             reason="SourceFile.hash only works on Py2")
+
+testharness = "<script src=/resources/testharness.js></script>"
+
+
+def write_files(root, files):
+    for path, content in files.items():
+        path = os.path.join(root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+
+@pytest.fixture
+def tests_root(tmpdir):
+    root = str(tmpdir.join("tests"))
+    write_files(root, {".gitignore": "*.pyc\n",
+                       "a/test.html": testharness,
+                       "b/support.js": ""})
+    return root
+
+
+def get_watcher(tmpdir, tests_root, **kwargs):
+    return watch.ManifestWatcher(tests_root,
+                                 str(tmpdir.join("MANIFEST.json")),
+                                 cache_root=str(tmpdir.join("cache")),
+                                 **kwargs)
+
+
+def item_paths(m):
+    return sorted((item_type, path) for item_type, path, _ in m)
+
+
+@py2_only
+def test_update_changed_paths(tmpdir, tests_root):
+    watcher = get_watcher(tmpdir, tests_root)
+    calls = []
+    watcher.subscribe(calls.append)
+    assert item_paths(watcher.manifest) == [("support", ".gitignore"),
+                                            ("support", os.path.join("b", "support.js")),
+                                            ("testharness", os.path.join("a", "test.html"))]
+
+    write_files(tests_root, {"a/new.html": testharness,
+                             "c/d/test.html": testharness})
+    assert watcher.update([os.path.join("a", "new.html"), "c"]) is True
+    assert calls == [watcher.manifest]
+    assert ("testharness", os.path.join("a", "new.html")) in item_paths(watcher.manifest)
+    assert ("testharness", os.path.join("c", "d", "test.html")) in item_paths(watcher.manifest)
+    with open(str(tmpdir.join("MANIFEST.json"))) as f:
+        assert "a/new.html" in json.load(f)["items"]["testharness"]
+
+    shutil.rmtree(os.path.join(tests_root, "b"))
+    assert watcher.update(["b"]) is True
+    assert ("support", os.path.join("b", "support.js")) not in item_paths(watcher.manifest)
+
+    write_files(tests_root, {"a/ignored.pyc": ""})
+    assert watcher.update([os.path.join("a", "ignored.pyc")]) is False
+    assert len(calls) == 2
+
+    # The incremental updates match checking the whole tree
+    assert watcher.update(None) is False
+    expected = get_watcher(tmpdir, tests_root, write_manifest=False, rebuild=True)
+    assert watcher.manifest.to_json() == expected.manifest.to_json()
+
+
+class QueueMonitor(object):
+    def __init__(self, changes):
+        self.changes = changes
+        self.closed = False
+
+    def wait(self, timeout):
+        if self.changes:
+            return self.changes.pop(0)
+        threading.Event().wait(timeout)
+        return set()
+
+    def close(self):
+        self.closed = True
+
+
+@py2_only
+def test_watcher_thread(tmpdir, tests_root):
+    monitor = QueueMonitor([set(), set([os.path.join("a", "new.html")])])
+    watcher = get_watcher(tmpdir, tests_root, interval=0.01,
+                          monitor_cls=lambda root, path_filter: monitor)
+    write_files(tests_root, {"a/new.html": testharness})
+    updated = threading.Event()
+    watcher.subscribe(lambda manifest: updated.set())
+
+    watcher.start()
+    try:
+        assert updated.wait(10)
+    finally:
+        watcher.stop()
+    assert monitor.closed
+    with watcher.lock:
+        assert ("testharness", os.path.join("a", "new.html")) in item_paths(watcher.manifest)
+
+
+@py2_only
+@pytest.mark.skipif(platform.system() != "Linux", reason="inotify is only available on Linux")
+def test_watcher_output_in_tests_root(tests_root):
+    watcher = watch.ManifestWatcher(tests_root,
+                                    os.path.join(tests_root, "MANIFEST.json"),
+                                    cache_root=os.path.join(tests_root, ".wptcache"),
+                                    interval=0.1)
+    updated = threading.Event()
+    calls = []
+
+    def on_update(manifest):
+        calls.append(manifest)
+        updated.set()
+
+    watcher.subscribe(on_update)
+    watcher.start()
+    try:
+        write_files(tests_root, {"a/test.html": testharness + "<meta name=timeout content=long>"})
+        assert updated.wait(10)
+        # Writing the manifest and the caches doesn't cause another update
+        time.sleep(1)
+    finally:
+        watcher.stop()
+    assert len(calls) == 1
+
+    paths = [path for _, path in item_paths(watcher.manifest)]
+    assert "MANIFEST.json" not in paths
+    assert not [path for path in paths if path.startswith(".wptcache")]
+    assert watcher.update(None) is False
+
+
+@pytest.mark.skipif(platform.system() != "Linux", reason="inotify is only available on Linux")
+def test_inotify_monitor(tests_root):
+    path_filter = gitignore.PathFilter(tests_root, extras=[".git/"])
+    monitor = watch.InotifyMonitor(tests_root, path_filter)
+    try:
+        assert monitor.wait(0) == set()
+
+        write_files(tests_root, {"a/new.html": ""})
+        assert monitor.wait(5) == {os.path.join("a", "new.html")}
+
+        os.makedirs(os.path.join(tests_root, "c"))
+        assert monitor.wait(5) == {"c"}
+        # New directories are watched
+        write_files(tests_root, {"c/test.html": ""})
+        assert monitor.wait(5) == {os.path.join("c", "test.html")}
+
+        shutil.rmtree(os.path.join(tests_root, "b"))
+        assert monitor.wait(5) == {"b", os.path.join("b", "support.js")}
+    finally:
+        monitor.close()
@@ -25,7 +25,11 @@ def update(tests_root,
 
     tree = vcs.get_tree(tests_root, manifest, manifest_path, cache_root,
                         working_copy, rebuild)
-    return manifest.update(tree)
+    changed = manifest.update(tree)
+    if manifest.commit != tree.commit:
+        manifest.commit = tree.commit
+        changed = True
+    return changed
 
 
 def update_from_cli(**kwargs):
@@ -36,13 +40,27 @@ def update_from_cli(**kwargs):
     if kwargs["download"]:
         download_from_github(path, tests_root)
 
+    if kwargs["watch"]:
+        from .watch import ManifestWatcher
+        watcher = ManifestWatcher(tests_root,
+                                  path,
+                                  kwargs["url_base"],
+                                  cache_root=kwargs["cache_root"],
+                                  rebuild=kwargs["rebuild"],
+                                  compact_format=kwargs["compact"])
+        logger.info("Watching for changes")
+        watcher.run()
+        return
+
     manifest.load_and_update(tests_root,
                              path,
                              kwargs["url_base"],
                              update=True,
                              rebuild=kwargs["rebuild"],
                              cache_root=kwargs["cache_root"],
-                             working_copy=kwargs["work"])
+                             working_copy=kwargs["work"],
+                             jobs=kwargs["jobs"],
+                             compact_format=kwargs["compact"])
 
 
 def abs_path(path):
@@ -68,8 +86,22 @@ def create_parser():
         "--no-download", dest="download", action="store_false", default=True,
         help="Never attempt to download the manifest.")
     parser.add_argument(
-        "--cache-root", action="store", default=os.path.join(wpt_root, ".wptcache"),
+        "--cache-root", action="store", default=vcs.default_cache_root(wpt_root),
         help="Path in which to store any caches (default <tests_root>/.wptcache/")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help="Number of processes to use when classifying updated files (default 1)")
+    parser.add_argument(
+        "--compact", action="store_true", default=None,
+        help="Write the manifest in the compact format rather than JSON, which is faster "
+        "to load but can't be read by tools that expect JSON (default: keep the format "
+        "of the existing manifest)")
+    parser.add_argument(
+        "--no-compact", action="store_false", dest="compact",
+        help="Write the manifest as JSON, converting a compact manifest")
+    parser.add_argument(
+        "--watch", action="store_true", default=False,
+        help="Keep running, updating the manifest from the working tree as files change")
     return parser
 
 
@@ -1,30 +1,62 @@
 import json
 import os
 import platform
+import re
 import stat
 import subprocess
+import time
 from collections import deque
 
-from .sourcefile import SourceFile
+from six import iteritems
+
+from .sourcefile import SourceFile, file_blob_hash, metadata_version
+from .utils import from_os_path
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def default_cache_root(tests_root):
+    return os.path.join(tests_root, ".wptcache")
+
+
+def ensure_cache_root(cache_root):
+    """Create a cache directory if it doesn't exist.
+
+    The directory contains a .gitignore ignoring everything in it, so
+    that a cache kept inside the repository isn't seen as new files by
+    git, or by the lint and tests-affected, which use git to find changed
+    files."""
+    if not os.path.exists(cache_root):
+        os.makedirs(cache_root)
+    ignore_path = os.path.join(cache_root, ".gitignore")
+    if not os.path.exists(ignore_path):
+        with open(ignore_path, "w") as f:
+            f.write("*\n")
 
 
 def get_tree(tests_root, manifest, manifest_path, cache_root,
              working_copy=False, rebuild=False):
     tree = None
     if cache_root is None:
-        cache_root = os.path.join(tests_root, ".wptcache")
-    if not os.path.exists(cache_root):
-        try:
-            os.makedirs(cache_root)
-        except IOError:
-            cache_root = None
+        cache_root = default_cache_root(tests_root)
+    try:
+        ensure_cache_root(cache_root)
+    except (IOError, OSError):
+        cache_root = None
 
     if not working_copy:
         tree = Git.for_path(tests_root,
                             manifest.url_base,
                             manifest_path=manifest_path,
                             cache_path=cache_root,
-                            rebuild=rebuild)
+                            rebuild=rebuild,
+                            manifest=manifest)
     if tree is None:
         tree = FileSystem(tests_root,
                           manifest.url_base,
@@ -34,112 +66,259 @@ def get_tree(tests_root, manifest, manifest_path, cache_root,
     return tree
 
 
+def _rel_path(tests_root, path):
+    rel_path = os.path.relpath(os.path.abspath(path), tests_root)
+    if rel_path == os.curdir or rel_path.split(os.path.sep)[0] == os.pardir:
+        return None
+    return rel_path
+
+
+def output_paths(tests_root, manifest_path=None, cache_root=None):
+    """Get the paths written when updating a manifest that are under
+    tests_root, so that they aren't treated as part of the tree.
+
+    :returns: Tuple of (path of the manifest, prefix of the temporary files
+              used to write the manifest, path of the cache directory),
+              relative to tests_root, with None for paths outside it"""
+    tests_root = os.path.abspath(tests_root)
+    manifest_rel_path = temp_prefix = cache_rel_path = None
+    if manifest_path is not None:
+        manifest_rel_path = _rel_path(tests_root, manifest_path)
+        if manifest_rel_path is not None:
+            dir_name, name = os.path.split(manifest_rel_path)
+            # Matches the temporary files created by manifest.write
+            temp_prefix = os.path.join(dir_name, ".%s." % name)
+    if cache_root is not None:
+        cache_rel_path = _rel_path(tests_root, cache_root)
+    return manifest_rel_path, temp_prefix, cache_rel_path
+
+
+def output_patterns(tests_root, manifest_path=None, cache_root=None):
+    """Get gitignore-style rules matching the paths from
+    :func:`output_paths`"""
+    def pattern(rel_path, suffix=""):
+        path = re.sub(r"([\\*?\[!#])", r"\\\1", from_os_path(rel_path)) + suffix
+        # Rules containing a / are relative to the root
+        return path if "/" in path.rstrip("/") else "/" + path
+
+    manifest_rel_path, temp_prefix, cache_rel_path = output_paths(tests_root,
+                                                                  manifest_path,
+                                                                  cache_root)
+    rv = []
+    if manifest_rel_path is not None:
+        rv.extend([pattern(manifest_rel_path), pattern(temp_prefix, "*")])
+    if cache_rel_path is not None:
+        rv.append(pattern(cache_rel_path, "/"))
+    return rv
+
+
 class Git(object):
+    """Tree containing the files in the HEAD commit of a git repository.
+
+    If a manifest built from an earlier commit is supplied, only the files
+    that differ between that commit and HEAD are yielded as needing an
+    update; every other file already in the manifest is yielded as not
+    needing an update, and files deleted since that commit are omitted."""
+
     def __init__(self, repo_root, url_base, cache_path, manifest_path=None,
-                 rebuild=False):
+                 rebuild=False, manifest=None):
         self.root = repo_root
         self.git = Git.get_func(repo_root)
         self.url_base = url_base
-        # rebuild is a noop for now since we don't cache anything
+        self.commit = self.git("rev-parse", "HEAD").strip()
+        self.manifest = manifest if not rebuild else None
+        self.metadata_cache = None
+        if cache_path is not None:
+            self.metadata_cache = MetadataCacheFile(cache_path, repo_root, rebuild)
 
     @staticmethod
     def get_func(repo_path):
         def git(cmd, *args):
             full_cmd = ["git", cmd] + list(args)
             try:
-                return subprocess.check_output(full_cmd, cwd=repo_path, stderr=subprocess.STDOUT)
+                rv = subprocess.check_output(full_cmd, cwd=repo_path, stderr=subprocess.STDOUT)
             except Exception as e:
                 if platform.uname()[0] == "Windows" and isinstance(e, WindowsError):
                         full_cmd[0] = "git.bat"
-                        return subprocess.check_output(full_cmd, cwd=repo_path, stderr=subprocess.STDOUT)
+                        rv = subprocess.check_output(full_cmd, cwd=repo_path, stderr=subprocess.STDOUT)
                 else:
                     raise
+            if not isinstance(rv, str):
+                rv = rv.decode("utf8")
+            return rv
         return git
 
     @classmethod
-    def for_path(cls, path, url_base, cache_path, manifest_path=None, rebuild=False):
+    def for_path(cls, path, url_base, cache_path, manifest_path=None, rebuild=False,
+                 manifest=None):
         git = Git.get_func(path)
         try:
             return cls(git("rev-parse", "--show-toplevel").rstrip(), url_base, cache_path,
-                       manifest_path=manifest_path, rebuild=rebuild)
+                       manifest_path=manifest_path, rebuild=rebuild, manifest=manifest)
         except (subprocess.CalledProcessError, OSError):
             return None
 
     def _local_changes(self):
-        changes = {}
-        cmd = ["status", "-z", "--ignore-submodules=all"]
+        """Set of paths that differ between HEAD and the working tree
+        or index"""
+        changes = set()
+        cmd = ["status", "-z", "--ignore-submodules=all", "--untracked-files=no"]
         data = self.git(*cmd)
 
-        if data == "":
-            return changes
+        entries = iter(data.split("\0")[:-1])
+        for entry in entries:
+            status, rel_path = entry[:2], entry[3:]
+            changes.add(rel_path)
+            if status[0] in ("R", "C"):
+                # The next entry is the path the file was renamed or copied from
+                changes.add(next(entries))
+        return changes
 
-        rename_data = None
-        for entry in data.split("\0")[:-1]:
-            if rename_data is not None:
-                status, rel_path = entry.split(" ")
-                if status[0] == "R":
-                    rename_data = (rel_path, status)
-                else:
-                    changes[rel_path] = (status, None)
+    def _read_blobs(self, hashes):
+        """Read the contents of a set of blobs with a single git process.
+
+        :returns: Dict of {hash: contents}"""
+        rv = {}
+        if not hashes:
+            return rv
+        hashes = sorted(hashes)
+        proc = subprocess.Popen(["git", "cat-file", "--batch"], cwd=self.root,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        data, _ = proc.communicate("".join("%s\n" % item for item in hashes).encode("ascii"))
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, "git cat-file --batch")
+
+        pos = 0
+        for item in hashes:
+            header_end = data.index(b"\n", pos)
+            header = data[pos:header_end].split()
+            if header[-1] == b"missing":
+                raise ValueError("Blob %s not found" % item)
+            size = int(header[2])
+            rv[item] = data[header_end + 1:header_end + 1 + size]
+            pos = header_end + size + 2
+        return rv
+
+    def _changes_since(self, commit):
+        """Get the files that changed between a commit and HEAD.
+
+        :returns: Tuple of ({path: blob hash} for added or modified files,
+                  set of deleted paths), or None if the commit isn't
+                  available e.g. because history was rewritten and it was
+                  garbage collected"""
+        try:
+            self.git("cat-file", "-e", "%s^{commit}" % commit)
+        except subprocess.CalledProcessError:
+            return None
+
+        changed = {}
+        deleted = set()
+        data = self.git("diff", "--raw", "-z", "--no-renames", "--no-abbrev",
+                        "--no-ext-diff", "--no-textconv", commit, self.commit)
+        entries = iter(data.split("\0")[:-1])
+        for entry in entries:
+            rel_path = next(entries)
+            _, _, _, new_hash, status = entry.split(" ")
+            if status == "D":
+                deleted.add(rel_path)
             else:
-                rel_path = entry
-                changes[rel_path] = rename_data
-                rename_data = None
-        return changes
+                changed[rel_path] = new_hash
+        return changed, deleted
 
-    def _show_file(self, path):
-        path = os.path.relpath(os.path.abspath(path), self.root)
-        return self.git("show", "HEAD:%s" % path)
+    def _all_files(self):
+        rv = {}
+        for result in self.git("ls-tree", "-r", "-z", self.commit).split("\0")[:-1]:
+            rel_path = result.split("\t")[-1]
+            hash = result.split()[2]
+            rv[rel_path] = hash
+        return rv
 
     def __iter__(self):
-        cmd = ["ls-tree", "-r", "-z", "HEAD"]
+        changes = None
+        if self.manifest is not None and self.manifest.commit is not None:
+            changes = self._changes_since(self.manifest.commit)
+
+        seen = set()
+        if changes is None:
+            updated = self._all_files()
+        else:
+            updated, deleted = changes
+            for rel_path in sorted(self.manifest.paths()):
+                git_path = from_os_path(rel_path)
+                if git_path not in updated and git_path not in deleted:
+                    seen.add(rel_path)
+                    yield rel_path, False
+
+        # Files that are modified on disk have to be read from git
         local_changes = self._local_changes()
-        for result in self.git(*cmd).split("\0")[:-1]:
-            rel_path = result.split("\t")[-1]
-            hash = result.split()[2]
+        contents = self._read_blobs({hash for rel_path, hash in iteritems(updated)
+                                     if rel_path in local_changes})
+
+        for rel_path, hash in sorted(iteritems(updated)):
             if not os.path.isdir(os.path.join(self.root, rel_path)):
-                if rel_path in local_changes:
-                    contents = self._show_file(rel_path)
-                else:
-                    contents = None
-                yield SourceFile(self.root,
-                                 rel_path,
-                                 self.url_base,
-                                 hash,
-                                 contents=contents), True
+                source_file = SourceFile(self.root,
+                                         rel_path,
+                                         self.url_base,
+                                         hash,
+                                         contents=contents.get(hash))
+                seen.add(source_file.rel_path)
+                yield source_file, True
+
+        if self.metadata_cache is not None:
+            self.metadata_cache.retain(seen)
 
     def dump_caches(self):
-        pass
+        if self.metadata_cache is not None:
+            self.metadata_cache.dump()
 
 
 class FileSystem(object):
     def __init__(self, root, url_base, cache_path, manifest_path=None, rebuild=False):
         from gitignore import gitignore
         self.root = os.path.abspath(root)
+        # The working tree doesn't correspond to a commit
+        self.commit = None
         self.url_base = url_base
-        self.ignore_cache = None
         self.mtime_cache = None
+        self.dir_cache = None
+        self.hash_cache = None
+        self.metadata_cache = None
+        # The manifest and caches may be written inside the tree
+        extras = [".git/"] + output_patterns(self.root, manifest_path, cache_path)
         if cache_path is not None:
             if manifest_path is not None:
                 self.mtime_cache = MtimeCache(cache_path, root, manifest_path, rebuild)
-            if gitignore.has_ignore(root):
-                self.ignore_cache = GitIgnoreCache(cache_path, root, rebuild)
-        self.path_filter = gitignore.PathFilter(self.root,
-                                                extras=[".git/"],
-                                                cache=self.ignore_cache)
+            self.dir_cache = DirectoryCache(cache_path, root, rebuild, extras=extras)
+            self.hash_cache = HashCache(cache_path, root, rebuild)
+            self.metadata_cache = MetadataCacheFile(cache_path, self.root, rebuild)
+        self.path_filter = gitignore.PathFilter(self.root, extras=extras)
 
     def __iter__(self):
         mtime_cache = self.mtime_cache
-        for dirpath, dirnames, filenames in self.path_filter(walk(self.root)):
+        hash_cache = self.hash_cache
+        if self.dir_cache is not None:
+            tree = self.dir_cache.walk(self.root, self.path_filter)
+        else:
+            tree = self.path_filter(walk(self.root))
+        seen = set()
+        for dirpath, dirnames, filenames in tree:
             for filename, path_stat in filenames:
                 path = os.path.join(dirpath, filename)
+                seen.add(path)
                 if mtime_cache is None or mtime_cache.updated(path, path_stat):
-                    yield SourceFile(self.root, path, self.url_base), True
+                    if hash_cache is None:
+                        yield SourceFile(self.root, path, self.url_base), True
+                    else:
+                        yield hash_cache.source_file(path, path_stat, self.url_base), True
                 else:
                     yield path, False
+        if hash_cache is not None:
+            hash_cache.retain(seen)
+        if self.metadata_cache is not None:
+            self.metadata_cache.retain(seen)
 
     def dump_caches(self):
-        for cache in [self.mtime_cache, self.ignore_cache]:
+        for cache in [self.mtime_cache, self.dir_cache, self.hash_cache, self.metadata_cache]:
             if cache is not None:
                 cache.dump()
 
@@ -149,8 +328,7 @@ class CacheFile(object):
 
     def __init__(self, cache_root, tests_root, rebuild=False):
         self.tests_root = tests_root
-        if not os.path.exists(cache_root):
-            os.makedirs(cache_root)
+        ensure_cache_root(cache_root)
         self.path = os.path.join(cache_root, self.file_name)
         self.modified = False
         self.data = self.load(rebuild)
@@ -183,7 +361,7 @@ class MtimeCache(CacheFile):
 
     def __init__(self, cache_root, tests_root, manifest_path, rebuild=False):
         self.manifest_path = manifest_path
-        super(MtimeCache, self).__init__(cache_root, tests_root, rebuild=False)
+        super(MtimeCache, self).__init__(cache_root, tests_root, rebuild=rebuild)
 
     def updated(self, rel_path, stat):
         """Return a boolean indicating whether the file changed since the cache was last updated.
@@ -222,28 +400,266 @@ class MtimeCache(CacheFile):
         super(MtimeCache, self).dump()
 
 
-class GitIgnoreCache(CacheFile):
-    file_name = "gitignore.json"
+class DirectoryCache(CacheFile):
+    """Cache of the filtered contents of each directory in the tree.
+
+    Adding, removing or renaming an entry in a directory updates the
+    mtime of the directory, so as long as that is unchanged the cached
+    listing can be used rather than reading the directory and matching
+    every entry against the ignore rules again. Modifying a file doesn't
+    update the directory mtime, so the files themselves are still
+    stat'd each time."""
+    file_name = "directories.json"
+
+    # Directories modified this recently (in seconds) aren't cached, since
+    # a further change in the same mtime tick wouldn't be noticed
+    racy_interval = 2
+
+    def __init__(self, cache_root, tests_root, rebuild=False, extras=None):
+        # The cached listings are filtered, so they depend on the ignore file
+        # and any extra rules
+        ignore_path = os.path.join(tests_root, ".gitignore")
+        if os.path.exists(ignore_path):
+            self.gitignore_file = [ignore_path, os.path.getmtime(ignore_path)]
+        else:
+            self.gitignore_file = [ignore_path, None]
+        self.extras = list(extras) if extras is not None else []
+        super(DirectoryCache, self).__init__(cache_root, tests_root, rebuild=rebuild)
+
+    def check_valid(self, data):
+        if (data.get("/tests_root") != self.tests_root or
+            data.get("/gitignore_file") != self.gitignore_file or
+            data.get("/extras", []) != self.extras):
+            self.modified = True
+            data = {}
+        return data
+
+    def dump(self):
+        self.data["/tests_root"] = self.tests_root
+        self.data["/gitignore_file"] = self.gitignore_file
+        self.data["/extras"] = self.extras
+        super(DirectoryCache, self).dump()
+
+    def walk(self, root, path_filter):
+        """Iterate over the filtered tree under root.
+
+        This yields (dirpath, dirnames, filenames) in the same form as
+        passing the output of :func:`walk` through path_filter, except
+        that the stat for each directory is None. The cache is updated
+        as the walk proceeds."""
+        root = os.path.abspath(root)
+        join = os.path.join
+        get_stat = os.stat
+        racy_mtime = time.time() - self.racy_interval
+
+        seen = set()
+        stack = deque([""])
+        while stack:
+            rel_path = stack.popleft()
+            dir_path = join(root, rel_path)
+            try:
+                dir_mtime = get_stat(dir_path).st_mtime
+            except OSError:
+                continue
+
+            seen.add(rel_path)
+            cached = self.data.get(rel_path)
+            if cached is not None and cached[0] == dir_mtime:
+                dir_names, file_names = cached[1], cached[2]
+            else:
+                try:
+                    entries = list_dir(dir_path)
+                except OSError:
+                    continue
+                dirs = [(name, None) for name, is_dir in entries if is_dir]
+                files = [(name, None) for name, is_dir in entries if not is_dir]
+                _, dirs, files = next(iter(path_filter([(rel_path, dirs, files)])))
+                dir_names = [name for name, _cached in dirs]
+                file_names = [name for name, _cached in files]
+                if dir_mtime < racy_mtime:
+                    self.data[rel_path] = [dir_mtime, dir_names, file_names]
+                    self.modified = True
+                elif cached is not None:
+                    del self.data[rel_path]
+                    self.modified = True
+
+            prefix = join(dir_path, "")
+            filenames = []
+            for name in file_names:
+                try:
+                    filenames.append((name, get_stat(prefix + name)))
+                except OSError:
+                    continue
+
+            dirnames = [(name, None) for name in dir_names]
+            yield rel_path, dirnames, filenames
+            for name, _ in dirnames:
+                stack.append(join(rel_path, name))
+
+        # Drop entries for directories that no longer exist
+        for key in list(self.data.keys()):
+            if not key.startswith("/") and key not in seen:
+                del self.data[key]
+                self.modified = True
+
+
+class HashCache(CacheFile):
+    """Cache of the git blob hash of each file's contents.
+
+    Entries are keyed on the inode, size and mtime of the file, so they
+    stay valid when the manifest or the mtime cache are rebuilt, and
+    files that are unchanged don't have to be read again to find that
+    their hash matches the one in the manifest. The cache is shared with
+    other tools that need to know if a file changed, such as lint."""
+    file_name = "hashes.json"
+
+    # Files modified this recently (in seconds) aren't cached, since a
+    # further change in the same mtime tick wouldn't be noticed
+    racy_interval = 2
+
+    def __init__(self, cache_root, tests_root, rebuild=False):
+        # SourceFiles whose hash might be computed after they're returned
+        self._pending = []
+        super(HashCache, self).__init__(cache_root, tests_root, rebuild=rebuild)
 
     def check_valid(self, data):
-        ignore_path = os.path.join(self.tests_root, ".gitignore")
-        mtime = os.path.getmtime(ignore_path)
-        if data.get("/gitignore_file") != [ignore_path, mtime]:
+        if data.get("/tests_root") != self.tests_root:
             self.modified = True
             data = {}
-            data["/gitignore_file"] = [ignore_path, mtime]
         return data
 
-    def __contains__(self, key):
-        return key in self.data
+    @staticmethod
+    def _key(path_stat):
+        mtime_ns = getattr(path_stat, "st_mtime_ns", None)
+        if mtime_ns is None:
+            mtime_ns = int(path_stat.st_mtime * 1e9)
+        return [path_stat.st_ino, path_stat.st_size, mtime_ns]
+
+    def _cacheable(self, path_stat):
+        return path_stat.st_mtime < time.time() - self.racy_interval
+
+    def get(self, rel_path, path_stat):
+        """Get the cached hash of a file, or None if the file changed
+        since it was cached."""
+        cached = self.data.get(rel_path)
+        if cached is not None and cached[:3] == self._key(path_stat):
+            return cached[3]
+        return None
+
+    def set(self, rel_path, path_stat, file_hash):
+        if not self._cacheable(path_stat):
+            if rel_path in self.data:
+                del self.data[rel_path]
+                self.modified = True
+            return
+        value = self._key(path_stat) + [file_hash]
+        if self.data.get(rel_path) != value:
+            self.data[rel_path] = value
+            self.modified = True
+
+    def hash(self, rel_path, path_stat=None):
+        """Get the hash of a file, reading it only if it isn't cached.
+
+        :param rel_path: Path to the file relative to the tests root
+        :param path_stat: Result of os.stat for the file, if known"""
+        if path_stat is None:
+            path_stat = os.stat(os.path.join(self.tests_root, rel_path))
+        file_hash = self.get(rel_path, path_stat)
+        if file_hash is None:
+            file_hash = file_blob_hash(os.path.join(self.tests_root, rel_path))
+            self.set(rel_path, path_stat, file_hash)
+        return file_hash
+
+    def source_file(self, rel_path, path_stat, url_base):
+        """Get a SourceFile for a path, with its hash filled in from the
+        cache if possible. Otherwise the hash is added to the cache on
+        :meth:`dump` if it was computed by then."""
+        file_hash = self.get(rel_path, path_stat)
+        source_file = SourceFile(self.tests_root, rel_path, url_base, file_hash)
+        if file_hash is None:
+            self._pending.append((source_file, path_stat))
+        return source_file
+
+    def retain(self, rel_paths):
+        """Drop the entries for files not in rel_paths"""
+        for key in list(self.data.keys()):
+            if not key.startswith("/") and key not in rel_paths:
+                del self.data[key]
+                self.modified = True
+
+    def dump(self):
+        for source_file, path_stat in self._pending:
+            if source_file._hash:
+                self.set(source_file.rel_path, path_stat, source_file._hash)
+        self._pending = []
+        self.data["/tests_root"] = self.tests_root
+        super(HashCache, self).dump()
+
+
+class MetadataCacheFile(CacheFile):
+    """On-disk copy of a :class:`sourcefile.MetadataCache`.
 
-    def __getitem__(self, key):
-        return self.data[key]
+    The entries are loaded into the in-memory cache, which is written
+    back when it has changed, so that files are only parsed again when
+    they change, including across different tools, e.g. a manifest
+    update after running the lint on the changed files. Only the entries
+    for the files under tests_root are stored. The whole cache is dropped
+    when the result of :func:`sourcefile.metadata_version` changes."""
+    file_name = "metadata.json"
 
-    def __setitem__(self, key, value):
-        if self.data.get(key) != value:
+    def __init__(self, cache_root, tests_root, rebuild=False, metadata_cache=None):
+        if metadata_cache is None:
+            metadata_cache = SourceFile.metadata_cache
+        self.metadata_cache = metadata_cache
+        self.version = metadata_version()
+        super(MetadataCacheFile, self).__init__(cache_root, tests_root, rebuild=rebuild)
+        self.metadata_cache.update(self.tests_root, self.data)
+
+    def check_valid(self, data):
+        if data.pop("/version", None) != self.version:
+            self.modified = True
+            data = {}
+        return data
+
+    def retain(self, rel_paths):
+        """Drop the entries for files not in rel_paths"""
+        self.metadata_cache.retain(self.tests_root, rel_paths)
+
+    def dump(self):
+        if self.metadata_cache.modified:
             self.modified = True
-            self.data[key] = value
+        if self.modified:
+            self.data = dict(self.metadata_cache.entries(self.tests_root))
+            self.data["/version"] = self.version
+        super(MetadataCacheFile, self).dump()
+        self.modified = False
+        self.metadata_cache.modified = False
+
+
+def list_dir(path):
+    """Return a list of (name, is_dir) for the entries in a directory,
+    following symlinks.
+
+    Where scandir is available the file type is taken from the directory
+    entry, so entries other than symlinks don't need to be stat'd."""
+    if scandir is not None:
+        rv = []
+        for entry in scandir(path):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            rv.append((entry.name, is_dir))
+        return rv
+
+    rv = []
+    for name in os.listdir(path):
+        try:
+            path_stat = os.stat(os.path.join(path, name))
+        except OSError:
+            continue
+        rv.append((name, stat.S_ISDIR(path_stat.st_mode)))
+    return rv
 
 
 def walk(root):
@@ -260,13 +676,11 @@ def walk(root):
 
     Unlike os.walk the implementation is not recursive."""
 
-    listdir = os.listdir
     get_stat = os.stat
     listdir = os.listdir
     join = os.path.join
     is_dir = stat.S_ISDIR
     is_link = stat.S_ISLNK
-    relpath = os.path.relpath
 
     root = os.path.abspath(root)
     stack = deque([(root, "")])
@@ -274,17 +688,22 @@ def walk(root):
     while stack:
         dir_path, rel_path = stack.popleft()
         try:
-            # Note that listdir and error are globals in this module due
-            # to earlier import-*.
-            names = listdir(dir_path)
+            if scandir is not None:
+                # DirEntry.stat() follows symlinks like os.stat, and
+                # is free on Windows
+                entries = [(entry.name, entry.stat) for entry in scandir(dir_path)]
+            else:
+                entries = [(name, None) for name in listdir(dir_path)]
         except OSError:
             continue
 
         dirs, non_dirs = [], []
-        for name in names:
-            path = join(dir_path, name)
+        for name, entry_stat in entries:
             try:
-                path_stat = get_stat(path)
+                if entry_stat is not None:
+                    path_stat = entry_stat()
+                else:
+                    path_stat = get_stat(join(dir_path, name))
             except OSError:
                 continue
             if is_dir(path_stat.st_mode):
@@ -294,6 +713,5 @@ def walk(root):
 
         yield rel_path, dirs, non_dirs
         for name, path_stat in dirs:
-            new_path = join(dir_path, name)
             if not is_link(path_stat.st_mode):
-                stack.append((new_path, relpath(new_path, root)))
+                stack.append((join(dir_path, name), join(rel_path, name)))
@@ -0,0 +1,411 @@
+"""Keep an in-memory manifest up to date as files change.
+
+A :class:`ManifestWatcher` loads the manifest for a working tree and then
+waits for files to change, applying the changes with Manifest.update,
+writing the manifest back and notifying subscribers. Changes are found
+with inotify on Linux, where only the changed paths need to be looked at,
+and otherwise by periodically checking the whole tree using the same
+caches as ``wpt manifest``.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import platform
+import select
+import struct
+import sys
+import threading
+import time
+import traceback
+
+from gitignore import gitignore
+from . import compact, manifest, vcs
+from .log import get_logger
+from .sourcefile import SourceFile
+
+
+class PollingMonitor(object):
+    """Monitor that doesn't know which paths changed, so reports that
+    the whole tree might have changed after each interval."""
+
+    def __init__(self, tests_root, path_filter):
+        pass
+
+    def wait(self, timeout):
+        """Wait for paths to change.
+
+        :param timeout: Maximum time to wait in seconds
+        :returns: Set of the paths that changed, relative to the tests
+                  root, or None if any path might have changed."""
+        time.sleep(timeout)
+        return None
+
+    def close(self):
+        pass
+
+
+class InotifyMonitor(object):
+    """Monitor for changes using inotify, which is only available on
+    Linux.
+
+    Every directory in the tree that isn't ignored is watched. Changes
+    are reported once there have been none for settle seconds, so that
+    a burst of changes is handled together."""
+
+    # Values from <sys/inotify.h>
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+
+    watch_mask = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_ONLYDIR)
+
+    event_header = struct.Struct("iIII")
+
+    settle = 0.1
+
+    def __init__(self, tests_root, path_filter):
+        if platform.system() != "Linux":
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.tests_root = tests_root
+        self.path_filter = path_filter
+        self.fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise_errno()
+        # Map from watch descriptor to directory path relative to tests_root
+        self.watches = {}
+        try:
+            self._add_watches("")
+        except Exception:
+            self.close()
+            raise
+
+    def _raise_errno(self):
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+    def _add_watches(self, rel_path):
+        root = os.path.join(self.tests_root, rel_path)
+
+        def tree():
+            for dir_path, dir_names, file_names in vcs.walk(root):
+                yield os.path.join(rel_path, dir_path) if dir_path else rel_path, dir_names, []
+
+        for dir_path, _, _ in self.path_filter(tree()):
+            path = os.path.join(self.tests_root, dir_path)
+            if not isinstance(path, bytes):
+                path = path.encode(sys.getfilesystemencoding())
+            wd = self._libc.inotify_add_watch(self.fd, path, self.watch_mask)
+            if wd < 0:
+                if ctypes.get_errno() == errno.ENOENT:
+                    # Already deleted again
+                    continue
+                self._raise_errno()
+            self.watches[wd] = dir_path
+
+    def _remove_watches(self, rel_path):
+        prefix = os.path.join(rel_path, "")
+        for wd, dir_path in list(self.watches.items()):
+            if dir_path == rel_path or dir_path.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def wait(self, timeout):
+        """Wait for paths to change.
+
+        :param timeout: Maximum time to wait in seconds
+        :returns: Set of the paths that changed, relative to the tests
+                  root, or None if any path might have changed."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        changed = set()
+        complete = True
+        while True:
+            complete = self._read_events(changed) and complete
+            if not select.select([self.fd], [], [], self.settle)[0]:
+                break
+        return changed if complete else None
+
+    def _read_events(self, changed):
+        """Add the paths from the pending events to changed.
+
+        :returns: False if events were lost."""
+        data = os.read(self.fd, 64 * 1024)
+        complete = True
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = self.event_header.unpack_from(data, pos)
+            pos += self.event_header.size
+            name = data[pos:pos + length].rstrip(b"\0")
+            pos += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                complete = False
+                continue
+            dir_path = self.watches.get(wd)
+            if dir_path is None:
+                continue
+            if mask & self.IN_IGNORED:
+                del self.watches[wd]
+                continue
+            if not name:
+                continue
+            if not isinstance(name, str):
+                name = name.decode(sys.getfilesystemencoding())
+            rel_path = os.path.join(dir_path, name) if dir_path else name
+            changed.add(rel_path)
+
+            if mask & self.IN_ISDIR:
+                if mask & self.IN_MOVED_FROM:
+                    self._remove_watches(rel_path)
+                elif mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    try:
+                        self._add_watches(rel_path)
+                    except OSError:
+                        complete = False
+        return complete
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def get_monitor(tests_root, path_filter):
+    """Get the best available monitor for changes to tests_root"""
+    try:
+        return InotifyMonitor(tests_root, path_filter)
+    except (OSError, AttributeError):
+        # Not Linux, or out of inotify watches
+        get_logger().debug("inotify unavailable, polling for manifest changes")
+        return PollingMonitor(tests_root, path_filter)
+
+
+class ManifestWatcher(object):
+    """Load the manifest for a working tree and keep it up to date.
+
+    Call :meth:`start` to watch for changes on a background thread, or
+    :meth:`update` to apply changes directly. Subscribers are called
+    with the manifest each time it changes, on the thread doing the
+    update, while holding :attr:`lock`. Anything else reading the
+    manifest while it is being watched should hold the lock too.
+
+    :param tests_root: Path to the root of the tests
+    :param manifest_path: Path to the manifest file
+    :param url_base: Base url of the tests
+    :param cache_root: Directory for the caches used when checking the
+                       whole tree
+    :param interval: Time in seconds between checks when polling
+    :param write_manifest: Write the manifest back after each change
+    :param rebuild: Rebuild the manifest from scratch on loading
+    :param compact_format: Write the manifest in the compact format if
+                           True, or as JSON if False. None keeps the format
+                           of the existing manifest.
+    :param monitor_cls: Callable returning the monitor to use, taking
+                        the tests root and the path filter
+    """
+
+    def __init__(self, tests_root, manifest_path, url_base="/", cache_root=None,
+                 interval=1.0, write_manifest=True, rebuild=False, compact_format=None,
+                 monitor_cls=get_monitor):
+        self.logger = get_logger()
+        self.tests_root = os.path.abspath(tests_root)
+        self.manifest_path = manifest_path
+        self.url_base = url_base
+        self.cache_root = cache_root
+        self.interval = interval
+        self.write_manifest = write_manifest
+        self.compact_format = compact_format
+        self.monitor_cls = monitor_cls
+
+        self.lock = threading.RLock()
+        self.manifest = manifest.load_and_update(self.tests_root,
+                                                 manifest_path,
+                                                 url_base,
+                                                 rebuild=rebuild,
+                                                 cache_root=cache_root,
+                                                 working_copy=True,
+                                                 write_manifest=write_manifest,
+                                                 compact_format=compact_format)
+        if self.compact_format is None:
+            self.compact_format = compact.is_compact_file(manifest_path)
+        # The manifest and caches may be written inside the tests root, but
+        # writing them mustn't be seen as a change to the tree
+        self.output_paths = vcs.output_paths(self.tests_root, manifest_path, cache_root)
+        self.path_filter = self._get_path_filter()
+        self.monitor = None
+        self._subscribers = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _get_path_filter(self):
+        extras = [".git/"] + vcs.output_patterns(self.tests_root, self.manifest_path,
+                                                 self.cache_root)
+        return gitignore.PathFilter(self.tests_root, extras=extras)
+
+    def _is_output(self, rel_path):
+        """Check if a path is written by the watcher itself"""
+        manifest_rel_path, temp_prefix, cache_rel_path = self.output_paths
+        if manifest_rel_path is not None and (rel_path == manifest_rel_path or
+                                              rel_path.startswith(temp_prefix)):
+            return True
+        return cache_rel_path is not None and (rel_path == cache_rel_path or
+                                               rel_path.startswith(cache_rel_path + os.path.sep))
+
+    def subscribe(self, callback):
+        """Call callback(manifest) each time the manifest changes"""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def start(self):
+        """Start watching for changes on a background thread"""
+        assert self._thread is None
+        self.monitor = self.monitor_cls(self.tests_root, self.path_filter)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="ManifestWatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self.monitor.close()
+        self.monitor = None
+
+    def run(self):
+        """Watch for changes until interrupted"""
+        self.start()
+        try:
+            while self._thread.is_alive():
+                self._thread.join(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            changed_paths = self.monitor.wait(self.interval)
+            if self._stopped.is_set():
+                break
+            if changed_paths is not None and not changed_paths:
+                continue
+            try:
+                self.update(changed_paths)
+            except Exception:
+                self.logger.error("Updating manifest failed:\n%s" % traceback.format_exc())
+
+            if changed_paths is not None and ".gitignore" in changed_paths:
+                # Directories may have started or stopped being ignored
+                self.monitor.close()
+                self.monitor = self.monitor_cls(self.tests_root, self.path_filter)
+
+    def update(self, changed_paths=None):
+        """Update the manifest with changed files.
+
+        :param changed_paths: Iterable of the paths that changed,
+                              relative to the tests root, or None to
+                              check the whole tree.
+        :returns: Whether the manifest changed."""
+        if changed_paths is not None:
+            changed_paths = set(os.path.normpath(path) for path in changed_paths)
+            changed_paths = set(path for path in changed_paths if not self._is_output(path))
+            if not changed_paths:
+                return False
+            if ".gitignore" in changed_paths:
+                changed_paths = None
+        if changed_paths is None:
+            self.path_filter = self._get_path_filter()
+
+        with self.lock:
+            if changed_paths is None:
+                tree = vcs.get_tree(self.tests_root, self.manifest, self.manifest_path,
+                                    self.cache_root, working_copy=True)
+            else:
+                tree = self._changed_tree(changed_paths)
+
+            changed = self.manifest.update(tree)
+            if changed_paths is None:
+                tree.dump_caches()
+
+            if changed:
+                self.logger.info("Manifest updated")
+                if self.write_manifest:
+                    manifest.write(self.manifest, self.manifest_path,
+                                   compact_format=self.compact_format)
+                for callback in self._subscribers:
+                    callback(self.manifest)
+        return changed
+
+    def _changed_tree(self, changed_paths):
+        """Iterate over the tree in the form used by Manifest.update,
+        re-reading only the given paths and any files under them."""
+        def is_changed(path):
+            while path:
+                if path in changed_paths:
+                    return True
+                path = os.path.dirname(path)
+            return False
+
+        for path in self.manifest.paths():
+            if not is_changed(path):
+                yield path, False
+
+        seen = set()
+        for path in sorted(changed_paths):
+            full_path = os.path.join(self.tests_root, path)
+            is_dir = os.path.isdir(full_path)
+            if not os.path.exists(full_path) or self._ignored(path, is_dir):
+                continue
+            if is_dir:
+                paths = self._walk(path)
+            else:
+                paths = [path]
+            for rel_path in paths:
+                if rel_path not in seen:
+                    seen.add(rel_path)
+                    yield SourceFile(self.tests_root, rel_path, self.url_base), True
+
+    def _walk(self, rel_path):
+        def tree():
+            for dir_path, dir_names, file_names in vcs.walk(os.path.join(self.tests_root,
+                                                                         rel_path)):
+                yield (os.path.join(rel_path, dir_path) if dir_path else rel_path,
+                       dir_names, file_names)
+
+        for dir_path, _, file_names in self.path_filter(tree()):
+            for name, _ in file_names:
+                yield os.path.join(dir_path, name)
+
+    def _ignored(self, rel_path, is_dir):
+        """Check if a path, or any directory containing it, is ignored"""
+        parts = rel_path.split(os.path.sep)
+        dir_path = ""
+        for i, name in enumerate(parts):
+            is_file = i == len(parts) - 1 and not is_dir
+            entry = [(name, None)]
+            if is_file:
+                tree = [(dir_path, [], entry)]
+            else:
+                tree = [(dir_path, entry, [])]
+            _, dir_names, file_names = next(iter(self.path_filter(tree)))
+            if not (file_names if is_file else dir_names):
+                return True
+            dir_path = os.path.join(dir_path, name)
+        return False
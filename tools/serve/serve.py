@@ -49,6 +49,15 @@ class WrapperHandler(object):
 
     headers = []
 
+    # Caches shared by all wrapper handlers. _metadata_cache maps the path,
+    # mtime, size and inode of a script to its parsed // META comments and
+    # _wrapper_cache maps the handler class, that script key, and the request
+    # path and query to the rendered wrapper. Each is cleared once it holds
+    # cache_size entries.
+    cache_size = 4096
+    _metadata_cache = {}
+    _wrapper_cache = {}
+
     def __init__(self, base_path=None, url_base="/"):
         self.base_path = base_path
         self.url_base = url_base
@@ -61,17 +70,28 @@ class WrapperHandler(object):
         for header_name, header_value in self.headers:
             response.headers.set(header_name, header_value)
 
-        self.check_exposure(request)
-
         path = self._get_path(request.url_parts.path, True)
         query = request.url_parts.query
         if query:
             query = "?" + query
-        meta = "\n".join(self._get_meta(request))
-        script = "\n".join(self._get_script(request))
-        response.content = self.wrapper % {"meta": meta, "script": script, "path": path, "query": query}
+
+        file_key, _ = self._load_metadata(request)
+        cache_key = (self.__class__, file_key, path, query)
+        content = self._wrapper_cache.get(cache_key)
+        if content is None:
+            self.check_exposure(request)
+            meta = "\n".join(self._get_meta(request))
+            script = "\n".join(self._get_script(request))
+            content = self.wrapper % {"meta": meta, "script": script, "path": path, "query": query}
+            self._cache_set(self._wrapper_cache, cache_key, content)
+        response.content = content
         wrap_pipeline(path, request, response)
 
+    def _cache_set(self, cache, key, value):
+        if len(cache) >= self.cache_size:
+            cache.clear()
+        cache[key] = value
+
     def _get_path(self, path, resource_path):
         """Convert the path from an incoming request into a path corresponding to an "unwrapped"
         resource e.g. the file on disk that will be loaded in the wrapper.
@@ -102,13 +122,33 @@ class WrapperHandler(object):
 
         :param request: The Request being processed.
         """
+        _, metadata = self._load_metadata(request)
+        for key, value in metadata:
+            yield key, value
+
+    def _load_metadata(self, request):
+        """Get the parsed // META comments from the js file associated with a
+        request, reading the file only if it changed since it was last read.
+
+        :param request: The Request being processed.
+        :returns: Tuple of (file key, list of (key, value) pairs) where the
+                  file key identifies the current version of the file.
+        """
         path = self._get_path(filesystem_path(self.base_path, request, self.url_base), False)
         try:
-            with open(path, "rb") as f:
-                for key, value in read_script_metadata(f, js_meta_re):
-                    yield key, value
-        except IOError:
+            st = os.stat(path)
+        except OSError:
             raise HTTPException(404)
+        file_key = (path, st.st_mtime, st.st_size, st.st_ino)
+        metadata = self._metadata_cache.get(file_key)
+        if metadata is None:
+            try:
+                with open(path, "rb") as f:
+                    metadata = list(read_script_metadata(f, js_meta_re))
+            except IOError:
+                raise HTTPException(404)
+            self._cache_set(self._metadata_cache, file_key, metadata)
+        return file_key, metadata
 
     def _get_meta(self, request):
         """Get an iterator over strings to inject into the wrapper document
@@ -440,6 +480,9 @@ class ServerProc(object):
                     self.stop.wait()
                 except KeyboardInterrupt:
                     pass
+                # Stop the server so that it releases its resources, such
+                # as the temporary directory of the gzip cache
+                self.daemon.stop()
             except Exception:
                 print(traceback.format_exc(), file=sys.stderr)
                 raise
@@ -450,8 +493,11 @@ class ServerProc(object):
 
     def kill(self):
         self.stop.set()
-        self.proc.terminate()
-        self.proc.join()
+        # Give the server a chance to stop cleanly before terminating it
+        self.proc.join(2)
+        if self.proc.is_alive():
+            self.proc.terminate()
+            self.proc.join()
 
     def is_alive(self):
         return self.proc.is_alive()
@@ -813,6 +859,17 @@ class ConfigBuilder(config.ConfigBuilder):
             "none": {}
         },
         "aliases": [],
+        "server": {
+            "max_workers": 200,
+            "max_queued_connections": 1000,
+            "max_connections_per_client": None,
+            "keep_alive_timeout": 5,
+            "max_h2_stream_workers": 200,
+        },
+        "content_encoding": {
+            "enabled": False,
+            "min_size": 1024,
+        },
         # wave specific configuration parameters
         "results": "./results",
         "timeouts": {
@@ -822,6 +879,7 @@ class ConfigBuilder(config.ConfigBuilder):
         "enable_results_import": False,
         "web_root": "/wave",
         "persisting_interval": 20,
+        "watch_manifest": False,
         "api_titles": []
     }
 
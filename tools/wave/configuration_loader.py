@@ -60,6 +60,9 @@ def load(configuration_file_path):
     configuration[u"api_titles"] = configuration.get(
         u"api_titles", default_configuration[u"api_titles"])
 
+    configuration[u"watch_manifest"] = configuration.get(
+        u"watch_manifest", default_configuration[u"watch_manifest"])
+
     return configuration
 
 
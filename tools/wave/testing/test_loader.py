@@ -29,36 +29,57 @@ class TestLoader(object):
         manifest_file_handle = open(manifest_file_path)
         manifest_file = manifest_file_handle.read()
         manifest = json.loads(manifest_file)
-        tests = manifest[u"items"]
-
+        self._load_manifest_items(manifest[u"items"])
+
+    def reload_tests(self, manifest):
+        # Called with an in-memory Manifest when it changes, e.g. by
+        # a ManifestWatcher
+        tests = {}
+        for item_type in [u"testharness", u"manual"]:
+            tests[item_type] = {}
+            for _, path, items in manifest.itertypes(item_type):
+                path = path.replace(os.path.sep, u"/")
+                tests[item_type][path] = sorted(
+                    item.to_json() for item in items)
+        self._load_manifest_items(tests)
+
+    def _load_manifest_items(self, tests):
         include_list = self._load_test_list(self._include_list_file_path)
         exclude_list = self._load_test_list(self._exclude_list_file_path)
 
+        loaded_tests = {}
+        loaded_tests[AUTOMATIC] = {}
+        loaded_tests[MANUAL] = {}
+
         if u"testharness" in tests:
-            self._tests[AUTOMATIC] = self._load_tests(
+            loaded_tests[AUTOMATIC] = self._load_tests(
                 tests=tests[u"testharness"],
                 exclude_list=exclude_list
             )
 
         if u"manual" in tests:
-            self._tests[MANUAL] = self._load_tests(
+            loaded_tests[MANUAL] = self._load_tests(
                 tests=tests[u"manual"],
                 include_list=include_list
             )
 
-        for api in self._tests[AUTOMATIC]:
-            for test_path in self._tests[AUTOMATIC][api][:]:
+        for api in loaded_tests[AUTOMATIC]:
+            for test_path in loaded_tests[AUTOMATIC][api][:]:
                 if u"manual" not in test_path:
                     continue
-                self._tests[AUTOMATIC][api].remove(test_path)
+                loaded_tests[AUTOMATIC][api].remove(test_path)
 
                 if not self._is_valid_test(test_path,
                                            include_list=include_list):
                     continue
 
-                if api not in self._tests[MANUAL]:
-                    self._tests[MANUAL][api] = []
-                self._tests[MANUAL][api].append(test_path)
+                if api not in loaded_tests[MANUAL]:
+                    loaded_tests[MANUAL][api] = []
+                loaded_tests[MANUAL][api].append(test_path)
+
+        # Replace the tests in one go, so that concurrent requests see
+        # either the old or the new tests
+        self._tests = loaded_tests
 
     def _load_tests(self, tests, exclude_list=None, include_list=None):
         loaded_tests = {}
@@ -70,6 +70,18 @@ class WaveServer(object):
 
         test_loader.load_tests(manifest_file_path)
 
+        if configuration[u"watch_manifest"]:
+            from manifest.watch import ManifestWatcher
+            manifest_watcher = ManifestWatcher(
+                tests_root=configuration[u"tests_directory_path"],
+                manifest_path=manifest_file_path
+            )
+            manifest_watcher.subscribe(test_loader.reload_tests)
+            with manifest_watcher.lock:
+                test_loader.reload_tests(manifest_watcher.manifest)
+            manifest_watcher.start()
+            self.manifest_watcher = manifest_watcher
+
         # Initialize HTTP handlers
         static_handler = StaticHandler(
             web_root=configuration["web_root"],
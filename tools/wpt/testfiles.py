@@ -9,6 +9,7 @@ from collections import OrderedDict
 from six import iteritems
 
 from ..manifest import manifest
+from ..manifest.vcs import CacheFile, HashCache, default_cache_root
 
 here = os.path.dirname(__file__)
 wpt_root = os.path.abspath(os.path.join(here, os.pardir, os.pardir))
@@ -200,7 +201,121 @@ def _init_manifest_cache():
 load_manifest = _init_manifest_cache()
 
 
-def affected_testfiles(files_changed, skip_tests, manifest_path=None):
+# Characters that make up the words that test files are indexed by. Any
+# file name made up of these characters that is contained in a test is
+# contained in one of its words.
+word_re = re.compile(r"[A-Za-z0-9_.\-~]+")
+name_re = re.compile(r"^[A-Za-z0-9_.\-~]+$")
+interface_name_re = re.compile(r"^[A-Za-z0-9_\-]+$")
+
+
+def read_test_file(path):
+    """Read and decode the contents of a test file"""
+    with open(path, "rb") as fh:
+        file_contents = fh.read()
+    if file_contents.startswith(b"\xfe\xff"):
+        return file_contents.decode("utf-16be", "replace")
+    elif file_contents.startswith(b"\xff\xfe"):
+        return file_contents.decode("utf-16le", "replace")
+    return file_contents.decode("utf8", "replace")
+
+
+class ReferenceIndex(CacheFile):
+    """Index of the file names that each test file might refer to, so that
+    only the tests that might be affected by a change have to be read.
+
+    For each test this stores the git blob hash of its contents, whether
+    it uses idlharness.js, and the words in it (see ``word_re``) that
+    contain a ".". Tests using idlharness.js keep all their words, since
+    they're matched against the names of the changed IDL files, which
+    don't include the extension. Entries are only recomputed for tests
+    whose contents changed."""
+
+    file_name = "references.json"
+
+    # Increase when the data stored for each test changes
+    version = 1
+
+    def __init__(self, cache_root, tests_root, rebuild=False):
+        self.hash_cache = HashCache(cache_root, tests_root, rebuild)
+        super(ReferenceIndex, self).__init__(cache_root, tests_root, rebuild=rebuild)
+
+    def check_valid(self, data):
+        if (data.get("/tests_root") != self.tests_root or
+            data.get("/version") != self.version):
+            self.modified = True
+            data = {}
+        return data
+
+    def update(self, rel_paths):
+        """Update the index to contain the tests in rel_paths, reading only
+        the ones that changed since they were last indexed.
+
+        :param rel_paths: Paths to the tests relative to the tests root"""
+        rel_paths = set(rel_paths)
+        for rel_path in rel_paths:
+            try:
+                file_hash = self.hash_cache.hash(rel_path)
+            except (IOError, OSError):
+                continue
+            entry = self.data.get(rel_path)
+            if entry is not None and entry[0] == file_hash:
+                continue
+            file_contents = read_test_file(os.path.join(self.tests_root, rel_path))
+            uses_idlharness = "idlharness.js" in file_contents
+            words = set(word_re.findall(file_contents))
+            if not uses_idlharness:
+                words = set(word for word in words if "." in word)
+            self.data[rel_path] = [file_hash, uses_idlharness, sorted(words)]
+            self.modified = True
+
+        for rel_path in list(self.data.keys()):
+            if not rel_path.startswith("/") and rel_path not in rel_paths:
+                del self.data[rel_path]
+                self.modified = True
+
+    def candidates(self, file_names, interface_names):
+        """Get the tests that might refer to a set of files.
+
+        :param file_names: Names of the changed files, without their
+                           directories
+        :param interface_names: Names of the changed IDL files, without
+                                their extension
+        :returns: Set of the paths to the tests that contain a word
+                  containing one of file_names, or that use idlharness.js
+                  and contain one of interface_names, or None if every
+                  test has to be checked."""
+        if any("." not in name or not name_re.match(name) for name in file_names):
+            return None
+        all_interfaces = not all(interface_name_re.match(name) for name in interface_names)
+        interface_words = set()
+        for name in interface_names:
+            interface_words |= {name, name + ".idl"}
+
+        entries = [(rel_path, entry) for rel_path, entry in iteritems(self.data)
+                   if not rel_path.startswith("/")]
+        words = set()
+        for _, (_, _, test_words) in entries:
+            words.update(test_words)
+        matching = set(word for word in words
+                       if any(name in word for name in file_names))
+
+        rv = set()
+        for rel_path, (_, uses_idlharness, test_words) in entries:
+            if (not matching.isdisjoint(test_words) or
+                (uses_idlharness and interface_names and
+                 (all_interfaces or not interface_words.isdisjoint(test_words)))):
+                rv.add(rel_path)
+        return rv
+
+    def dump(self):
+        self.data["/tests_root"] = self.tests_root
+        self.data["/version"] = self.version
+        super(ReferenceIndex, self).dump()
+        self.hash_cache.dump()
+
+
+def affected_testfiles(files_changed, skip_tests, manifest_path=None, cache_root=None):
     """Determine and return list of test files that reference changed files."""
     affected_testfiles = set()
     # Exclude files that are in the repo root, because
@@ -211,11 +326,11 @@ def affected_testfiles(files_changed, skip_tests, manifest_path=None):
 
     test_types = ["testharness", "reftest", "wdspec"]
     support_files = {os.path.join(wpt_root, path)
-                     for _, path, _ in wpt_manifest.itertypes("support")}
+                     for _, path in wpt_manifest.iterpaths("support")}
     wdspec_test_files = {os.path.join(wpt_root, path)
-                         for _, path, _ in wpt_manifest.itertypes("wdspec")}
+                         for _, path in wpt_manifest.iterpaths("wdspec")}
     test_files = {os.path.join(wpt_root, path)
-                  for _, path, _ in wpt_manifest.itertypes(*test_types)}
+                  for _, path in wpt_manifest.iterpaths(*test_types)}
 
     interface_dir = os.path.join(wpt_root, 'interfaces')
     interfaces_files = {os.path.join(wpt_root, 'interfaces', filename)
@@ -241,7 +356,7 @@ def affected_testfiles(files_changed, skip_tests, manifest_path=None):
         nontest_changed_paths.add((full_path, repo_path))
 
     interface_name = lambda x: os.path.splitext(os.path.basename(x))[0]
-    interfaces_changed_names = map(interface_name, interfaces_changed)
+    interfaces_changed_names = [interface_name(item) for item in interfaces_changed]
 
     def affected_by_wdspec(test):
         affected = False
@@ -267,34 +382,50 @@ def affected_testfiles(files_changed, skip_tests, manifest_path=None):
                         return True
         return False
 
-    for root, dirs, fnames in os.walk(wpt_root):
-        # Walk top_level_subdir looking for test files containing either the
-        # relative filepath or absolute filepath to the changed files.
-        if root == wpt_root:
-            for dir_name in skip_tests:
-                dirs.remove(dir_name)
-        for fname in fnames:
-            test_full_path = os.path.join(root, fname)
-            # Skip any file that's not a test file.
-            if test_full_path not in test_files:
-                continue
-            if affected_by_wdspec(test_full_path):
-                affected_testfiles.add(test_full_path)
-                continue
+    # Test files that exist, apart from those in skipped top level
+    # directories
+    test_paths = {}
+    for test_full_path in test_files:
+        rel_path = os.path.relpath(test_full_path, wpt_root)
+        path_components = rel_path.split(os.sep)
+        if len(path_components) > 1 and path_components[0] in skip_tests:
+            continue
+        if os.path.isfile(test_full_path):
+            test_paths[rel_path] = test_full_path
 
-            with open(test_full_path, "rb") as fh:
-                file_contents = fh.read()
-                if file_contents.startswith("\xfe\xff"):
-                    file_contents = file_contents.decode("utf-16be", "replace")
-                elif file_contents.startswith("\xff\xfe"):
-                    file_contents = file_contents.decode("utf-16le", "replace")
-                else:
-                    file_contents = file_contents.decode("utf8", "replace")
-                for full_path, repo_path in nontest_changed_paths:
-                    rel_path = os.path.relpath(full_path, root).replace(os.path.sep, "/")
-                    if rel_path in file_contents or repo_path in file_contents or affected_by_interfaces(file_contents):
-                        affected_testfiles.add(test_full_path)
-                        continue
+    to_check = []
+    for rel_path, test_full_path in sorted(iteritems(test_paths)):
+        if affected_by_wdspec(test_full_path):
+            affected_testfiles.add(test_full_path)
+        else:
+            to_check.append((rel_path, test_full_path))
+
+    if not nontest_changed_paths:
+        # Tests can only be affected by their contents if a support
+        # file changed
+        return tests_changed, affected_testfiles
+
+    # Look up the tests that might contain one of the changed paths in
+    # the index, and only read those to check if they do
+    if cache_root is None:
+        cache_root = default_cache_root(wpt_root)
+    index = ReferenceIndex(cache_root, wpt_root)
+    index.update(test_paths)
+    candidates = index.candidates({os.path.basename(full_path)
+                                   for full_path, _ in nontest_changed_paths},
+                                  interfaces_changed_names)
+    index.dump()
+    if candidates is not None:
+        to_check = [item for item in to_check if item[0] in candidates]
+
+    for _, test_full_path in to_check:
+        file_contents = read_test_file(test_full_path)
+        root = os.path.dirname(test_full_path)
+        for full_path, repo_path in nontest_changed_paths:
+            rel_path = os.path.relpath(full_path, root).replace(os.path.sep, "/")
+            if rel_path in file_contents or repo_path in file_contents or affected_by_interfaces(file_contents):
+                affected_testfiles.add(test_full_path)
+                break
 
     return tests_changed, affected_testfiles
 
@@ -0,0 +1,133 @@
+import os
+
+import mock
+import pytest
+
+from tools.wpt import testfiles
+
+
+files = {
+    "a/test.html": b"<script src=/a/support/helper.js></script>",
+    "a/relative.html": b"<script src='support/helper.js'></script>",
+    "a/other.html": b"<script src=/a/support/other-helper.js></script>",
+    "b/test.html": b"<img src='../a/support/image.png'>",
+    "b/none.html": b"<p>No references</p>",
+    "idl/test.html": (b"<script src=/resources/idlharness.js></script>"
+                      b"<script>idl_test(['dom'], ['html'])</script>"),
+    "tools/test.html": b"<script src=/a/support/helper.js></script>",
+    "a/support/helper.js": b"",
+    "a/support/other-helper.js": b"",
+    "a/support/image.png": b"",
+    "interfaces/dom.idl": b"",
+    "interfaces/html.idl": b"",
+}
+
+tests = ["a/test.html", "a/relative.html", "a/other.html", "b/test.html",
+         "b/none.html", "idl/test.html", "tools/test.html"]
+
+
+class Manifest(object):
+    def iterpaths(self, *item_types):
+        for path in sorted(files):
+            is_test = path in tests
+            if is_test and "testharness" in item_types:
+                yield "testharness", path.replace("/", os.path.sep)
+            elif not is_test and "support" in item_types:
+                yield "support", path.replace("/", os.path.sep)
+
+
+@pytest.fixture
+def wpt_root(tmpdir, monkeypatch):
+    root = str(tmpdir.join("tests"))
+    for path, contents in files.items():
+        path = os.path.join(root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(contents)
+    monkeypatch.setattr(testfiles, "wpt_root", root)
+    monkeypatch.setattr(testfiles, "load_manifest", lambda manifest_path: Manifest())
+    return root
+
+
+def affected(wpt_root, cache_root, changed):
+    _, dependents = testfiles.affected_testfiles(
+        [os.path.join(wpt_root, path) for path in changed],
+        set(["tools"]),
+        cache_root=cache_root)
+    return sorted(os.path.relpath(path, wpt_root).replace(os.path.sep, "/")
+                  for path in dependents)
+
+
+@pytest.mark.parametrize("changed,expected", [
+    (["a/support/helper.js"], ["a/relative.html", "a/test.html"]),
+    (["a/support/other-helper.js"], ["a/other.html"]),
+    (["a/support/image.png"], ["b/test.html"]),
+    (["a/support/helper.js", "interfaces/dom.idl"], ["a/relative.html", "a/test.html",
+                                                     "idl/test.html"]),
+    (["interfaces/html.idl"], ["idl/test.html"]),
+])
+def test_affected_testfiles(tmpdir, wpt_root, changed, expected):
+    cache_root = str(tmpdir.join("cache"))
+    assert affected(wpt_root, cache_root, changed) == expected
+
+    # Checking every test gives the same result
+    with mock.patch.object(testfiles.ReferenceIndex, "candidates", return_value=None):
+        assert affected(wpt_root, cache_root, changed) == expected
+
+
+def test_affected_testfiles_reads_candidates(tmpdir, wpt_root):
+    cache_root = str(tmpdir.join("cache"))
+    assert affected(wpt_root, cache_root, ["a/support/image.png"]) == ["b/test.html"]
+
+    with open(os.path.join(wpt_root, "b", "none.html"), "wb") as f:
+        f.write(b"<img src=/a/support/image.png>")
+    with mock.patch.object(testfiles, "read_test_file",
+                           wraps=testfiles.read_test_file) as read_test_file:
+        assert affected(wpt_root, cache_root, ["a/support/image.png"]) == ["b/none.html",
+                                                                           "b/test.html"]
+    # Only the changed test is indexed again, and only the tests referring
+    # to image.png are checked
+    read_paths = sorted(os.path.relpath(call[0][0], wpt_root).replace(os.path.sep, "/")
+                        for call in read_test_file.call_args_list)
+    assert read_paths == ["b/none.html", "b/none.html", "b/test.html"]
+
+
+def test_affected_testfiles_default_cache(wpt_root):
+    git = testfiles.get_git_cmd(wpt_root)
+    git("init")
+    git("add", "-A")
+    git("-c", "user.name=test", "-c", "user.email=test@example.org",
+        "commit", "-m", "initial")
+
+    assert affected(wpt_root, None, ["a/support/image.png"]) == ["b/test.html"]
+    assert os.path.exists(os.path.join(wpt_root, ".wptcache", "references.json"))
+
+    # The cache in the tree isn't seen as a new file
+    assert testfiles.repo_files_changed("HEAD", include_uncommitted=True,
+                                        include_new=True) == set()
+
+
+def test_reference_index(tmpdir, wpt_root):
+    cache_root = str(tmpdir.join("cache"))
+    index = testfiles.ReferenceIndex(cache_root, wpt_root)
+    index.update(os.path.join(*path.split("/")) for path in tests)
+    index.dump()
+
+    index = testfiles.ReferenceIndex(cache_root, wpt_root)
+    assert index.data[os.path.join("a", "relative.html")][1:] == [False, ["helper.js"]]
+    assert index.data[os.path.join("idl", "test.html")][1] is True
+    assert index.candidates({"helper.js"}, []) == {os.path.join("a", "test.html"),
+                                                   os.path.join("a", "relative.html"),
+                                                   os.path.join("a", "other.html"),
+                                                   os.path.join("tools", "test.html")}
+    assert index.candidates({"helper.js"}, ["dom"]) == {os.path.join("a", "test.html"),
+                                                        os.path.join("a", "relative.html"),
+                                                        os.path.join("a", "other.html"),
+                                                        os.path.join("idl", "test.html"),
+                                                        os.path.join("tools", "test.html")}
+    # Names that might not be contained in an indexed word
+    assert index.candidates({"Makefile"}, []) is None
+
+    index.update([os.path.join("a", "test.html")])
+    assert [key for key in index.data if not key.startswith("/")] == [os.path.join("a", "test.html")]
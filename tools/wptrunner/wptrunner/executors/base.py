@@ -1,6 +1,8 @@
 import hashlib
 import httplib
 import os
+import shutil
+import tempfile
 import threading
 import traceback
 import socket
@@ -28,7 +30,7 @@ def executor_kwargs(test_type, server_config, cache_manager, run_info_data,
                        "debug_info": kwargs["debug_info"]}
 
     if test_type == "reftest":
-        executor_kwargs["screenshot_cache"] = cache_manager.dict()
+        executor_kwargs["screenshot_cache"] = ScreenshotCache(cache_manager)
 
     if test_type == "wdspec":
         executor_kwargs["binary"] = kwargs.get("binary")
@@ -38,6 +40,112 @@ def executor_kwargs(test_type, server_config, cache_manager, run_info_data,
     return executor_kwargs
 
 
+class ScreenshotCache(object):
+    """Cache of reftest screenshot hashes, shared between the test processes.
+
+    Each process keeps the hashes it has looked up in a local dict in front
+    of an index shared through the multiprocessing manager, so only the
+    first lookup of each key in a process is a round-trip to the manager.
+    The shared index holds only hashes; the screenshots of failing tests
+    are written to a temporary directory, in files named by hash.
+
+    :param cache_manager: multiprocessing.Manager used to share the index
+                          between processes
+    """
+
+    def __init__(self, cache_manager):
+        self.index = cache_manager.dict()
+        # Map of pid: lookup counts, updated by each process on teardown
+        self.shared_counts = cache_manager.dict()
+        self.screenshot_dir = tempfile.mkdtemp(prefix="wptrunner-screenshots")
+        self.local = {}
+        self.counts = {"local": 0, "shared": 0, "miss": 0}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["local"] = {}
+        state["counts"] = {"local": 0, "shared": 0, "miss": 0}
+        return state
+
+    def get(self, key):
+        """Get the screenshot hash for a key, or None if it isn't cached"""
+        hash_value = self.local.get(key)
+        if hash_value is not None:
+            self.counts["local"] += 1
+            return hash_value
+        hash_value = self.index.get(key)
+        if hash_value is None:
+            self.counts["miss"] += 1
+            return None
+        self.counts["shared"] += 1
+        self.local[key] = hash_value
+        return hash_value
+
+    def set(self, key, hash_value):
+        self.local[key] = hash_value
+        self.index[key] = hash_value
+
+    def _hash(self, key):
+        hash_value = self.local.get(key)
+        if hash_value is None:
+            hash_value = self.index.get(key)
+        return hash_value
+
+    def _screenshot_path(self, hash_value):
+        return os.path.join(self.screenshot_dir, hash_value)
+
+    def get_screenshot(self, key):
+        """Get the stored screenshot for a key, or None if there isn't one"""
+        hash_value = self._hash(key)
+        if hash_value is None:
+            return None
+        try:
+            with open(self._screenshot_path(hash_value), "rb") as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def set_screenshot(self, key, data):
+        """Store the screenshot for a key that is already cached"""
+        hash_value = self._hash(key)
+        # Write to a temporary file first so that other processes never
+        # read a partial screenshot
+        fd, tmp_path = tempfile.mkstemp(dir=self.screenshot_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            os.rename(tmp_path, self._screenshot_path(hash_value))
+        except OSError:
+            # On Windows the rename fails if another process already
+            # stored the screenshot
+            os.unlink(tmp_path)
+
+    def flush_counts(self):
+        """Share the lookup counts of this process"""
+        self.shared_counts[os.getpid()] = dict(self.counts)
+
+    def hit_counts(self):
+        """Total lookup counts of all processes"""
+        rv = {"local": 0, "shared": 0, "miss": 0}
+        for counts in self.shared_counts.values():
+            for name, value in counts.iteritems():
+                rv[name] += value
+        return rv
+
+    def log_counts(self, logger):
+        counts = self.hit_counts()
+        lookups = sum(counts.values())
+        if not lookups:
+            return
+        logger.info("Screenshot cache: %i lookups, %i local hits, %i shared hits, "
+                    "%i misses (%.1f%% hit rate)" %
+                    (lookups, counts["local"], counts["shared"], counts["miss"],
+                     100.0 * (counts["local"] + counts["shared"]) / lookups))
+
+    def cleanup(self):
+        shutil.rmtree(self.screenshot_dir, ignore_errors=True)
+
+
 def strip_server(url):
     """Remove the scheme and netloc from a url, leaving only the path and any query
     or fragment.
@@ -224,15 +332,20 @@ class RefTestExecutor(TestExecutor):
 
         self.screenshot_cache = screenshot_cache
 
+    def teardown(self):
+        if self.screenshot_cache is not None:
+            self.screenshot_cache.flush_counts()
+        TestExecutor.teardown(self)
+
 
 class RefTestImplementation(object):
     def __init__(self, executor):
         self.timeout_multiplier = executor.timeout_multiplier
         self.executor = executor
-        # Cache of url:(screenshot hash, screenshot). Typically the
-        # screenshot is None, but we set this value if a test fails
-        # and the screenshot was taken from the cache so that we may
-        # retrieve the screenshot from the cache directly in the future
+        # ScreenshotCache of (url, viewport size, dpi):screenshot hash. If
+        # a test fails and the screenshot was taken from the cache, the
+        # screenshot is also stored so that we may retrieve it from the
+        # cache directly in the future
         self.screenshot_cache = self.executor.screenshot_cache
         self.message = None
 
@@ -248,8 +361,9 @@ class RefTestImplementation(object):
 
     def get_hash(self, test, viewport_size, dpi):
         key = (test.url, viewport_size, dpi)
+        hash_value = self.screenshot_cache.get(key)
 
-        if key not in self.screenshot_cache:
+        if hash_value is None:
             success, data = self.executor.screenshot(test, viewport_size, dpi)
 
             if not success:
@@ -258,11 +372,11 @@ class RefTestImplementation(object):
             screenshot = data
             hash_value = hashlib.sha1(screenshot).hexdigest()
 
-            self.screenshot_cache[key] = (hash_value, None)
+            self.screenshot_cache.set(key, hash_value)
 
             rv = (hash_value, screenshot)
         else:
-            rv = self.screenshot_cache[key]
+            rv = (hash_value, None)
 
         self.message.append("%s %s" % (test.url, rv[0]))
         return True, rv
@@ -318,13 +432,16 @@ class RefTestImplementation(object):
                 "extra": {"reftest_screenshots": log_data}}
 
     def retake_screenshot(self, node, viewport_size, dpi):
+        key = (node.url, viewport_size, dpi)
+        data = self.screenshot_cache.get_screenshot(key)
+        if data is not None:
+            return True, data
+
         success, data = self.executor.screenshot(node, viewport_size, dpi)
         if not success:
             return False, data
 
-        key = (node.url, viewport_size, dpi)
-        hash_val, _ = self.screenshot_cache[key]
-        self.screenshot_cache[key] = hash_val, data
+        self.screenshot_cache.set_screenshot(key, data)
         return True, data
 
 
@@ -186,6 +186,8 @@ class ServoRefTestExecutor(ProcessTestExecutor):
         except OSError:
             pass
         os.rmdir(self.tempdir)
+        if self.screenshot_cache is not None:
+            self.screenshot_cache.flush_counts()
         ProcessTestExecutor.teardown(self)
 
     def screenshot(self, test, viewport_size, dpi):
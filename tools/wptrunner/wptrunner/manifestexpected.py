@@ -1,8 +1,12 @@
+import cPickle as pickle
+import hashlib
 import os
 import urlparse
 
+from wptmanifest import node as wptmanifest_node
 from wptmanifest.backends import static
 from wptmanifest.backends.static import ManifestItem
+from wptmanifest.parser import atoms, parse
 
 import expected
 
@@ -292,7 +296,120 @@ class SubtestNode(TestNode):
         return True
 
 
-def get_manifest(metadata_root, test_path, url_base, run_info):
+def parser_version():
+    """Get an identifier for the code used to parse and compile metadata
+    files, which changes whenever that code changes"""
+    sha1 = hashlib.sha1()
+    here = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wptmanifest")
+    for path in [("node.py",), ("parser.py",), ("backends", "static.py")]:
+        with open(os.path.join(here, *path), "rb") as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+class MetadataCache(object):
+    """Cache of parsed and compiled metadata files, optionally stored on disk.
+
+    For each file this keeps the wptmanifest AST, keyed on the mtime and
+    size of the file, and the result of evaluating its conditions for the
+    most recently used run_info values, so that files that haven't changed
+    don't have to be tokenized and parsed, or compiled, again. The cache
+    file is ignored when the parser or compiler code changes.
+
+    :param path: Path to the file to store the cache in, or None to only
+                 keep it in memory
+    """
+
+    # Number of sets of run_info values to keep the compiled output for
+    max_run_infos = 4
+
+    def __init__(self, path=None):
+        self.path = path
+        self.version = parser_version()
+        self.modified = False
+        self.data = self.load()
+
+    def _persistent_id(self, obj):
+        # Reset is compared by identity, so store it by name
+        if obj is atoms["Reset"]:
+            return "Reset"
+        return None
+
+    def _persistent_load(self, name):
+        return atoms[name]
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "rb") as f:
+                unpickler = pickle.Unpickler(f)
+                unpickler.persistent_load = self._persistent_load
+                version, data = unpickler.load()
+        except Exception:
+            self.modified = True
+            return {}
+        if version != self.version:
+            self.modified = True
+            return {}
+        return data
+
+    def dump(self):
+        if self.path is None or not self.modified:
+            return
+        with open(self.path, "wb") as f:
+            pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = self._persistent_id
+            pickler.dump((self.version, self.data))
+        self.modified = False
+
+    def compile(self, path, run_info, data_cls_getter, **kwargs):
+        """Get the compiled metadata in a file, as static.compile would
+        give, or None if the file doesn't exist.
+
+        :param path: Path to the metadata file
+        :param run_info: Dictionary of properties of the test run for which the
+                         expectation values should be computed.
+        :param data_cls_getter: Function giving the class of each output node,
+                                which mustn't depend on the AST node
+        """
+        try:
+            path_stat = os.stat(path)
+        except OSError:
+            return None
+        key = (path_stat.st_mtime, path_stat.st_size)
+
+        entry = self.data.get(path)
+        if entry is None or entry["key"] != key:
+            try:
+                with open(path) as f:
+                    ast = parse(f)
+            except IOError:
+                return None
+            entry = {"key": key,
+                     "ast": wptmanifest_node.to_data(ast),
+                     "compiled": []}
+            self.data[path] = entry
+            self.modified = True
+
+        run_info_key = repr(sorted(run_info.items()))
+        compiled = entry["compiled"]
+        for i, (item_key, tree) in enumerate(compiled):
+            if item_key == run_info_key:
+                if i != len(compiled) - 1:
+                    compiled.append(compiled.pop(i))
+                    self.modified = True
+                break
+        else:
+            tree = static.specialize(wptmanifest_node.from_data(entry["ast"]), run_info)
+            compiled.append((run_info_key, tree))
+            del compiled[:-self.max_run_infos]
+            self.modified = True
+
+        return static.build(tree, data_cls_getter=data_cls_getter, **kwargs)
+
+
+def get_manifest(metadata_root, test_path, url_base, run_info, cache=None):
     """Get the ExpectedManifest for a particular test path, or None if there is no
     metadata stored for that test path.
 
@@ -301,8 +418,15 @@ def get_manifest(metadata_root, test_path, url_base, run_info):
     :param url_base: Base url for serving the tests in this manifest
     :param run_info: Dictionary of properties of the test run for which the expectation
                      values should be computed.
+    :param cache: MetadataCache to get the compiled manifest from, or None
     """
     manifest_path = expected.expected_path(metadata_root, test_path)
+    if cache is not None:
+        return cache.compile(manifest_path,
+                             run_info,
+                             data_cls_getter,
+                             test_path=test_path,
+                             url_base=url_base)
     try:
         with open(manifest_path) as f:
             return static.compile(f,
@@ -314,14 +438,19 @@ def get_manifest(metadata_root, test_path, url_base, run_info):
         return None
 
 
-def get_dir_manifest(path, run_info):
+def get_dir_manifest(path, run_info, cache=None):
     """Get the ExpectedManifest for a particular test path, or None if there is no
     metadata stored for that test path.
 
     :param path: Full path to the ini file
     :param run_info: Dictionary of properties of the test run for which the expectation
                      values should be computed.
+    :param cache: MetadataCache to get the compiled manifest from, or None
     """
+    if cache is not None:
+        return cache.compile(path,
+                             run_info,
+                             lambda x,y: DirectoryManifest)
     try:
         with open(path) as f:
             return static.compile(f,
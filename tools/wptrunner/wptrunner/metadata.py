@@ -1,9 +1,13 @@
 import array
+import multiprocessing
 import os
+import re
 import shutil
+import sys
 import tempfile
 import uuid
 from collections import defaultdict, namedtuple
+from json import JSONDecoder
 
 from mozlog import structuredlog
 
@@ -23,16 +27,25 @@ try:
 except ImportError:
     import json
 
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
 
 def update_expected(test_paths, serve_root, log_file_names,
                     rev_old=None, rev_new="HEAD", ignore_existing=False,
                     sync_root=None, property_order=None, boolean_properties=None,
-                    stability=None):
+                    stability=None, processes=None):
     """Update the metadata files for web-platform-tests based on
     the results obtained in a previous run or runs
 
     If stability is not None, assume log_file_names refers to logs from repeated
-    test jobs, disable tests that don't behave as expected on all runs"""
+    test jobs, disable tests that don't behave as expected on all runs
+
+    If processes is greater than 1, read that many logs at once in separate
+    processes"""
     do_delayed_imports(serve_root)
 
     id_test_map = load_test_data(test_paths)
@@ -42,7 +55,8 @@ def update_expected(test_paths, serve_root, log_file_names,
                                                        ignore_existing=ignore_existing,
                                                        property_order=property_order,
                                                        boolean_properties=boolean_properties,
-                                                       stability=stability):
+                                                       stability=stability,
+                                                       processes=processes):
 
         write_new_expected(metadata_path, updated_ini)
         if stability:
@@ -173,6 +187,27 @@ run_info_intern = RunInfoInterned()
 status_intern = InternedData(4)
 
 
+def memory_usage():
+    """Description of the peak memory used by this process"""
+    if resource is None:
+        return "unknown"
+    # ru_maxrss is in kB on Linux but in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return "%.1fMB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6)
+
+
+def results_size(id_test_map):
+    """Number of results stored in the id_test_map, and the number of
+    bytes used to store them, not counting the values that can't be
+    packed"""
+    count = 0
+    for test_data in set(id_test_map.itervalues()):
+        for subtests in test_data.data.itervalues():
+            for results in subtests.itervalues():
+                count += len(results.data)
+    return count, count * array.array("H").itemsize
+
+
 def load_test_data(test_paths):
     manifest_loader = testloader.ManifestLoader(test_paths, False)
     manifests = manifest_loader.load()
@@ -189,14 +224,21 @@ def update_from_logs(id_test_map, *log_filenames, **kwargs):
     property_order = kwargs.get("property_order")
     boolean_properties = kwargs.get("boolean_properties")
     stability = kwargs.get("stability")
+    processes = kwargs.get("processes") or 1
 
     updater = ExpectedUpdater(id_test_map,
                               ignore_existing=ignore_existing)
 
-    for i, log_filename in enumerate(log_filenames):
-        print("Processing log %d/%d" % (i + 1, len(log_filenames)))
-        with open(log_filename) as f:
-            updater.update_from_log(f)
+    if processes > 1 and len(log_filenames) > 1 and sys.platform != "win32":
+        updater.update_from_logs_parallel(log_filenames, processes)
+    else:
+        for i, log_filename in enumerate(log_filenames):
+            print("Processing log %d/%d" % (i + 1, len(log_filenames)))
+            with open(log_filename) as f:
+                updater.update_from_log(f)
+            print("Peak memory use %s" % memory_usage())
+
+    print("Stored %i results in %i bytes" % results_size(id_test_map))
 
     for item in update_results(id_test_map, property_order, boolean_properties, stability):
         yield item
@@ -291,21 +333,85 @@ class ExpectedUpdater(object):
                            "assertion_count": self.assertion_count,
                            "lsan_leak": self.lsan_leak}
         self.tests_visited = {}
+        self._file_data_ids = None
 
     def update_from_log(self, log_file):
         self.run_info = None
-        try:
-            data = json.load(log_file)
-        except Exception:
-            pass
-        else:
-            if "action" not in data and "results" in data:
-                self.update_from_wptreport_log(data)
-                return
+        if self.update_from_wptreport_stream(log_file):
+            return
 
         log_file.seek(0)
         self.update_from_raw_log(log_file)
 
+    def update_from_logs_parallel(self, log_filenames, processes):
+        """Read several logs at once, each in a separate process, and merge
+        the results into id_test_map.
+
+        This relies on the worker processes being forked, so that they
+        don't need id_test_map to be sent to them."""
+        global _log_worker_updater
+        _log_worker_updater = self
+        pool = multiprocessing.Pool(min(processes, len(log_filenames)),
+                                    initializer=_init_log_worker)
+        try:
+            results = pool.imap(_update_from_log_worker, log_filenames)
+            for i, data in enumerate(results):
+                print("Processed log %d/%d" % (i + 1, len(log_filenames)))
+                self.merge_results(data)
+                print("Peak memory use %s" % memory_usage())
+        finally:
+            pool.terminate()
+            _log_worker_updater = None
+
+    def take_results(self):
+        """Remove the results stored in id_test_map since the last call, and
+        return them along with the interned values they refer to, in a form
+        that can be passed to merge_results in another process"""
+        if self._file_data_ids is None:
+            self._file_data_ids = {}
+            for test_id, test_data in self.id_test_map.iteritems():
+                self._file_data_ids[test_data] = test_id
+
+        files = []
+        for test_data, key in self._file_data_ids.iteritems():
+            if not (test_data.data or test_data._requires_update or test_data.clear):
+                continue
+            # A flat list of test_id, subtest_id, packed results, raw data
+            # is much smaller to pass between processes than a list of tuples
+            results = []
+            for test_id, subtests in test_data.data.iteritems():
+                for subtest_id, result_list in subtests.iteritems():
+                    results.extend([test_id,
+                                    subtest_id,
+                                    result_list.data.tostring(),
+                                    getattr(result_list, "raw_data", None)])
+            files.append((key, test_data._requires_update, set(test_data.clear), results))
+            test_data.data.clear()
+            test_data._requires_update = False
+            test_data.clear.clear()
+
+        interned = (prop_intern._data[0], run_info_intern._data[0], status_intern._data[0])
+        return interned, files
+
+    def merge_results(self, data):
+        """Add results returned by take_results in another process"""
+        (props, run_infos, statuses), files = data
+        maps = ([0] + [prop_intern.store(item) for item in props[1:]],
+                [0] + [run_info_intern.store(dict(item)) for item in run_infos[1:]],
+                [0] + [status_intern.store(item) for item in statuses[1:]])
+        if all(item == range(len(item)) for item in maps):
+            # The values were interned in the same order in both processes
+            maps = (None, None, None)
+
+        for key, requires_update, clear, results in files:
+            test_data = self.id_test_map[key]
+            if requires_update:
+                test_data.set_requires_update()
+            test_data.clear |= clear
+            for i in xrange(0, len(results), 4):
+                test_id, subtest_id, packed, raw_data = results[i:i + 4]
+                test_data.data[test_id][subtest_id].merge(packed, raw_data, *maps)
+
     def update_from_raw_log(self, log_file):
         action_map = self.action_map
         for line in log_file:
@@ -319,26 +425,89 @@ class ExpectedUpdater(object):
                 action_map[action](data)
 
     def update_from_wptreport_log(self, data):
-        action_map = self.action_map
-        action_map["suite_start"]({"run_info": data["run_info"]})
+        self.suite_start({"run_info": data["run_info"]})
         for test in data["results"]:
-            action_map["test_start"]({"test": test["test"]})
-            for subtest in test["subtests"]:
-                action_map["test_status"]({"test": test["test"],
-                                           "subtest": subtest["name"],
-                                           "status": subtest["status"],
-                                           "expected": subtest.get("expected")})
-            action_map["test_end"]({"test": test["test"],
-                                    "status": test["status"],
-                                    "expected": test.get("expected")})
-            if "asserts" in test:
-                asserts = test["asserts"]
-                action_map["assertion_count"]({"test": test["test"],
-                                               "count": asserts["count"],
-                                               "min_expected": asserts["min"],
-                                               "max_expected": asserts["max"]})
+            self.wptreport_result(test)
         for item in data.get("lsan_leaks", []):
-            action_map["lsan_leak"](item)
+            self.lsan_leak(item)
+
+    def update_from_wptreport_stream(self, log_file):
+        """Update from a wptreport format log, reading one test result at
+        a time.
+
+        Returns False, without having used any results, if the log isn't in
+        the wptreport format."""
+        reader = WptreportReader(log_file)
+        data = {}
+        try:
+            for key, value in reader.members():
+                if key == "action":
+                    return False
+                if key != "results":
+                    data[key] = value
+                elif "run_info" in data:
+                    data["results"] = True
+                    self.suite_start({"run_info": data["run_info"]})
+                    for test in value:
+                        self.wptreport_result(test)
+                else:
+                    # The run_info comes after the results, so skip them
+                    # for now and read them again once it's known
+                    data["results"] = False
+                    for _ in value:
+                        pass
+        except ValueError:
+            if "results" not in data:
+                return False
+            raise
+
+        if "results" not in data or "run_info" not in data:
+            return False
+
+        if not data["results"]:
+            log_file.seek(0)
+            reader = WptreportReader(log_file)
+            self.suite_start({"run_info": data["run_info"]})
+            for key, value in reader.members():
+                if key == "results":
+                    for test in value:
+                        self.wptreport_result(test)
+
+        for item in data.get("lsan_leaks", []):
+            self.lsan_leak(item)
+        return True
+
+    def wptreport_result(self, test):
+        """Update from the results of a single test in a wptreport log"""
+        test_id = intern(test["test"].encode("utf8"))
+        test_data = self.id_test_map.get(test_id)
+        if test_data is None:
+            print "Test not found %s, skipping" % test_id
+            return
+
+        if self.ignore_existing:
+            test_data.set_requires_update()
+            test_data.clear.add("expected")
+
+        for subtest in test["subtests"]:
+            self.set_status(test_data, test_id, intern(subtest["name"].encode("utf8")),
+                            subtest["status"], subtest.get("expected"))
+        if test["status"] != "SKIP":
+            self.set_status(test_data, test_id, None, test["status"], test.get("expected"))
+
+        if "asserts" in test:
+            asserts = test["asserts"]
+            self.set_asserts(test_data, test_id, asserts["count"], asserts["min"], asserts["max"])
+
+    def set_status(self, test_data, test_id, subtest, status, expected):
+        test_data.set(test_id, subtest, "status", self.run_info, status_intern.store(status))
+        if expected and expected != status:
+            test_data.set_requires_update()
+
+    def set_asserts(self, test_data, test_id, count, min_expected, max_expected):
+        test_data.set(test_id, None, "asserts", self.run_info, count)
+        if count < min_expected or count > max_expected:
+            test_data.set_requires_update()
 
     def suite_start(self, data):
         self.run_info = run_info_intern.store(data["run_info"])
@@ -353,7 +522,7 @@ class ExpectedUpdater(object):
 
         if self.ignore_existing:
             test_data.set_requires_update()
-            test_data.clear.append("expected")
+            test_data.clear.add("expected")
         self.tests_visited[test_id] = set()
 
     def test_status(self, data):
@@ -365,11 +534,7 @@ class ExpectedUpdater(object):
 
         self.tests_visited[test_id].add(subtest)
 
-        result = status_intern.store(data["status"])
-
-        test_data.set(test_id, subtest, "status", self.run_info, result)
-        if data.get("expected") and data["expected"] != data["status"]:
-            test_data.set_requires_update()
+        self.set_status(test_data, test_id, subtest, data["status"], data.get("expected"))
 
     def test_end(self, data):
         if data["status"] == "SKIP":
@@ -380,11 +545,7 @@ class ExpectedUpdater(object):
         if test_data is None:
             return
 
-        result = status_intern.store(data["status"])
-
-        test_data.set(test_id, None, "status", self.run_info, result)
-        if data.get("expected") and data["status"] != data["expected"]:
-            test_data.set_requires_update()
+        self.set_status(test_data, test_id, None, data["status"], data.get("expected"))
         del self.tests_visited[test_id]
 
     def assertion_count(self, data):
@@ -393,9 +554,8 @@ class ExpectedUpdater(object):
         if test_data is None:
             return
 
-        test_data.set(test_id, None, "asserts", self.run_info, data["count"])
-        if data["count"] < data["min_expected"] or data["count"] > data["max_expected"]:
-            test_data.set_requires_update()
+        self.set_asserts(test_data, test_id, data["count"], data["min_expected"],
+                         data["max_expected"])
 
     def lsan_leak(self, data):
         dir_path = data.get("scope", "/")
@@ -409,6 +569,119 @@ class ExpectedUpdater(object):
             test_data.set_requires_update()
 
 
+# ExpectedUpdater used by the processes reading logs in parallel, which is
+# inherited from the parent process when the worker process is forked
+_log_worker_updater = None
+
+
+def _init_log_worker():
+    # Drop any results inherited from the parent process
+    _log_worker_updater.take_results()
+
+
+def _update_from_log_worker(log_filename):
+    updater = _log_worker_updater
+    with open(log_filename) as f:
+        updater.update_from_log(f)
+    return updater.take_results()
+
+
+class WptreportReader(object):
+    """Incremental reader for logs in the wptreport format.
+
+    A wptreport log is a single JSON object, which may be too large to
+    load at once. This reads the file in blocks and decodes the members of
+    the top level object one at a time; the "results" list is decoded one
+    test at a time."""
+
+    block_size = 1024 * 1024
+    whitespace_re = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.decoder = JSONDecoder()
+        self.buf = b""
+        self.pos = 0
+
+    def read_block(self):
+        """Read more of the file into the buffer, returning False at the end
+        of the file. The amount read grows with the size of the buffer, so that
+        decoding a large value isn't retried too many times."""
+        data = self.log_file.read(max(self.block_size, len(self.buf) - self.pos))
+        if not data:
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """Skip any whitespace and return the next character, without
+        consuming it"""
+        while True:
+            self.pos = self.whitespace_re.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read_block():
+                raise ValueError("Unexpected end of log")
+
+    def expect(self, chars):
+        c = self.next_char()
+        if c not in chars:
+            raise ValueError("Expected one of %s in log, got %s" % (chars, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode the next JSON value"""
+        self.next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # The value may continue past the end of the buffer
+                if not self.read_block():
+                    raise
+                continue
+            # A number might continue in the next block
+            if end == len(self.buf) and self.read_block():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Iterator over (key, value) for each member of the top level object.
+
+        The value of "results" is an iterator over the results, which is
+        exhausted before the next member is read."""
+        self.expect(b"{")
+        if self.next_char() == b"}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(b":")
+            if key == "results":
+                results = self.items()
+                yield key, results
+                for _ in results:
+                    pass
+            else:
+                yield key, self.value()
+            if self.expect(b",}") == b"}":
+                return
+
+    def items(self):
+        """Iterator over the values in a list"""
+        self.expect(b"[")
+        if self.next_char() == b"]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(b",]") == b"]":
+                return
+
+
 def create_test_tree(metadata_path, test_manifest):
     """Create a map of test_id to TestFileData for that test.
     """
@@ -492,6 +765,31 @@ class PackedResultList(object):
         for i, item in enumerate(self.data):
             yield self.unpack(i, item)
 
+    def merge(self, packed, raw_data, prop_map, run_info_map, status_map):
+        """Append results packed in another process.
+
+        :param packed: String containing the packed results
+        :param raw_data: Dictionary of the values of the results that aren't
+                         packed, by index, or None
+        :param prop_map: List mapping the property indices used in the other
+                         process to the ones used here, or None if they are the
+                         same. Likewise for run_info_map and status_map"""
+        offset = len(self.data)
+        if prop_map is None:
+            self.data.fromstring(packed)
+        else:
+            data = array.array("H")
+            data.fromstring(packed)
+            for item in data:
+                self.data.append((prop_map[item >> 12] << 12) +
+                                 (status_map[(item & 0x0F00) >> 8] << 8) +
+                                 run_info_map[item & 0x00FF])
+        if raw_data:
+            if not hasattr(self, "raw_data"):
+                self.raw_data = {}
+            for idx, value in raw_data.iteritems():
+                self.raw_data[offset + idx] = value
+
 
 class TestFileData(object):
     __slots__ = ("url_base", "item_type", "test_path", "metadata_path", "tests",
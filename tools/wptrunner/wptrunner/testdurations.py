@@ -0,0 +1,119 @@
+import json
+import os
+from collections import defaultdict
+
+from mozlog import reader
+
+
+class DurationHandler(reader.LogHandler):
+    """Log handler collecting the duration of each test that ran, in ms,
+    from structured log messages."""
+
+    def __init__(self):
+        self.start_times = {}
+        self.durations = defaultdict(list)
+
+    def test_start(self, data):
+        self.start_times[data["test"]] = data["time"]
+
+    def test_end(self, data):
+        start_time = self.start_times.pop(data["test"], None)
+        # Skipped tests don't run at all, so say nothing about how long
+        # the test takes
+        if start_time is None or data["status"] == "SKIP":
+            return
+        self.durations[data["test"]].append(data["time"] - start_time)
+
+
+class DurationStore(object):
+    """Store of the time taken by each test in previous runs, used to
+    balance chunks and to start the longest tests first.
+
+    The durations are read from raw structured logs and kept, in ms, for
+    the most recent runs of each test, in a JSON file.
+
+    :param path: Path to the JSON file to store the durations in, or None
+                 to only keep them in memory
+    """
+
+    version = 1
+
+    # Number of runs of each test to keep the duration of
+    max_samples = 20
+
+    def __init__(self, path=None):
+        self.path = path
+        self.durations = self.load()
+        self._default_estimate = None
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except ValueError:
+            return {}
+        if data.get("version") != self.version:
+            return {}
+        return data["tests"]
+
+    def dump(self):
+        if self.path is None:
+            return
+        with open(self.path, "w") as f:
+            json.dump({"version": self.version, "tests": self.durations}, f,
+                      sort_keys=True)
+
+    def update_from_log(self, log_file):
+        """Add the test durations from a raw structured log.
+
+        :param log_file: File object containing the log"""
+        handler = DurationHandler()
+        reader.handle_log(reader.read(log_file), handler)
+        for test_id, durations in handler.durations.iteritems():
+            samples = self.durations.setdefault(test_id, [])
+            samples.extend(durations)
+            del samples[:-self.max_samples]
+        self._default_estimate = None
+
+    def mean(self, test_id):
+        """Mean duration of a test in seconds, or None if it is unknown"""
+        samples = self.durations.get(test_id)
+        if not samples:
+            return None
+        return float(sum(samples)) / len(samples) / 1000
+
+    def p95(self, test_id):
+        """95th percentile duration of a test in seconds, or None if it is
+        unknown"""
+        samples = self.durations.get(test_id)
+        if not samples:
+            return None
+        samples = sorted(samples)
+        return float(samples[int(0.95 * (len(samples) - 1) + 0.5)]) / 1000
+
+    @property
+    def default_estimate(self):
+        """Estimated duration in seconds of tests that haven't run before;
+        the median of the mean durations of all the known tests"""
+        if self._default_estimate is None and self.durations:
+            means = sorted(self.mean(test_id) for test_id in self.durations)
+            self._default_estimate = means[len(means) // 2]
+        return self._default_estimate
+
+    def estimate(self, test_id, timeout, stat="mean"):
+        """Estimated duration of a test in seconds.
+
+        :param test_id: Id of the test
+        :param timeout: Timeout of the test in seconds, used as an upper
+                        bound for tests that haven't run before
+        :param stat: "mean" or "p95", the statistic of the previous
+                     durations of the test to use
+        """
+        value = getattr(self, stat)(test_id)
+        if value is not None:
+            return value
+        if self.default_estimate is None:
+            return timeout
+        return min(timeout, self.default_estimate)
@@ -1,4 +1,5 @@
 import hashlib
+import heapq
 import os
 import urlparse
 from abc import ABCMeta, abstractmethod
@@ -69,6 +70,21 @@ class DirectoryHashChunker(TestChunker):
 
 
 class EqualTimeChunker(TestChunker):
+    def __init__(self, total_chunks, chunk_number, durations=None):
+        """
+        :param durations: DurationStore with the durations of previous runs
+                          of the tests, or None to estimate the time taken by
+                          each test from its timeout
+        """
+        TestChunker.__init__(self, total_chunks, chunk_number)
+        self.durations = durations
+
+    def _test_time(self, test):
+        timeout = test.default_timeout if test.timeout != "long" else test.long_timeout
+        if self.durations is None:
+            return timeout
+        return self.durations.estimate(test.id, timeout)
+
     def _group_by_directory(self, manifest_items):
         """Split the list of manifest items into a ordered dict that groups tests in
         so that anything in the same subdirectory beyond a depth of 3 is in the same
@@ -94,8 +110,7 @@ class EqualTimeChunker(TestChunker):
                 by_dir[test_dir] = PathData(test_dir)
 
             data = by_dir[test_dir]
-            time = sum(test.default_timeout if test.timeout !=
-                       "long" else test.long_timeout for test in tests)
+            time = sum(self._test_time(test) for test in tests)
             data.time += time
             total_time += time
             data.tests.append((test_type, test_path, tests))
@@ -425,10 +440,14 @@ class TestLoader(object):
                  total_chunks=1,
                  chunk_number=1,
                  include_https=True,
-                 skip_timeout=False):
+                 skip_timeout=False,
+                 metadata_cache=None,
+                 durations=None):
 
         self.test_types = test_types
         self.run_info = run_info
+        self.metadata_cache = metadata_cache
+        self.durations = durations
 
         self.manifest_filters = manifest_filters if manifest_filters is not None else []
         self.meta_filters = meta_filters if meta_filters is not None else []
@@ -443,17 +462,23 @@ class TestLoader(object):
         self.total_chunks = total_chunks
         self.chunk_number = chunk_number
 
+        chunker_kwargs = {}
+        if chunk_type == "equal_time":
+            chunker_kwargs["durations"] = durations
         self.chunker = {"none": Unchunked,
                         "hash": HashChunker,
                         "dir_hash": DirectoryHashChunker,
                         "equal_time": EqualTimeChunker}[chunk_type](total_chunks,
-                                                                    chunk_number)
+                                                                    chunk_number,
+                                                                    **chunker_kwargs)
 
         self._test_ids = None
 
         self.directory_manifests = {}
 
         self._load_tests()
+        if self.metadata_cache is not None:
+            self.metadata_cache.dump()
 
     @property
     def test_ids(self):
@@ -477,8 +502,8 @@ class TestLoader(object):
         for i in xrange(len(path_parts) + 1):
             path = os.path.join(metadata_path, os.path.sep.join(path_parts[:i]), "__dir__.ini")
             if path not in self.directory_manifests:
-                self.directory_manifests[path] = manifestexpected.get_dir_manifest(path,
-                                                                                   self.run_info)
+                self.directory_manifests[path] = manifestexpected.get_dir_manifest(
+                    path, self.run_info, cache=self.metadata_cache)
             manifest = self.directory_manifests[path]
             if manifest is not None:
                 rv.append(manifest)
@@ -487,7 +512,8 @@ class TestLoader(object):
     def load_metadata(self, test_manifest, metadata_path, test_path):
         inherit_metadata = self.load_dir_metadata(test_manifest, metadata_path, test_path)
         test_metadata = manifestexpected.get_manifest(
-            metadata_path, test_path, test_manifest.url_base, self.run_info)
+            metadata_path, test_path, test_manifest.url_base, self.run_info,
+            cache=self.metadata_cache)
         return inherit_metadata, test_metadata
 
     def iter_tests(self):
@@ -557,6 +583,13 @@ class TestSource(object):
     def group_metadata(cls, state):
         return {"scope": "/"}
 
+    @staticmethod
+    def test_time(durations, test):
+        """Time to allow for a test when ordering the queue, which is the
+        95th percentile of its previous durations, so that tests that are
+        sometimes slow start early"""
+        return durations.estimate(test.id, test.timeout, stat="p95")
+
     def group(self):
         if not self.current_group or len(self.current_group) == 0:
             try:
@@ -587,6 +620,13 @@ class GroupedSource(TestSource):
             group.append(test)
             test.update_metadata(metadata)
 
+        durations = kwargs.get("durations")
+        if durations is not None:
+            # Start the longest groups first, so that they don't end up
+            # running alone at the end of the run
+            groups.sort(key=lambda item: -sum(cls.test_time(durations, test)
+                                              for test in item[0]))
+
         for item in groups:
             test_queue.put(item)
         return test_queue
@@ -599,8 +639,18 @@ class SingleTestSource(TestSource):
         processes = kwargs["processes"]
         queues = [deque([]) for _ in xrange(processes)]
         metadatas = [cls.group_metadata(None) for _ in xrange(processes)]
+        durations = kwargs.get("durations")
+        if durations is not None:
+            # Give each test, longest first, to the process with the least
+            # time assigned so far
+            tests = sorted(tests, key=lambda test: -cls.test_time(durations, test))
+            times = [(0, idx) for idx in xrange(processes)]
         for test in tests:
-            idx = hash(test.id) % processes
+            if durations is not None:
+                time, idx = heapq.heappop(times)
+                heapq.heappush(times, (time + cls.test_time(durations, test), idx))
+            else:
+                idx = hash(test.id) % processes
             group = queues[idx]
             metadata = metadatas[idx]
             group.append(test)
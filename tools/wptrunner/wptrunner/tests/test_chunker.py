@@ -6,6 +6,7 @@ from mozlog import structured
 sys.path.insert(0, join(dirname(__file__), "..", "..", ".."))
 
 from wptrunner.testloader import EqualTimeChunker
+from wptrunner.testdurations import DurationStore
 from manifest.sourcefile import SourceFile
 
 structured.set_default_logger(structured.structuredlog.StructuredLogger("TestChunker"))
@@ -93,6 +94,25 @@ class TestEqualTimeChunker(unittest.TestCase):
                                        ("test", "c", 1))
             list(EqualTimeChunker(4, 1)(tests))
 
+    def test_durations(self):
+        tests = make_mock_manifest(("test", "a", 10), ("test", "a/b", 10),
+                                   ("test", "c", 10))
+        durations = DurationStore()
+        durations.durations = {"%i.html" % i: [1000] for i in range(10)}
+        for _, test_path, items in tests[20:]:
+            test = iter(items).next()
+            test.id = test_path
+            durations.durations[test.id] = [10000, 10000]
+
+        # Without durations every test is expected to take the same time
+        self.assertEquals(tests[:10], list(EqualTimeChunker(2, 1)(tests)))
+
+        chunk_1 = list(EqualTimeChunker(2, 1, durations)(tests))
+        chunk_2 = list(EqualTimeChunker(2, 2, durations)(tests))
+
+        self.assertEquals(tests[:20], chunk_1)
+        self.assertEquals(tests[20:], chunk_2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,107 @@
+import hashlib
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from wptrunner.executors.base import RefTestImplementation, ScreenshotCache
+
+
+@pytest.fixture
+def cache_manager():
+    manager = multiprocessing.Manager()
+    yield manager
+    manager.shutdown()
+
+
+@pytest.fixture
+def screenshot_cache(cache_manager):
+    cache = ScreenshotCache(cache_manager)
+    yield cache
+    cache.cleanup()
+
+
+class MockTest(object):
+    def __init__(self, url, references=None):
+        self.url = url
+        self.references = references or []
+        self.viewport_size = None
+        self.dpi = None
+
+
+class MockExecutor(object):
+    timeout_multiplier = 1
+    logger = None
+
+    def __init__(self, screenshot_cache, screenshots):
+        self.screenshot_cache = screenshot_cache
+        self.screenshots = screenshots
+        self.calls = []
+
+    def screenshot(self, test, viewport_size, dpi):
+        self.calls.append(test.url)
+        return True, self.screenshots[test.url]
+
+
+def add_hash(cache, key, hash_value):
+    cache.set(key, hash_value)
+    cache.flush_counts()
+
+
+def test_screenshot_cache(screenshot_cache):
+    assert screenshot_cache.get("/a.html") is None
+    screenshot_cache.set("/a.html", "abc")
+    assert screenshot_cache.get("/a.html") == "abc"
+
+    assert screenshot_cache.get_screenshot("/a.html") is None
+    screenshot_cache.set_screenshot("/a.html", b"data")
+    assert screenshot_cache.get_screenshot("/a.html") == b"data"
+    assert os.listdir(screenshot_cache.screenshot_dir) == ["abc"]
+
+    screenshot_cache.flush_counts()
+    assert screenshot_cache.hit_counts() == {"local": 1, "shared": 0, "miss": 1}
+
+    screenshot_cache.cleanup()
+    assert not os.path.exists(screenshot_cache.screenshot_dir)
+
+
+def test_screenshot_cache_processes(screenshot_cache):
+    proc = multiprocessing.Process(target=add_hash,
+                                   args=(screenshot_cache, "/a.html", "abc"))
+    proc.start()
+    proc.join()
+
+    # Only the first lookup goes to the shared index
+    assert screenshot_cache.get("/a.html") == "abc"
+    assert screenshot_cache.get("/a.html") == "abc"
+    assert screenshot_cache.local == {"/a.html": "abc"}
+    screenshot_cache.flush_counts()
+    assert screenshot_cache.hit_counts() == {"local": 1, "shared": 1, "miss": 0}
+
+
+def test_reftest_implementation(screenshot_cache):
+    screenshots = {"/test.html": b"test", "/ref.html": b"ref"}
+    ref = MockTest("/ref.html")
+    test = MockTest("/test.html", [(ref, "==")])
+
+    executor = MockExecutor(screenshot_cache, screenshots)
+    implementation = RefTestImplementation(executor)
+    result = implementation.run_test(test)
+    assert result["status"] == "FAIL"
+    assert executor.calls == ["/test.html", "/ref.html"]
+    assert screenshot_cache.get((ref.url, None, None)) == hashlib.sha1(b"ref").hexdigest()
+
+    # A second executor gets the hashes from the cache, and only takes the
+    # screenshots again for the failure message the first time
+    for calls in [["/test.html", "/ref.html"], []]:
+        executor = MockExecutor(screenshot_cache, screenshots)
+        implementation = RefTestImplementation(executor)
+        result = implementation.run_test(test)
+        assert result["status"] == "FAIL"
+        assert executor.calls == calls
+        assert result["extra"]["reftest_screenshots"] == [
+            {"url": "/test.html", "screenshot": b"test"}, "==",
+            {"url": "/ref.html", "screenshot": b"ref"}]
@@ -0,0 +1,107 @@
+import os
+import sys
+from io import BytesIO
+
+import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from wptrunner import manifestexpected, wpttest
+from .test_chunker import make_mock_manifest
+
+dir_ini = """\
+prefs: [@Reset, b:c]
+tags: [b, c]
+"""
+
+test_ini = """\
+[0.html]
+  prefs: [c:d]
+  expected:
+    if os == 'win': FAIL
+    if os == 'mac': [TIMEOUT, @Reset]
+    PASS
+  max-asserts: 3
+
+  [subtest]
+    expected:
+      if os == 'win': FAIL
+"""
+
+
+def write_files(tmpdir):
+    tmpdir.join("__dir__.ini").write(dir_ini, ensure=True)
+    tmpdir.join("a", "0.html.ini").write(test_ini, ensure=True)
+    return str(tmpdir)
+
+
+def flatten(node):
+    return (node.__class__, node.name, sorted(node._data.items()),
+            [flatten(child) for child in node.children])
+
+
+def compile_test(run_info):
+    return manifestexpected.static.compile(BytesIO(test_ini),
+                                           run_info,
+                                           data_cls_getter=manifestexpected.data_cls_getter,
+                                           test_path="a/0.html",
+                                           url_base="/")
+
+
+def test_metadata_cache(tmpdir):
+    metadata_root = write_files(tmpdir.join("meta"))
+    cache_path = str(tmpdir.join("metadata.cache"))
+    test_path = os.path.join("a", "0.html")
+
+    cache = manifestexpected.MetadataCache(cache_path)
+    for os_name in ["win", "mac", "linux"]:
+        manifest = manifestexpected.get_manifest(metadata_root, test_path, "/",
+                                                 {"os": os_name}, cache=cache)
+        assert flatten(manifest) == flatten(compile_test({"os": os_name}))
+        manifestexpected.get_dir_manifest(os.path.join(metadata_root, "__dir__.ini"),
+                                          {"os": os_name}, cache=cache)
+    assert manifestexpected.get_manifest(metadata_root, "missing.html", "/",
+                                         {"os": "win"}, cache=cache) is None
+    cache.dump()
+
+    cache = manifestexpected.MetadataCache(cache_path)
+    with mock.patch.object(manifestexpected, "parse") as parse:
+        with mock.patch.object(manifestexpected.static, "specialize") as specialize:
+            manifest = manifestexpected.get_manifest(metadata_root, test_path, "/",
+                                                     {"os": "mac"}, cache=cache)
+            dir_manifest = manifestexpected.get_dir_manifest(
+                os.path.join(metadata_root, "__dir__.ini"), {"os": "mac"}, cache=cache)
+            assert not specialize.called
+        # A new run_info is compiled from the cached AST
+        manifestexpected.get_manifest(metadata_root, test_path, "/", {"os": "other"}, cache=cache)
+        assert dir_manifest is not None
+        assert not parse.called
+    assert flatten(manifest) == flatten(compile_test({"os": "mac"}))
+    # Atoms are still compared by identity
+    assert manifest.get_test("/a/0.html").get("expected")[1] is manifestexpected.atoms["Reset"]
+
+    tests = make_mock_manifest(("test", "a", 1))
+    test = tests[0][2].pop()
+    test_obj = wpttest.from_manifest(tests, test, [dir_manifest],
+                                     manifest.get_test(test.url))
+    assert test_obj.prefs == {"b": "c", "c": "d"}
+
+
+def test_metadata_cache_changed(tmpdir):
+    metadata_root = write_files(tmpdir.join("meta"))
+    cache_path = str(tmpdir.join("metadata.cache"))
+    path = os.path.join(metadata_root, "__dir__.ini")
+
+    cache = manifestexpected.MetadataCache(cache_path)
+    assert cache.compile(path, {}, lambda x, y: manifestexpected.DirectoryManifest).get("tags") == ["b", "c"]
+    cache.dump()
+
+    with open(path, "w") as f:
+        f.write("tags: [d]\n")
+    os.utime(path, (1000000000, 1000000000))
+    cache = manifestexpected.MetadataCache(cache_path)
+    assert cache.compile(path, {}, lambda x, y: manifestexpected.DirectoryManifest).get("tags") == ["d"]
+    cache.dump()
+
+    with mock.patch.object(manifestexpected, "parser_version", return_value="changed"):
+        assert manifestexpected.MetadataCache(cache_path).data == {}
@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from wptrunner.testdurations import DurationStore
+
+
+def make_log(*tests):
+    """Raw structured log for a run of each (test id, status, duration in ms)"""
+    lines = [{"action": "suite_start", "time": 0, "tests": [item[0] for item in tests]}]
+    time = 1000
+    for test_id, status, duration in tests:
+        lines.append({"action": "test_start", "time": time, "test": test_id})
+        time += duration
+        lines.append({"action": "test_end", "time": time, "test": test_id, "status": status})
+    lines.append({"action": "suite_end", "time": time})
+    return BytesIO("\n".join(json.dumps(line) for line in lines))
+
+
+def test_update_from_log():
+    durations = DurationStore()
+    durations.update_from_log(make_log(("/a.html", "OK", 1000),
+                                       ("/b.html", "SKIP", 0),
+                                       ("/c.html", "TIMEOUT", 10000)))
+    durations.update_from_log(make_log(("/a.html", "OK", 3000)))
+
+    assert durations.durations == {"/a.html": [1000, 3000],
+                                   "/c.html": [10000]}
+    assert durations.mean("/a.html") == 2
+    assert durations.p95("/a.html") == 3
+    assert durations.mean("/b.html") is None
+    assert durations.p95("/b.html") is None
+
+
+def test_max_samples():
+    durations = DurationStore()
+    for i in range(DurationStore.max_samples + 5):
+        durations.update_from_log(make_log(("/a.html", "PASS", i)))
+    assert durations.durations["/a.html"] == range(5, DurationStore.max_samples + 5)
+
+
+def test_p95():
+    durations = DurationStore()
+    durations.durations = {"/a.html": range(100, 0, -1)}
+    assert durations.p95("/a.html") == 0.095
+
+
+def test_estimate():
+    durations = DurationStore()
+    assert durations.estimate("/a.html", 10) == 10
+
+    durations.durations = {"/a.html": [1000, 2000],
+                           "/b.html": [4000],
+                           "/c.html": [20000]}
+    assert durations.estimate("/a.html", 10) == 1.5
+    assert durations.estimate("/a.html", 10, stat="p95") == 2
+    # Unknown tests take as long as the median known test, up to their timeout
+    assert durations.estimate("/d.html", 10) == 4
+    assert durations.estimate("/d.html", 2) == 2
+
+
+def test_load_dump(tmpdir):
+    path = str(tmpdir.join("durations.json"))
+    durations = DurationStore(path)
+    assert durations.durations == {}
+    durations.update_from_log(make_log(("/a.html", "OK", 1000)))
+    durations.dump()
+
+    assert DurationStore(path).durations == {"/a.html": [1000]}
+
+    with open(path, "w") as f:
+        json.dump({"version": DurationStore.version + 1, "tests": {"/a.html": [1000]}}, f)
+    assert DurationStore(path).durations == {}
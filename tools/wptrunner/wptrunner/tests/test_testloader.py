@@ -9,7 +9,8 @@ import pytest
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
 
 from mozlog import structured
-from wptrunner.testloader import TestFilter as Filter
+from wptrunner.testdurations import DurationStore
+from wptrunner.testloader import PathGroupedSource, SingleTestSource, TestFilter as Filter
 from .test_chunker import make_mock_manifest
 
 structured.set_default_logger(structured.structuredlog.StructuredLogger("TestLoader"))
@@ -32,3 +33,56 @@ def test_filter_unicode():
         f.flush()
 
         Filter(manifest_path=f.name, test_manifests=tests)
+
+
+class MockRunTest(object):
+    def __init__(self, url, timeout=10):
+        self.id = url
+        self.url = url
+        self.timeout = timeout
+
+    def update_metadata(self, metadata):
+        pass
+
+
+def get_groups(test_queue, count):
+    return [[test.id for test in group] for group, _ in
+            (test_queue.get(timeout=5) for _ in range(count))]
+
+
+def test_path_grouped_source_durations():
+    tests = [MockRunTest(url) for url in ["/a/0.html", "/a/1.html", "/b/0.html",
+                                          "/c/0.html", "/c/1.html"]]
+    durations = DurationStore()
+    durations.durations = {"/a/0.html": [1000],
+                           "/a/1.html": [1000],
+                           "/b/0.html": [5000, 1000, 6000],
+                           "/c/0.html": [2000]}
+
+    test_queue = PathGroupedSource.make_queue(tests, depth=1)
+    assert get_groups(test_queue, 3) == [["/a/0.html", "/a/1.html"],
+                                         ["/b/0.html"],
+                                         ["/c/0.html", "/c/1.html"]]
+
+    # Groups are ordered longest first, using the 95th percentile duration
+    # of each test; /c/1.html hasn't run before so takes as long as the
+    # median test
+    test_queue = PathGroupedSource.make_queue(tests, depth=1, durations=durations)
+    assert get_groups(test_queue, 3) == [["/b/0.html"],
+                                         ["/c/0.html", "/c/1.html"],
+                                         ["/a/0.html", "/a/1.html"]]
+
+
+def test_single_test_source_durations():
+    tests = [MockRunTest("/%i.html" % i) for i in range(6)]
+    durations = DurationStore()
+    durations.durations = {"/0.html": [1000],
+                           "/1.html": [6000],
+                           "/2.html": [2000],
+                           "/3.html": [3000],
+                           "/4.html": [2000],
+                           "/5.html": [4000]}
+
+    test_queue = SingleTestSource.make_queue(tests, processes=2, durations=durations)
+    assert get_groups(test_queue, 2) == [["/1.html", "/2.html", "/0.html"],
+                                         ["/5.html", "/3.html", "/4.html"]]
@@ -4,6 +4,8 @@ import os
 import sys
 from io import BytesIO
 
+import pytest
+
 from .. import metadata, manifestupdate
 from mozlog import structuredlog, handlers, formatters
 
@@ -606,3 +608,136 @@ def test_update_wptreport_1():
 
     assert len(updated) == 1
     assert updated[0][1].get("lsan-allowed") == ["baz"]
+
+
+def test_update_wptreport_results_first():
+    test_id = "/path/to/test.htm"
+    tests = [("path/to/test.htm", [test_id], "testharness",
+              """[test.htm]
+  [test1]
+    expected: FAIL""")]
+
+    # The run_info comes after the results, so they are read twice
+    log = BytesIO(b"""{"results": [{"test": "/path/to/test.htm",
+                                   "subtests": [{"name": "test1",
+                                                 "status": "TIMEOUT",
+                                                 "expected": "FAIL"}],
+                                   "status": "OK"}],
+                      "run_info": {"os": "linux"}}""")
+
+    id_test_map, updater = create_updater(tests)
+    updater.update_from_log(log)
+    updated = list(metadata.update_results(id_test_map, ["os"], [], False))
+
+    assert len(updated) == 1
+    assert updated[0][1].get_test(test_id).children[0].get(
+        "expected", {"os": "linux"}) == "TIMEOUT"
+
+
+def test_wptreport_reader():
+    data = {"run_info": {"os": "linux"},
+            "time_start": 1234567890,
+            "results": [{"test": "/a/test%i.htm" % i,
+                         "subtests": [{"name": u"\u53f0 %i" % j, "status": "PASS"}
+                                      for j in range(i)],
+                         "status": "OK"}
+                        for i in range(20)],
+            "lsan_leaks": []}
+
+    for indent in [None, 2]:
+        log = BytesIO(json.dumps(data, indent=indent))
+        reader = metadata.WptreportReader(log)
+        # Values are split across blocks
+        reader.block_size = 7
+        members = {}
+        for key, value in reader.members():
+            if key == "results":
+                value = list(value)
+            members[key] = value
+        assert members == data
+
+
+def test_wptreport_reader_invalid():
+    for data in [b"", b"{", b"[]", b'{"results": [{}', b'{"results": [1 2]}']:
+        reader = metadata.WptreportReader(BytesIO(data))
+        with pytest.raises(ValueError):
+            for key, value in reader.members():
+                if key == "results":
+                    list(value)
+
+
+def test_update_raw_log_not_wptreport():
+    # A raw log's first line is a JSON object, but it isn't a wptreport log
+    test_id = "/path/to/test.htm"
+    tests = [("path/to/test.htm", [test_id], "testharness", """[test.htm]
+  [test1]
+    expected: FAIL""")]
+    log = create_log(suite_log([("test_start", {"test": test_id}),
+                                ("test_status", {"test": test_id,
+                                                 "subtest": "test1",
+                                                 "status": "PASS",
+                                                 "expected": "FAIL"}),
+                                ("test_end", {"test": test_id,
+                                              "status": "OK"})]))
+    id_test_map, updater = create_updater(tests)
+    assert not updater.update_from_wptreport_stream(log)
+    log.seek(0)
+    updater.update_from_log(log)
+    updated = list(metadata.update_results(id_test_map, [], [], False))
+    assert len(updated) == 1
+    assert updated[0][1].is_empty
+
+
+def test_packed_result_list_merge():
+    results = metadata.PackedResultList()
+    status = metadata.prop_intern.store("status")
+    asserts = metadata.prop_intern.store("asserts")
+    run_info = metadata.run_info_intern.store({"os": "linux"})
+    results.append(status, run_info, metadata.status_intern.store("PASS"))
+
+    other = metadata.PackedResultList()
+    other.append(asserts, run_info, 3)
+    other.append(status, run_info, metadata.status_intern.store("FAIL"))
+
+    # The other process interned the same values with the indices swapped
+    prop_map = [0] * 16
+    prop_map[asserts] = status
+    prop_map[status] = asserts
+    results.merge(other.data.tostring(), other.raw_data, prop_map,
+                  range(256), range(16))
+    assert list(results) == [("status", {"os": "linux"}, "PASS"),
+                             ("status", {"os": "linux"}, 3),
+                             ("asserts", {"os": "linux"}, "FAIL")]
+
+
+def test_update_parallel(tmpdir):
+    test_id = "/path/to/test.htm"
+    tests = [("path/to/test.htm", [test_id], "testharness", """[test.htm]
+  [test1]
+    expected: FAIL""")]
+
+    logs = []
+    for i, (os_name, status) in enumerate([("osx", "FAIL"), ("linux", "TIMEOUT"),
+                                           ("win", "PASS")]):
+        log = suite_log([("test_start", {"test": test_id}),
+                         ("test_status", {"test": test_id,
+                                          "subtest": "test1",
+                                          "status": status,
+                                          "expected": "FAIL"}),
+                         ("test_end", {"test": test_id,
+                                       "status": "OK"})],
+                        run_info={"debug": False, "os": os_name})
+        path = str(tmpdir.join("log%i.json" % i))
+        with open(path, "wb") as f:
+            f.write(create_log(log).read())
+        logs.append(path)
+
+    id_test_map, updater = create_updater(tests)
+    updater.update_from_logs_parallel(logs, 2)
+    updated = list(metadata.update_results(id_test_map, ["debug", "os"], ["debug"], False))
+    new_manifest = updated[0][1]
+
+    subtest = new_manifest.get_test(test_id).children[0]
+    assert subtest.get("expected", {"debug": False, "os": "osx"}) == "FAIL"
+    assert subtest.get("expected", {"debug": False, "os": "linux"}) == "TIMEOUT"
+    assert subtest.get("expected", {"debug": False, "os": "win"}) == "PASS"
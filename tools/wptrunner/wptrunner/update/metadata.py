@@ -32,7 +32,8 @@ class UpdateExpected(Step):
                                  sync_root=sync_root,
                                  property_order=state.property_order,
                                  boolean_properties=state.boolean_properties,
-                                 stability=state.stability)
+                                 stability=state.stability,
+                                 processes=getattr(state, "processes", None))
 
 
 class CreateMetadataPatch(Step):
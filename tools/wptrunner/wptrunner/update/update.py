@@ -92,6 +92,7 @@ class UpdateMetadata(Step):
             state.product = kwargs["product"]
             state.config = kwargs["config"]
             state.extra_properties = kwargs["extra_property"]
+            state.processes = kwargs.get("processes")
             runner = MetadataUpdateRunner(self.logger, state)
             runner.run()
 
@@ -188,6 +188,10 @@ scheme host and port.""")
                               help="Path to root directory containing test files"),
     config_group.add_argument("--manifest", action="store", type=abs_path, dest="manifest_path",
                               help="Path to test manifest (default is ${metadata_root}/MANIFEST.json)")
+    config_group.add_argument("--metadata-cache", action="store", type=abs_path,
+                              help="Path to a file to cache the parsed test metadata in, "
+                              "so that unchanged metadata files aren't parsed again on "
+                              "later runs")
     config_group.add_argument("--run-info", action="store", type=abs_path,
                               help="Path to directory containing extra json files to add to run info")
     config_group.add_argument("--product", action="store", choices=product_choices,
@@ -226,6 +230,13 @@ scheme host and port.""")
                                 help="Chunk number to run")
     chunking_group.add_argument("--chunk-type", action="store", choices=["none", "equal_time", "hash", "dir_hash"],
                                 default=None, help="Chunking type to use")
+    chunking_group.add_argument("--duration-db", action="store", type=abs_path,
+                                help="Path to a file storing the durations of tests in previous "
+                                "runs, used to balance equal_time chunks and to start the "
+                                "longest tests first")
+    chunking_group.add_argument("--duration-log", action="append", type=abs_path,
+                                help="Raw structured log of a previous run to add test durations "
+                                "from, before they are used. May be repeated")
 
     ssl_group = parser.add_argument_group("SSL/TLS")
     ssl_group.add_argument("--ssl-type", action="store", default=None,
@@ -593,6 +604,8 @@ def create_parser_update(product_choices=None):
                         help="List of glob-style paths to include which would otherwise be excluded when syncing tests")
     parser.add_argument("--extra-property", action="append", default=[],
                         help="Extra property from run_info.json to use in metadata update")
+    parser.add_argument("--processes", action="store", type=int, default=None,
+                        help="Number of log files to read at once, each in a separate process")
     # Should make this required iff run=logfile
     parser.add_argument("run_log", nargs="*", type=abs_path,
                         help="Log file from run of tests")
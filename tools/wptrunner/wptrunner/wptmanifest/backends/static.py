@@ -123,6 +123,84 @@ class Compiler(NodeVisitor):
                 "!=": operator.ne}[node.data]
 
 
+class Specializer(Compiler):
+    """Compiler backend that evaluates conditional expressions to give
+    a tree of plain data, which can be stored and later turned into the
+    output of Compiler using :func:`build`.
+
+    Each data node is represented by a list of [name, [[key, value], ...],
+    children], with the keys in the order they're set by Compiler."""
+
+    def specialize(self, tree, expr_data):
+        """Evaluate the conditional expressions in a raw AST.
+
+        tree - The root node of the wptmanifest AST to compile
+
+        expr_data - A dictionary of key / value pairs to use when
+                    evaluating conditional expressions
+        """
+        self.expr_data = expr_data
+        self.output_node = None
+        self.visit(tree)
+        return self.output_node
+
+    def visit_DataNode(self, node):
+        output_parent = self.output_node
+        self.output_node = [node.data, [], []]
+
+        for child in node.children:
+            self.visit(child)
+
+        if output_parent is not None:
+            output_parent[2].append(self.output_node)
+            self.output_node = output_parent
+
+    def visit_KeyValueNode(self, node):
+        key_value = None
+        for child in node.children:
+            value = self.visit(child)
+            if value is not None:
+                key_value = value
+                break
+        if key_value is not None:
+            self.output_node[1].append([node.data, key_value])
+
+
+def _copy_value(value):
+    # Atoms are compared by identity, so only copy the lists
+    if isinstance(value, list):
+        return [_copy_value(item) for item in value]
+    return value
+
+
+def build(tree, data_cls_getter=None, **kwargs):
+    """Build the output of Compiler.compile from the output of
+    Specializer.specialize.
+
+    tree - The tree of plain data to build the output from
+
+    data_cls_getter - As for Compiler.compile, except that the current
+                      ast node is always passed as None, so this can
+                      only be used when the class of the output nodes
+                      doesn't depend on it
+    """
+    if data_cls_getter is None:
+        data_cls_getter = lambda x, y: ManifestItem
+
+    def build_node(output_node, data):
+        _, values, children = data
+        for key, value in values:
+            output_node.set(key, _copy_value(value))
+        for child in children:
+            child_node = data_cls_getter(output_node, None)(child[0])
+            build_node(child_node, child)
+            output_node.append(child_node)
+
+    root = data_cls_getter(None, None)(None, **kwargs)
+    build_node(root, tree)
+    return root
+
+
 class ManifestItem(object):
     def __init__(self, name, **kwargs):
         self.parent = None
@@ -221,3 +299,7 @@ def compile(stream, expr_data, data_cls_getter=None, **kwargs):
                        expr_data,
                        data_cls_getter=data_cls_getter,
                        **kwargs)
+
+
+def specialize(ast, expr_data):
+    return Specializer().specialize(ast, expr_data)
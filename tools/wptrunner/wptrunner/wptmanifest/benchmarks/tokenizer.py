@@ -0,0 +1,107 @@
+"""Benchmark tokenizing and parsing metadata files with each tokenizer.
+
+Reads every .ini file under a metadata root, then times tokenizing and
+parsing all of them with Tokenizer and with FastTokenizer, checking that
+both give the same tokens. Without --metadata-root a synthetic metadata
+tree is used, with headings, conditional values, lists and comments.
+
+Run as::
+
+  python tools/wptrunner/wptrunner/wptmanifest/benchmarks/tokenizer.py [--metadata-root PATH]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+from cStringIO import StringIO
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, os.path.abspath(os.path.join(here, os.pardir, os.pardir, os.pardir)))
+
+from wptrunner.wptmanifest import parser
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--metadata-root",
+                        help="Directory containing .ini metadata files")
+    parser.add_argument("--files", type=int, default=1000,
+                        help="Number of files in the synthetic metadata tree")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times to tokenize and parse each file")
+    return parser
+
+
+def synthetic_file(i):
+    rv = ["[test%i.html]" % i,
+          "  disabled: if os == \"win\": https://bugs.example/%i" % i,
+          "  prefs: [dom.example.enabled:true, layout.css.example:%i]" % i,
+          "  expected:",
+          "    if debug and (os == \"linux\") and (version == \"Ubuntu 16.04\"): TIMEOUT",
+          "    if not e10s and (processor == \"x86\") and (bits == 32): [PASS, FAIL]",
+          "    FAIL # bug %i" % i]
+    for j in range(i % 10):
+        rv.extend(["",
+                   "  [Subtest %i: \\\"escaped\\\" and 'quoted' text %i]" % (j, i),
+                   "    expected:",
+                   "      if (os == \"mac\") or (os == \"win\" and version == \"10.0.17134\"): FAIL",
+                   "      if webrender and not debug: [TIMEOUT, NOTRUN]"])
+    return "\n".join(rv).encode("utf8")
+
+
+def metadata_files(metadata_root):
+    for dir_path, dir_names, file_names in os.walk(metadata_root):
+        for file_name in file_names:
+            if file_name.endswith(".ini"):
+                with open(os.path.join(dir_path, file_name), "rb") as f:
+                    yield f.read()
+
+
+def tokenize(tokenizer_cls, data):
+    tokenizer = tokenizer_cls()
+    rv = []
+    for token in tokenizer.tokenize(StringIO(data)):
+        rv.append(token)
+        if token[0] == parser.token_types.eof:
+            break
+    return rv
+
+
+def run(metadata_root, files, repeat):
+    if metadata_root is not None:
+        contents = list(metadata_files(metadata_root))
+    else:
+        contents = [synthetic_file(i) for i in range(files)]
+    print("%i files, %i bytes" % (len(contents), sum(len(data) for data in contents)))
+
+    tokens = {}
+    for tokenizer_cls in [parser.Tokenizer, parser.FastTokenizer]:
+        name = tokenizer_cls.__name__
+        start = time.time()
+        for _ in range(repeat):
+            tokens[name] = [tokenize(tokenizer_cls, data) for data in contents]
+        tokenize_time = (time.time() - start) / repeat
+
+        start = time.time()
+        for _ in range(repeat):
+            for data in contents:
+                parser.parse(StringIO(data), tokenizer_cls)
+        parse_time = (time.time() - start) / repeat
+        print("%s: tokenize %.2fs, parse %.2fs" % (name, tokenize_time, parse_time))
+
+    if tokens["Tokenizer"] != tokens["FastTokenizer"]:
+        print("Tokens differ")
+        return 1
+    return 0
+
+
+def main():
+    kwargs = vars(get_parser().parse_args())
+    return run(kwargs["metadata_root"], kwargs["files"], kwargs["repeat"])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -155,3 +155,26 @@ class StringNode(Node):
 
 class NumberNode(ValueNode):
     pass
+
+
+def to_data(node):
+    """Convert an AST into nested lists of [class name, data, children]
+    for each node, which can be stored and converted back with
+    :func:`from_data`"""
+    return [node.__class__.__name__, node.data, [to_data(child) for child in node.children]]
+
+
+def from_data(data):
+    """Convert the output of :func:`to_data` back into an AST"""
+    cls_name, node_data, children = data
+    cls = globals()[cls_name]
+    assert issubclass(cls, Node)
+    # The children are attached directly, since they're already in the
+    # order that the append methods maintain
+    node = cls.__new__(cls)
+    Node.__init__(node, node_data)
+    for child in children:
+        child_node = from_data(child)
+        child_node.parent = node
+        node.children.append(child_node)
+    return node
@@ -14,6 +14,7 @@
 
 from __future__ import unicode_literals
 
+import re
 from cStringIO import StringIO
 
 from node import (AtomNode, BinaryExpressionNode, BinaryOperatorNode,
@@ -505,15 +506,185 @@ class Tokenizer(object):
             raise ParseError(self.filename, self.line_number, "Invalid character escape")
 
 
+class FastTokenizer(Tokenizer):
+    """Tokenizer giving the same tokens as Tokenizer, but which consumes
+    runs of characters that don't need special handling using a regexp
+    for each state, rather than one character at a time."""
+
+    space_re = re.compile(" *")
+    heading_re = re.compile(r"[^\\\]]+")
+    key_re = re.compile(r"[^\\ :]+")
+    list_value_re = re.compile(r"[^\\#, \]]+")
+    value_re = re.compile(r"[^\\# ]+")
+    string_res = {"'": re.compile(r"[^\\']+"),
+                  '"': re.compile(r'[^\\"]+')}
+    operator_re = re.compile("[%s]*" % operator_chars)
+    number_re = re.compile(r"[0-9]*(?:\.[0-9]*)?")
+    ident_re = re.compile(r"[^.\[\]()=! :]*")
+
+    def consume_run(self, regexp):
+        m = regexp.match(self.line, self.index)
+        if m is None:
+            return ""
+        self.index = m.end()
+        return m.group()
+
+    def skip_whitespace(self):
+        self.index = self.space_re.match(self.line, self.index).end()
+
+    def heading_state(self):
+        rv = ""
+        while True:
+            rv += self.consume_run(self.heading_re)
+            c = self.char()
+            if c == "\\":
+                rv += self.consume_escape()
+            elif c == "]":
+                break
+            else:
+                raise ParseError(self.filename, self.line_number, "EOL in heading")
+
+        yield (token_types.string, decode(rv))
+        yield (token_types.paren, "]")
+        self.consume()
+        self.state = self.line_end_state
+        self.next_state = self.data_line_state
+
+    def key_state(self):
+        rv = ""
+        while True:
+            rv += self.consume_run(self.key_re)
+            c = self.char()
+            if c == " ":
+                self.skip_whitespace()
+                if self.char() != ":":
+                    raise ParseError(self.filename, self.line_number, "Space in key name")
+                break
+            elif c == ":":
+                break
+            elif c == eol:
+                raise ParseError(self.filename, self.line_number, "EOL in key name (missing ':'?)")
+            else:
+                rv += self.consume_escape()
+        yield (token_types.string, decode(rv))
+        yield (token_types.separator, ":")
+        self.consume()
+        self.state = self.after_key_state
+
+    def list_value_state(self):
+        rv = ""
+        spaces = 0
+        while True:
+            value = self.consume_run(self.list_value_re)
+            if value:
+                rv += " " * spaces + value
+                spaces = 0
+            c = self.char()
+            if c == "\\":
+                # Like Tokenizer, this doesn't add the preceding spaces
+                rv += self.consume_escape()
+            elif c == eol:
+                raise ParseError(self.filename, self.line_number, "EOL in list value")
+            elif c == "#":
+                raise ParseError(self.filename, self.line_number, "EOL in list value (comment)")
+            elif c == ",":
+                self.state = self.list_value_start_state
+                self.consume()
+                break
+            elif c == " ":
+                spaces += len(self.consume_run(self.space_re))
+            else:
+                self.state = self.list_end_state
+                self.consume()
+                break
+
+        if rv:
+            yield (token_types.string, decode(rv))
+
+    def value_inner_state(self):
+        rv = ""
+        spaces = 0
+        while True:
+            value = self.consume_run(self.value_re)
+            if value:
+                rv += " " * spaces + value
+                spaces = 0
+            c = self.char()
+            if c == "\\":
+                rv += self.consume_escape()
+            elif c == "#":
+                self.state = self.comment_state
+                break
+            elif c == " ":
+                spaces += len(self.consume_run(self.space_re))
+            else:
+                self.state = self.line_end_state
+                break
+        yield (token_types.string, decode(rv))
+
+    def comment_state(self):
+        self.index = len(self.line)
+        self.state = self.eol_state
+
+    def consume_string(self, quote_char):
+        rv = ""
+        string_re = self.string_res[quote_char]
+        while True:
+            rv += self.consume_run(string_re)
+            c = self.char()
+            if c == "\\":
+                rv += self.consume_escape()
+            elif c == quote_char:
+                self.consume()
+                break
+            else:
+                raise ParseError(self.filename, self.line_number, "EOL in quoted string")
+
+        return decode(rv)
+
+    def operator_state(self):
+        index_0 = self.index
+        self.consume_run(self.operator_re)
+        if self.char() != eol:
+            self.state = self.expr_state
+        yield (token_types.ident, self.line[index_0:self.index])
+
+    def digit_state(self):
+        index_0 = self.index
+        self.consume_run(self.number_re)
+        c = self.char()
+        if c == ".":
+            raise ParseError(self.filename, self.line_number, "Invalid number")
+        elif c != eol and c not in parens and c not in operator_chars and c not in " :":
+            raise ParseError(self.filename, self.line_number, "Invalid character in number")
+
+        self.state = self.expr_state
+        yield (token_types.number, self.line[index_0:self.index])
+
+    def ident_state(self):
+        index_0 = self.index
+        self.consume_run(self.ident_re)
+        self.state = self.expr_state
+        yield (token_types.ident, self.line[index_0:self.index])
+
+
+# Tokenizer used by Parser unless another is given
+default_tokenizer_cls = FastTokenizer
+
+
 class Parser(object):
-    def __init__(self):
+    def __init__(self, tokenizer_cls=None):
+        self.tokenizer_cls = tokenizer_cls
         self.reset()
 
     def reset(self):
         self.token = None
         self.unary_operators = "!"
         self.binary_operators = frozenset(["&&", "||", "=="])
-        self.tokenizer = Tokenizer()
+        tokenizer_cls = self.tokenizer_cls
+        if tokenizer_cls is None:
+            tokenizer_cls = default_tokenizer_cls
+        self.tokenizer = tokenizer_cls()
         self.token_generator = None
         self.tree = Treebuilder(DataNode(None))
         self.expr_builder = None
@@ -758,6 +929,6 @@ class ExpressionBuilder(object):
         return precedence(operator)
 
 
-def parse(stream):
-    p = Parser()
+def parse(stream, tokenizer_cls=None):
+    p = Parser(tokenizer_cls)
     return p.parse(stream)
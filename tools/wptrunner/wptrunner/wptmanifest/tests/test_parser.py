@@ -108,5 +108,10 @@ key:
             self.parse("key: @true")
 
 
+class TestExpressionTokenizer(TestExpression):
+    def setUp(self):
+        self.parser = parser.Parser(parser.Tokenizer)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,3 +1,4 @@
+import random
 import sys
 import os
 import unittest
@@ -340,5 +341,53 @@ key:
              (token_types.separator, ":"),
              (token_types.string, "value")])
 
+
+class FastTokenizerTest(TokenizerTest):
+    def setUp(self):
+        self.tokenizer = parser.FastTokenizer()
+
+
+class TokenizerFuzzTest(unittest.TestCase):
+    # Lines with the general shape of a manifest, with text made of
+    # pieces that are likely to need special handling
+    lines = ["[%s]", "%s: %s", "%s: [%s, %s]", "%s:", "if %s: %s", "if %s: [%s]",
+             "%s", "[%s, %s", "@%s"]
+    pieces = ["[", "]", "(", ")", ":", ",", "#", "@", "\\", "\\x4", "\\u0041", "\\n",
+              "'", '"', "'a b'", '"\\""', " ", "  ", "if ", "==", "!=", "=", "!", "not ",
+              "and ", " or ", "1", "2.", ".5", "1.2.3", "key", "a b", "\xc3\xa9",
+              "Reset", "os == 'win'"]
+
+    def text(self, rand):
+        return "".join(rand.choice(self.pieces) for _ in range(rand.randint(0, 4)))
+
+    def input_str(self, rand):
+        rv = []
+        for _ in range(rand.randint(1, 6)):
+            line = rand.choice(self.lines)
+            line = line % tuple(self.text(rand) for _ in range(line.count("%s")))
+            rv.append(" " * rand.choice([0, 0, 2, 4, 5]) + line)
+        return "\n".join(rv)
+
+    def tokens(self, tokenizer, input_str):
+        # Limit the number of tokens, since some invalid input gives
+        # an infinite sequence of tokens that the parser would reject
+        rv = []
+        try:
+            for item in tokenizer.tokenize(StringIO(input_str)):
+                rv.append(item)
+                if item[0] == token_types.eof or len(rv) > 200:
+                    break
+        except parser.ParseError as e:
+            rv.append((e.detail, e.line))
+        return rv
+
+    def test_fuzz(self):
+        rand = random.Random(0)
+        for _ in range(5000):
+            input_str = self.input_str(rand)
+            self.assertEquals(self.tokens(parser.FastTokenizer(), input_str),
+                              self.tokens(parser.Tokenizer(), input_str),
+                              input_str)
+
 if __name__ == "__main__":
     unittest.main()
@@ -7,7 +7,9 @@ import sys
 from wptserve import sslutils
 
 import environment as env
+import manifestexpected
 import products
+import testdurations
 import testloader
 import wptcommandline
 import wptlogging
@@ -67,6 +69,19 @@ def get_loader(test_paths, product, debug=None, run_info_extras=None, **kwargs):
     if kwargs["tags"]:
         meta_filters.append(testloader.TagFilter(tags=kwargs["tags"]))
 
+    metadata_cache = None
+    if kwargs.get("metadata_cache"):
+        metadata_cache = manifestexpected.MetadataCache(kwargs["metadata_cache"])
+
+    durations = None
+    if kwargs.get("duration_db") or kwargs.get("duration_log"):
+        durations = testdurations.DurationStore(kwargs.get("duration_db"))
+        if kwargs.get("duration_log"):
+            for path in kwargs["duration_log"]:
+                with open(path) as f:
+                    durations.update_from_log(f)
+            durations.dump()
+
     ssl_enabled = sslutils.get_cls(kwargs["ssl_type"]).ssl_enabled
     test_loader = testloader.TestLoader(test_manifests,
                                         kwargs["test_types"],
@@ -77,7 +92,9 @@ def get_loader(test_paths, product, debug=None, run_info_extras=None, **kwargs):
                                         total_chunks=kwargs["total_chunks"],
                                         chunk_number=kwargs["this_chunk"],
                                         include_https=ssl_enabled,
-                                        skip_timeout=kwargs["skip_timeout"])
+                                        skip_timeout=kwargs["skip_timeout"],
+                                        metadata_cache=metadata_cache,
+                                        durations=durations)
     return run_info, test_loader
 
 
@@ -165,6 +182,8 @@ def run_tests(config, test_paths, product, **kwargs):
             # A value of None indicates infinite depth
             test_source_cls = testloader.PathGroupedSource
             test_source_kwargs["depth"] = kwargs["run_by_dir"]
+        if test_loader.durations is not None:
+            test_source_kwargs["durations"] = test_loader.durations
 
         logger.info("Using %i client processes" % kwargs["processes"])
 
@@ -226,12 +245,6 @@ def run_tests(config, test_paths, product, **kwargs):
                                                         **kwargs)
 
                     executor_cls = executor_classes.get(test_type)
-                    executor_kwargs = get_executor_kwargs(test_type,
-                                                          test_environment.config,
-                                                          test_environment.cache_manager,
-                                                          run_info,
-                                                          **kwargs)
-
                     if executor_cls is None:
                         logger.error("Unsupported test type %s for product %s" %
                                      (test_type, product))
@@ -255,28 +268,40 @@ def run_tests(config, test_paths, product, **kwargs):
                     else:
                         run_tests = test_loader.tests
 
-                    with ManagerGroup("web-platform-tests",
-                                      kwargs["processes"],
-                                      test_source_cls,
-                                      test_source_kwargs,
-                                      browser_cls,
-                                      browser_kwargs,
-                                      executor_cls,
-                                      executor_kwargs,
-                                      kwargs["rerun"],
-                                      kwargs["pause_after_test"],
-                                      kwargs["pause_on_unexpected"],
-                                      kwargs["restart_on_unexpected"],
-                                      kwargs["debug_info"],
-                                      not kwargs["no_capture_stdio"]) as manager_group:
-                        try:
-                            manager_group.run(test_type, run_tests)
-                        except KeyboardInterrupt:
-                            logger.critical("Main thread got signal")
-                            manager_group.stop()
-                            raise
-                        test_count += manager_group.test_count()
-                        unexpected_count += manager_group.unexpected_count()
+                    executor_kwargs = get_executor_kwargs(test_type,
+                                                          test_environment.config,
+                                                          test_environment.cache_manager,
+                                                          run_info,
+                                                          **kwargs)
+                    screenshot_cache = executor_kwargs.get("screenshot_cache")
+
+                    try:
+                        with ManagerGroup("web-platform-tests",
+                                          kwargs["processes"],
+                                          test_source_cls,
+                                          test_source_kwargs,
+                                          browser_cls,
+                                          browser_kwargs,
+                                          executor_cls,
+                                          executor_kwargs,
+                                          kwargs["rerun"],
+                                          kwargs["pause_after_test"],
+                                          kwargs["pause_on_unexpected"],
+                                          kwargs["restart_on_unexpected"],
+                                          kwargs["debug_info"],
+                                          not kwargs["no_capture_stdio"]) as manager_group:
+                            try:
+                                manager_group.run(test_type, run_tests)
+                            except KeyboardInterrupt:
+                                logger.critical("Main thread got signal")
+                                manager_group.stop()
+                                raise
+                            test_count += manager_group.test_count()
+                            unexpected_count += manager_group.unexpected_count()
+                    finally:
+                        if screenshot_cache is not None:
+                            screenshot_cache.log_counts(logger)
+                            screenshot_cache.cleanup()
 
                 test_total += test_count
                 unexpected_total += unexpected_count
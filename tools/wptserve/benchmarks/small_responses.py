@@ -0,0 +1,82 @@
+"""Benchmark wptserve throughput for small responses.
+
+Starts a server with a handler that returns a short body with a handful
+of headers and times sequential requests over a single keep-alive
+connection, so the per-response write overhead dominates.
+
+Run as::
+
+  python tools/wptserve/benchmarks/small_responses.py --requests 5000
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+from six.moves import http_client
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, os.path.abspath(os.path.join(here, os.pardir, os.pardir)))
+
+import localpaths  # noqa: F401
+from wptserve import handlers, server
+
+
+@handlers.handler
+def small_response(request, response):
+    return [("Content-Type", "text/plain"),
+            ("Cache-Control", "no-cache"),
+            ("X-Benchmark", "1")], b"PASS"
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="Number of requests to make")
+    parser.add_argument("--ssl", action="store_true",
+                        help="Benchmark over HTTPS")
+    return parser
+
+
+def run(requests, ssl=False):
+    kwargs = {}
+    if ssl:
+        certs = os.path.join(localpaths.repo_root, "tools", "certs")
+        kwargs = {"use_ssl": True,
+                  "key_file": os.path.join(certs, "web-platform.test.key"),
+                  "certificate": os.path.join(certs, "web-platform.test.pem")}
+    httpd = server.WebTestHttpd(host="127.0.0.1", port=0,
+                                routes=[("GET", "/small", small_response)],
+                                **kwargs)
+    httpd.start(False)
+    try:
+        if ssl:
+            import ssl as ssl_module
+            context = ssl_module._create_unverified_context()
+            conn = http_client.HTTPSConnection(httpd.host, httpd.port, context=context)
+        else:
+            conn = http_client.HTTPConnection(httpd.host, httpd.port)
+        start = time.time()
+        for _ in range(requests):
+            conn.request("GET", "/small")
+            resp = conn.getresponse()
+            assert resp.read() == b"PASS"
+        elapsed = time.time() - start
+        conn.close()
+    finally:
+        httpd.stop()
+
+    print("%i requests in %.2fs: %.0f requests/s, %.3fms/request" %
+          (requests, elapsed, requests / elapsed, 1000 * elapsed / requests))
+
+
+def main():
+    kwargs = vars(get_parser().parse_args())
+    run(**kwargs)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
+import gzip
 import json
 import os
 import sys
 import unittest
 import uuid
+from io import BytesIO
 
+import mock
 import pytest
 from six.moves.urllib.error import HTTPError
 
@@ -106,6 +109,49 @@ class TestFileHandler(TestUsingServer):
         assert resp.read().rstrip() == expected
 
 
+class TestFileHandlerContentEncoding(TestUsingServer):
+    def setUp(self):
+        with wptserve.config.ConfigBuilder(content_encoding={"enabled": True,
+                                                             "min_size": 0}) as config:
+            self.server = wptserve.server.WebTestHttpd(host="localhost",
+                                                       port=0,
+                                                       doc_root=doc_root,
+                                                       config=config)
+        self.server.start(False)
+
+    def test_gzip(self):
+        resp = self.request("/document.txt", headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(200, resp.getcode())
+        self.assertEqual("gzip", resp.info()["Content-Encoding"])
+        self.assertEqual("Accept-Encoding", resp.info()["Vary"])
+        data = resp.read()
+        self.assertEqual(str(len(data)), resp.info()["Content-Length"])
+        expected = open(os.path.join(doc_root, "document.txt"), 'rb').read()
+        self.assertEqual(expected, gzip.GzipFile(fileobj=BytesIO(data)).read())
+
+    def test_not_accepted(self):
+        resp = self.request("/document.txt", headers={"Accept-Encoding": "gzip;q=0"})
+        self.assertEqual(200, resp.getcode())
+        self.assertNotIn("Content-Encoding", resp.info())
+        self.assertEqual("Accept-Encoding", resp.info()["Vary"])
+        expected = open(os.path.join(doc_root, "document.txt"), 'rb').read()
+        self.assertEqual(expected, resp.read())
+
+    def test_range_not_encoded(self):
+        resp = self.request("/document.txt", headers={"Accept-Encoding": "gzip",
+                                                      "Range": "bytes=10-19"})
+        self.assertEqual(206, resp.getcode())
+        self.assertNotIn("Content-Encoding", resp.info())
+
+    def test_pipe_not_encoded(self):
+        resp = self.request("/document.txt", query="pipe=slice(1,3)",
+                            headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(200, resp.getcode())
+        self.assertNotIn("Content-Encoding", resp.info())
+        expected = open(os.path.join(doc_root, "document.txt"), 'rb').read()
+        self.assertEqual(expected[1:3], resp.read())
+
+
 class TestFunctionHandler(TestUsingServer):
     def test_string_rv(self):
         @wptserve.handlers.handler
@@ -443,5 +489,38 @@ class TestAnyWorkerHandler(TestWrapperHandlerUsingServer):
                               serve.AnyWorkerHandler)
 
 
+class TestWrapperHandlerCache(TestWrapperHandlerUsingServer):
+    dummy_js_files = {'cached.any.js': b'// META: title=first\n'}
+
+    def test_cached_until_modified(self):
+        route = ('GET', '/cached.any.html', serve.AnyHtmlHandler())
+        self.server.router.register(*route)
+
+        resp = self.request(route[1])
+        self.assertIn(b"<title>first</title>", resp.read())
+
+        with mock.patch.object(serve, "read_script_metadata") as read_metadata:
+            resp = self.request(route[1])
+            self.assertIn(b"<title>first</title>", resp.read())
+            resp = self.request(route[1], query="variant")
+            self.assertIn(b"<title>first</title>", resp.read())
+            self.assertEqual(read_metadata.call_count, 0)
+
+        self.gen_js_file(os.path.join(doc_root, 'cached.any.js'), False,
+                         b'// META: title=second one\n')
+        resp = self.request(route[1])
+        self.assertIn(b"<title>second one</title>", resp.read())
+
+    def test_not_exposed(self):
+        self.gen_js_file(os.path.join(doc_root, 'cached.any.js'), False,
+                         b'// META: global=!window\n')
+        route = ('GET', '/cached.any.html', serve.AnyHtmlHandler())
+        self.server.router.register(*route)
+        for _ in range(2):
+            with self.assertRaises(HTTPError) as cm:
+                self.request(route[1])
+            self.assertEqual(cm.exception.code, 404)
+
+
 if __name__ == '__main__':
     unittest.main()
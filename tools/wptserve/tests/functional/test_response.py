@@ -18,7 +18,73 @@ def send_body_as_header(self):
     self.write("X-Body: ")
     self._headers_complete = True
 
+class RecordingFile(object):
+    def __init__(self, wfile, writes):
+        self._wfile = wfile
+        self.writes = writes
+
+    def write(self, data):
+        self.writes.append(data)
+        return self._wfile.write(data)
+
+    def flush(self):
+        return self._wfile.flush()
+
 class TestResponse(TestUsingServer):
+    def test_headers_written_with_body(self):
+        writes = []
+
+        @wptserve.handlers.handler
+        def handler(request, response):
+            response.writer._wfile = RecordingFile(response.writer._wfile, writes)
+            return [("X-Test", "TEST")], "body"
+
+        route = ("GET", "/test/test_headers_written_with_body", handler)
+        self.server.router.register(*route)
+        resp = self.request(route[1])
+        assert resp.read() == b"body"
+        assert resp.info()["X-Test"] == "TEST"
+        assert len(writes) == 1
+        assert writes[0].startswith(b"HTTP/1.1 200 OK\r\n")
+        assert writes[0].endswith(b"\r\n\r\nbody")
+
+    def test_headers_flushed_before_streamed_body(self):
+        writes = []
+
+        @wptserve.handlers.handler
+        def handler(request, response):
+            response.writer._wfile = RecordingFile(response.writer._wfile, writes)
+            return [("X-Test", "TEST")], [b"first", b"second"]
+
+        route = ("GET", "/test/test_headers_flushed_before_streamed_body", handler)
+        self.server.router.register(*route)
+        resp = self.request(route[1])
+        assert resp.read() == b"firstsecond"
+        assert len(writes) == 3
+        assert writes[0].endswith(b"\r\n\r\n")
+        assert writes[1:] == [b"first", b"second"]
+
+    def test_explicit_flush_headers(self):
+        writes = []
+
+        @wptserve.handlers.handler
+        def handler(request, response):
+            response.writer._wfile = RecordingFile(response.writer._wfile, writes)
+            response.explicit_flush = True
+            response.writer.write_status(200)
+            response.writer.write_header("Content-Length", 4)
+            response.writer.end_headers()
+            assert writes == []
+            response.writer.flush()
+            assert len(writes) == 1
+            response.writer.write_content(b"TEST")
+
+        route = ("GET", "/test/test_explicit_flush_headers", handler)
+        self.server.router.register(*route)
+        resp = self.request(route[1])
+        assert resp.read() == b"TEST"
+        assert len(writes) == 2
+
     def test_head_without_body(self):
         @wptserve.handlers.handler
         def handler(request, response):
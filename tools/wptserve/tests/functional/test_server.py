@@ -1,10 +1,19 @@
+import os
+import socket
+import time
 import unittest
 
+import mock
 import pytest
 from six.moves.urllib.error import HTTPError
 
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.errors import ErrorCodes
+from h2.events import StreamReset
+
 wptserve = pytest.importorskip("wptserve")
-from .base import TestUsingServer, TestUsingH2Server
+from .base import TestUsingServer, TestUsingH2Server, doc_root
 
 
 class TestFileHandler(TestUsingServer):
@@ -40,6 +49,105 @@ class TestRequestHandler(TestUsingServer):
 
         self.assertEqual(cm.exception.code, 500)
 
+class TestAdmissionControl(unittest.TestCase):
+    def setUp(self):
+        with wptserve.config.ConfigBuilder(server={"max_connections_per_client": 1,
+                                                   "keep_alive_timeout": 1}) as config:
+            self.server = wptserve.server.WebTestHttpd(host="localhost",
+                                                       port=0,
+                                                       doc_root=doc_root,
+                                                       config=config)
+        self.server.start(False)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def connect(self):
+        return socket.create_connection((self.server.host, self.server.port), 5)
+
+    def read_all(self, sock):
+        data = b""
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return data
+            data += chunk
+
+    def wait_for_clients(self, count):
+        for _ in range(250):
+            if sum(self.server.httpd.stats()["clients"].values()) == count:
+                break
+            time.sleep(0.02)
+        assert sum(self.server.httpd.stats()["clients"].values()) == count
+
+    def test_per_client_limit(self):
+        first = self.connect()
+        try:
+            self.wait_for_clients(1)
+            second = self.connect()
+            try:
+                assert self.read_all(second).startswith(b"HTTP/1.1 503")
+            finally:
+                second.close()
+        finally:
+            first.close()
+
+    def test_keep_alive_timeout(self):
+        sock = self.connect()
+        try:
+            # The server closes the idle connection without a response
+            assert self.read_all(sock) == b""
+        finally:
+            sock.close()
+        # The connection is released just after the socket is closed
+        self.wait_for_clients(0)
+
+
+class MockH2Handler(wptserve.server.Http2WebTestRequestHandler):
+    def __init__(self, server, request):
+        # Skip the socket setup of the base class
+        self.logger = wptserve.logger.get_logger()
+        self.server = server
+        self.request = request
+
+
+def test_refused_stream_frames_dropped():
+    client = H2Connection(H2Configuration(client_side=True))
+    client.initiate_connection()
+    client.send_headers(1, [(":method", "POST"), (":path", "/"),
+                            (":scheme", "https"), (":authority", "localhost")])
+    client.send_data(1, b"data", end_stream=True)
+
+    handler = MockH2Handler(mock.Mock(), mock.Mock())
+    handler.server.stream_pool.submit.return_value = None
+    # The headers, data and end of the stream all arrive in one batch
+    handler.request.recv.side_effect = [client.data_to_send(), socket.error()]
+    handler.handle_one_request()
+
+    # Only the first frame is offered to the stream pool, and the stream is
+    # refused once
+    assert handler.server.stream_pool.submit.call_count == 1
+    sent = b"".join(call[0][0] for call in handler.request.sendall.call_args_list)
+    resets = [event for event in client.receive_data(sent)
+              if isinstance(event, StreamReset)]
+    assert [(event.stream_id, event.error_code) for event in resets] == [
+        (1, ErrorCodes.REFUSED_STREAM)]
+
+
+def test_stop_removes_gzip_cache_dir(tmpdir, monkeypatch):
+    cache = wptserve.content_encoding.GzipCache(max_memory_entry=10)
+    monkeypatch.setattr(wptserve.content_encoding, "gzip_cache", cache)
+    path = tmpdir.join("test.js")
+    path.write(b"a" * 1000, mode="wb")
+    cache.get(str(path))[0].close()
+    cache_dir = cache.cache_dir
+
+    server = wptserve.server.WebTestHttpd(host="localhost", port=0, doc_root=doc_root)
+    server.start(False)
+    server.stop()
+    assert not os.path.exists(cache_dir)
+
+
 class TestFileHandlerH2(TestUsingH2Server):
     def test_not_handled(self):
         self.conn.request("GET", "/not_existing")
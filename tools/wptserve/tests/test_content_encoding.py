@@ -0,0 +1,155 @@
+import gzip
+import os
+import time
+from io import BytesIO
+
+import pytest
+
+content_encoding = pytest.importorskip("wptserve.content_encoding")
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    (b"", False),
+    (b"gzip", True),
+    (b"deflate, gzip;q=1.0, *;q=0.5", True),
+    (b"gzip;q=0", False),
+    (b"x-gzip", True),
+    (b"identity", False),
+    (b"*", True),
+    (b"*;q=0", False),
+    (b"br, *", True),
+    (b"*, gzip;q=0", False),
+])
+def test_accepts_gzip(header, expected):
+    assert content_encoding.accepts_gzip(header) is expected
+
+
+@pytest.mark.parametrize("content_type, expected", [
+    ("text/html", True),
+    ("text/javascript;charset=utf8", True),
+    ("application/json", True),
+    ("image/png", False),
+    ("video/mp4", False),
+    (None, False),
+])
+def test_is_compressible(content_type, expected):
+    assert content_encoding.is_compressible(content_type) is expected
+
+
+def read_entry(entry):
+    data, length = entry
+    if hasattr(data, "read"):
+        with data:
+            data = data.read()
+    assert len(data) == length
+    return gzip.GzipFile(fileobj=BytesIO(data)).read()
+
+
+def write_file(path, data, mtime=None):
+    with open(path, "wb") as f:
+        f.write(data)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_memory_cache(tmpdir):
+    path = str(tmpdir.join("test.js"))
+    write_file(path, b"a" * 100)
+    cache = content_encoding.GzipCache()
+    entry = cache.get(path)
+    assert isinstance(entry[0], bytes)
+    assert read_entry(entry) == b"a" * 100
+    assert cache.get(path)[0] is entry[0]
+    assert cache.cache_dir is None
+
+
+def test_memory_cache_invalidated(tmpdir):
+    path = str(tmpdir.join("test.js"))
+    now = time.time()
+    write_file(path, b"a" * 100, now - 10)
+    cache = content_encoding.GzipCache()
+    assert read_entry(cache.get(path)) == b"a" * 100
+    write_file(path, b"b" * 100, now)
+    assert read_entry(cache.get(path)) == b"b" * 100
+
+
+def test_memory_cache_eviction(tmpdir):
+    cache = content_encoding.GzipCache(memory_size=60)
+    paths = []
+    for i in range(3):
+        path = str(tmpdir.join("test%i.js" % i))
+        write_file(path, os.urandom(20))
+        paths.append(path)
+        cache.get(path)
+    assert cache._memory_used <= 60
+    assert len(cache._memory) < 3
+
+
+def test_disk_cache(tmpdir):
+    path = str(tmpdir.join("test.js"))
+    write_file(path, b"a" * 1000)
+    cache_dir = tmpdir.mkdir("cache")
+    cache = content_encoding.GzipCache(max_memory_entry=10, cache_dir=str(cache_dir))
+    assert read_entry(cache.get(path)) == b"a" * 1000
+    assert len(cache_dir.listdir()) == 1
+    assert read_entry(cache.get(path)) == b"a" * 1000
+    assert len(cache_dir.listdir()) == 1
+
+
+def test_disk_cache_invalidated(tmpdir):
+    path = str(tmpdir.join("test.js"))
+    now = time.time()
+    write_file(path, b"a" * 1000, now - 10)
+    cache_dir = tmpdir.mkdir("cache")
+    cache = content_encoding.GzipCache(max_memory_entry=10, cache_dir=str(cache_dir))
+    assert read_entry(cache.get(path)) == b"a" * 1000
+    write_file(path, b"b" * 1000, now)
+    assert read_entry(cache.get(path)) == b"b" * 1000
+    # The entry for the old version is removed
+    assert len(cache_dir.listdir()) == 1
+
+
+def test_disk_cache_cleanup(tmpdir):
+    path = str(tmpdir.join("test.js"))
+    write_file(path, b"a" * 1000)
+    cache = content_encoding.GzipCache(max_memory_entry=10)
+    assert read_entry(cache.get(path)) == b"a" * 1000
+    cache_dir = cache.cache_dir
+    assert os.path.isdir(cache_dir)
+    cache.cleanup()
+    assert not os.path.exists(cache_dir)
+    assert cache.cache_dir is None
+
+    # The cache can be used again after a cleanup
+    assert read_entry(cache.get(path)) == b"a" * 1000
+    cache.cleanup()
+    assert cache.cache_dir is None
+
+
+def test_cleanup_keeps_cache_dir(tmpdir):
+    path = str(tmpdir.join("test.js"))
+    write_file(path, b"a" * 1000)
+    cache_dir = tmpdir.mkdir("cache")
+    cache = content_encoding.GzipCache(max_memory_entry=10, cache_dir=str(cache_dir))
+    cache.get(path)[0].close()
+    cache.cleanup()
+    assert len(cache_dir.listdir()) == 1
+
+
+def test_precompressed(tmpdir):
+    path = str(tmpdir.join("test.js"))
+    now = time.time()
+    write_file(path, b"source", now - 10)
+    write_file(path + ".gz", content_encoding.compress(b"precompressed"), now)
+    cache = content_encoding.GzipCache()
+    assert read_entry(cache.get(path)) == b"precompressed"
+
+
+def test_precompressed_stale(tmpdir):
+    path = str(tmpdir.join("test.js"))
+    now = time.time()
+    write_file(path + ".gz", content_encoding.compress(b"precompressed"), now - 10)
+    write_file(path, b"source", now)
+    cache = content_encoding.GzipCache()
+    assert read_entry(cache.get(path)) == b"source"
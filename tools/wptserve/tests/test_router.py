@@ -0,0 +1,91 @@
+from collections import namedtuple
+
+import pytest
+
+router = pytest.importorskip("wptserve.router")
+
+UrlParts = namedtuple("UrlParts", ["path"])
+
+
+class Request(object):
+    def __init__(self, method, path):
+        self.method = method
+        self.url_parts = UrlParts(path)
+        self.route_match = None
+
+
+def handler(name):
+    def inner(request, response):
+        pass
+    inner.__name__ = name
+    return inner
+
+
+@pytest.mark.parametrize("pattern, expected", [
+    ("/", ("/", None, True)),
+    ("foo/bar.html", ("/foo/bar.html", None, True)),
+    ("*", ("/", "", False)),
+    ("*.any.html", ("/", ".any.html", False)),
+    ("/spec/*.py", ("/spec/", ".py", False)),
+    ("{spec}/tools/*", ("/", None, False)),
+    ("/api/{resource}/*.json", ("/api/", None, False)),
+])
+def test_path_match_literals(pattern, expected):
+    assert router.path_match_literals(pattern) == expected
+
+
+def test_last_registered_wins():
+    r = router.Router("/", [])
+    r.register("GET", "*", handler("first"))
+    r.register("GET", "/foo/*", handler("second"))
+    r.register("GET", "*.html", handler("third"))
+
+    assert r.get_handler(Request("GET", "/foo/bar.html")).__name__ == "third"
+    assert r.get_handler(Request("GET", "/foo/bar.js")).__name__ == "second"
+    assert r.get_handler(Request("GET", "/bar.js")).__name__ == "first"
+
+
+def test_initial_routes_precedence():
+    r = router.Router("/", [("GET", "/foo/*", handler("first")),
+                            ("GET", "*", handler("second"))])
+    # Earlier entries in the initial routes take priority
+    assert r.get_handler(Request("GET", "/foo/bar")).__name__ == "first"
+    assert r.get_handler(Request("GET", "/bar")).__name__ == "second"
+
+
+def test_methods():
+    r = router.Router("/", [])
+    r.register(router.any_method, "*.py", handler("any"))
+    r.register("GET", "/get.py", handler("get"))
+    r.register(["POST", "PUT"], "/post.py", handler("post"))
+
+    assert r.get_handler(Request("GET", "/get.py")).__name__ == "get"
+    assert r.get_handler(Request("HEAD", "/get.py")).__name__ == "get"
+    assert r.get_handler(Request("POST", "/get.py")).__name__ == "any"
+    assert r.get_handler(Request("PUT", "/post.py")).__name__ == "post"
+    assert r.get_handler(Request("DELETE", "/post.py")).__name__ == "any"
+    assert r.get_handler(Request("GET", "/post.txt")) is None
+
+
+def test_route_match():
+    r = router.Router("/", [])
+    r.register("GET", "/api/{resource}/*.json", handler("api"))
+
+    request = Request("GET", "/api/test/test2/data.json")
+    assert r.get_handler(request).__name__ == "api"
+    assert request.route_match == {"resource": "test", "*": "test2/data.json"}
+
+    # Cached lookups still fill in the match for each request
+    request = Request("GET", "/api/test/test2/data.json")
+    assert r.get_handler(request).__name__ == "api"
+    assert request.route_match == {"resource": "test", "*": "test2/data.json"}
+
+    assert r.get_handler(Request("GET", "/api/test/data.py")) is None
+
+
+def test_register_invalidates_cache():
+    r = router.Router("/", [])
+    r.register("GET", "*", handler("first"))
+    assert r.get_handler(Request("GET", "/foo")).__name__ == "first"
+    r.register("GET", "/foo", handler("second"))
+    assert r.get_handler(Request("GET", "/foo")).__name__ == "second"
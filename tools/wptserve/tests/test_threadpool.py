@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+ThreadPool = pytest.importorskip("wptserve.threadpool").ThreadPool
+
+
+def test_runs_tasks():
+    pool = ThreadPool(2)
+    results = []
+    tasks = [pool.submit(results.append, i) for i in range(10)]
+    for task in tasks:
+        task.join(5)
+        assert not task.is_alive()
+    pool.shutdown(wait=True)
+    assert sorted(results) == list(range(10))
+    assert pool.stats()["completed"] == 10
+
+
+def test_workers_bounded():
+    pool = ThreadPool(2)
+    release = threading.Event()
+    tasks = [pool.submit(release.wait) for _ in range(5)]
+    stats = pool.stats()
+    assert stats["workers"] == 2
+    # At most two of the tasks can have been picked up by a worker
+    assert stats["max_queued"] >= 3
+    release.set()
+    for task in tasks:
+        task.join(5)
+    pool.shutdown(wait=True)
+    assert pool.stats()["workers"] == 2
+
+
+def test_queue_limit():
+    pool = ThreadPool(1, max_queued=1)
+    release = threading.Event()
+    running = pool.submit(release.wait)
+    queued = pool.submit(release.wait)
+    assert running is not None
+    assert queued is not None
+    assert pool.submit(release.wait) is None
+    assert pool.stats()["rejected"] == 1
+    release.set()
+    running.join(5)
+    queued.join(5)
+    pool.shutdown(wait=True)
+
+
+def test_task_exception():
+    pool = ThreadPool(1)
+
+    def fail():
+        raise ValueError
+
+    task = pool.submit(fail)
+    task.join(5)
+    assert not task.is_alive()
+    # The worker survives to run further tasks
+    results = []
+    pool.submit(results.append, 1).join(5)
+    assert results == [1]
+    pool.shutdown(wait=True)
+
+
+def test_submit_after_shutdown():
+    pool = ThreadPool(1)
+    pool.shutdown()
+    assert pool.submit(lambda: None) is None
@@ -134,7 +134,18 @@ class ConfigBuilder(object):
                 "host_cert_path": None,
             },
         },
-        "aliases": []
+        "aliases": [],
+        "server": {
+            "max_workers": 200,
+            "max_queued_connections": 1000,
+            "max_connections_per_client": None,
+            "keep_alive_timeout": 5,
+            "max_h2_stream_workers": 200,
+        },
+        "content_encoding": {
+            "enabled": False,
+            "min_size": 1024,
+        },
     }
     default_config_cls = Config
 
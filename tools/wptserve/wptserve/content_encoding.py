@@ -0,0 +1,209 @@
+"""Support for serving static files with Content-Encoding: gzip.
+
+Compressed representations are either read from a precompressed
+``<file>.gz`` sibling that is at least as new as the file itself, or
+generated once and cached keyed on the path, mtime and size of the
+file. Small results are kept in memory; larger ones are written to a
+cache directory on disk and streamed from there.
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from six import binary_type
+
+compressible_types = {"application/json",
+                      "application/javascript",
+                      "application/wasm",
+                      "application/xhtml+xml",
+                      "application/xml",
+                      "image/svg+xml",
+                      "text/cache-manifest",
+                      "text/css",
+                      "text/html",
+                      "text/javascript",
+                      "text/plain",
+                      "text/vtt"}
+
+
+def accepts_gzip(header):
+    """Check if an Accept-Encoding header value allows a gzip response.
+
+    :param header: Value of the Accept-Encoding header, or None
+    """
+    if not header:
+        return False
+    if isinstance(header, binary_type):
+        header = header.decode("ascii", "replace")
+    wildcard = False
+    for item in header.split(","):
+        parts = [part.strip() for part in item.split(";")]
+        coding = parts[0].lower()
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if coding in ("gzip", "x-gzip"):
+            return quality > 0
+        if coding == "*":
+            wildcard = quality > 0
+    return wildcard
+
+
+def is_compressible(content_type):
+    """Check if content of a given Content-Type benefits from compression."""
+    if not content_type:
+        return False
+    if isinstance(content_type, binary_type):
+        content_type = content_type.decode("ascii", "replace")
+    return content_type.split(";", 1)[0].strip().lower() in compressible_types
+
+
+class GzipCache(object):
+    """Cache of gzip-compressed representations of files.
+
+    :param memory_size: Maximum total size in bytes of compressed data
+                        kept in memory.
+    :param max_memory_entry: Compressed data larger than this is kept on
+                             disk rather than in memory.
+    :param cache_dir: Directory for on-disk cache entries, or None to use
+                      a temporary directory created on first use and
+                      removed by cleanup().
+    """
+
+    def __init__(self, memory_size=32 * 1024 * 1024, max_memory_entry=1024 * 1024,
+                 cache_dir=None):
+        self.memory_size = memory_size
+        self.max_memory_entry = max_memory_entry
+        self.cache_dir = cache_dir
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        # Dict of { path: on-disk entry for the latest version of the file }
+        self._disk_entries = {}
+        self._temp_dir = None
+
+    def get(self, path):
+        """Get a gzip-encoded representation of a file.
+
+        :param path: Path to the file
+        :returns: Tuple of (data, length) where data is either a bytes
+                  object or an open binary file object positioned at
+                  the start of the compressed data.
+        """
+        st = os.stat(path)
+        precompressed = self._precompressed(path, st)
+        if precompressed is not None:
+            return precompressed
+
+        key = (path, st.st_mtime, st.st_size)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                # Move to the end so that this entry is evicted last
+                del self._memory[key]
+                self._memory[key] = data
+                return data, len(data)
+
+        if st.st_size <= self.max_memory_entry:
+            with open(path, "rb") as f:
+                data = compress(f.read())
+            if len(data) <= self.max_memory_entry:
+                self._store_memory(key, data)
+                return data, len(data)
+
+        disk_path = self._disk_path(key)
+        if not os.path.exists(disk_path):
+            self._store_disk(path, disk_path)
+        f = open(disk_path, "rb")
+        return f, os.fstat(f.fileno()).st_size
+
+    def _precompressed(self, path, st):
+        gz_path = path + ".gz"
+        try:
+            gz_st = os.stat(gz_path)
+        except OSError:
+            return None
+        if gz_st.st_mtime < st.st_mtime:
+            # Don't serve a stale precompressed file
+            return None
+        return open(gz_path, "rb"), gz_st.st_size
+
+    def _store_memory(self, key, data):
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self._memory_used += len(data)
+            while self._memory_used > self.memory_size and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+
+    def _disk_path(self, key):
+        if self.cache_dir is None:
+            with self._lock:
+                if self.cache_dir is None:
+                    self._temp_dir = tempfile.mkdtemp(prefix="wptserve-gzip-")
+                    self.cache_dir = self._temp_dir
+        name = hashlib.sha1(repr(key).encode("utf8")).hexdigest()
+        return os.path.join(self.cache_dir, name + ".gz")
+
+    def _store_disk(self, path, disk_path):
+        # Compress into a temporary file and rename it into place so
+        # that concurrent requests never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(disk_path))
+        try:
+            with os.fdopen(fd, "wb") as out:
+                with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+                    with open(path, "rb") as f:
+                        shutil.copyfileobj(f, gz)
+            os.rename(tmp_path, disk_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        # Remove the entry for the previous version of the file, which
+        # can't be served again
+        with self._lock:
+            old_path = self._disk_entries.get(path)
+            self._disk_entries[path] = disk_path
+        if old_path is not None and old_path != disk_path:
+            try:
+                os.unlink(old_path)
+            except OSError:
+                pass
+
+    def cleanup(self):
+        """Remove the temporary cache directory, if one was created.
+
+        The cache can still be used afterwards, in which case a new
+        temporary directory is created."""
+        with self._lock:
+            temp_dir = self._temp_dir
+            if temp_dir is not None:
+                self._temp_dir = None
+                self.cache_dir = None
+                self._disk_entries.clear()
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def compress(data):
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode="wb") as f:
+        f.write(data)
+    return out.getvalue()
+
+
+gzip_cache = GzipCache()
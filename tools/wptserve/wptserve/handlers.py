@@ -7,6 +7,7 @@ import traceback
 from six.moves.urllib.parse import parse_qs, quote, unquote, urljoin
 from six import iteritems
 
+from . import content_encoding
 from .constants import content_types
 from .pipes import Pipeline, template
 from .ranges import RangeParser
@@ -151,6 +152,8 @@ class FileHandler(object):
                         raise
             else:
                 byte_ranges = None
+                if self.set_encoded_content(request, response, path, file_size):
+                    return response
             data = self.get_data(response, path, byte_ranges)
             response.content = data
             response = wrap_pipeline(path, request, response)
@@ -159,6 +162,40 @@ class FileHandler(object):
         except (OSError, IOError):
             raise HTTPException(404)
 
+    def set_encoded_content(self, request, response, path, file_size):
+        """Set the response content to a gzip-encoded representation of the
+        file if the server config has content encoding enabled and the
+        request accepts it.
+
+        Responses that would be modified by a pipeline, or that have a
+        Content-Encoding set in a .headers file, are never encoded.
+
+        :returns: Boolean indicating whether encoded content was set."""
+        config = request.server.config
+        if config is None or "content_encoding" not in config:
+            return False
+        options = config["content_encoding"]
+        if not options.get("enabled"):
+            return False
+
+        content_type = response.headers.get("Content-Type")
+        if not content_type or not content_encoding.is_compressible(content_type[-1]):
+            return False
+        if file_size < options.get("min_size", 0) or "Content-Encoding" in response.headers:
+            return False
+        if "pipe" in parse_qs(request.url_parts.query) or ".sub." in path:
+            return False
+
+        response.headers.append("Vary", "Accept-Encoding")
+        if not content_encoding.accepts_gzip(request.headers.get("Accept-Encoding")):
+            return False
+
+        data, length = content_encoding.gzip_cache.get(path)
+        response.headers.set("Content-Encoding", "gzip")
+        response.headers.set("Content-Length", length)
+        response.content = data
+        return True
+
     def get_headers(self, request, path):
         rv = (self.load_headers(request, os.path.join(os.path.split(path)[0], "__dir__")) +
               self.load_headers(request, path))
@@ -1,16 +1,16 @@
 from cgi import escape
 from collections import deque
 import base64
-import gzip as gzip_module
 import hashlib
 import os
 import re
 import time
 import uuid
-from six.moves import StringIO
 
 from six import text_type, binary_type
 
+from .content_encoding import compress
+
 def resolve_content(response):
     return b"".join(item for item in response.iter_content(read_file=True))
 
@@ -516,10 +516,7 @@ def gzip(request, response):
     content = resolve_content(response)
     response.headers.set("Content-Encoding", "gzip")
 
-    out = StringIO()
-    with gzip_module.GzipFile(fileobj=out, mode="w") as f:
-        f.write(content)
-    response.content = out.getvalue()
+    response.content = compress(content)
 
     response.headers.set("Content-Length", len(response.content))
 
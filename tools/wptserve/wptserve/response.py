@@ -609,8 +609,13 @@ class ResponseWriter(object):
     :param response: The Response associated with this writer.
 
     After each part of the response is written, the output is
-    flushed unless response.explicit_flush is False, in which case
-    the user must call .flush() explicitly."""
+    flushed unless response.explicit_flush is True, in which case
+    the user must call .flush() explicitly.
+
+    The status line and headers are buffered and sent in a single write
+    when the headers are flushed. If the body is already available when
+    the headers end, they are instead sent in the same write as the first
+    chunk of the body."""
     def __init__(self, handler, response):
         self._wfile = handler.wfile
         self._response = response
@@ -618,6 +623,7 @@ class ResponseWriter(object):
         self._status_written = False
         self._headers_seen = set()
         self._headers_complete = False
+        self._headers_buffer = []
         self.content_written = False
         self.request = response.request
         self.file_chunk_size = 32 * 1024
@@ -634,8 +640,8 @@ class ResponseWriter(object):
                 message = response_codes[code][0]
             else:
                 message = ''
-        self.write("%s %d %s\r\n" %
-                   (self._response.request.protocol_version, code, message))
+        self._write_headers_buffer("%s %d %s\r\n" %
+                                   (self._response.request.protocol_version, code, message))
         self._status_written = True
 
     def write_header(self, name, value):
@@ -649,9 +655,7 @@ class ResponseWriter(object):
         if not self._status_written:
             self.write_status(self.default_status)
         self._headers_seen.add(name.lower())
-        self.write("%s: %s\r\n" % (name, value))
-        if not self._response.explicit_flush:
-            self.flush()
+        self._write_headers_buffer("%s: %s\r\n" % (name, value))
 
     def write_default_headers(self):
         for name, f in [("Server", self._handler.version_string),
@@ -674,13 +678,30 @@ class ResponseWriter(object):
         if self._response.add_required_headers:
             self.write_default_headers()
 
-        self.write("\r\n")
+        self._write_headers_buffer("\r\n")
         if "content-length" not in self._headers_seen:
             self._response.close_connection = True
-        if not self._response.explicit_flush:
+        if not self._response.explicit_flush and not self._body_ready():
             self.flush()
         self._headers_complete = True
 
+    def _body_ready(self):
+        """Check if the response body is available to be written straight
+        after the headers, so that they can be sent together."""
+        if self.request.method == "HEAD" and not self._response.send_body_for_head_request:
+            return False
+        content = self._response.content
+        return isinstance(content, (binary_type, text_type)) or hasattr(content, "read")
+
+    def _write_headers_buffer(self, data):
+        self.content_written = True
+        self._headers_buffer.append(self.encode(data))
+
+    def _take_headers_buffer(self):
+        data = b"".join(self._headers_buffer)
+        self._headers_buffer = []
+        return data
+
     def write_content(self, data):
         """Write the body of the response.
 
@@ -708,8 +729,11 @@ class ResponseWriter(object):
         """Write directly to the response, converting unicode to bytes
         according to response.encoding. Does not flush."""
         self.content_written = True
+        data = self.encode(data)
+        if self._headers_buffer:
+            data = self._take_headers_buffer() + data
         try:
-            self._wfile.write(self.encode(data))
+            self._wfile.write(data)
         except socket.error:
             # This can happen if the socket got closed by the remote end
             pass
@@ -720,6 +744,8 @@ class ResponseWriter(object):
         self.content_written = True
         while True:
             buf = data.read(self.file_chunk_size)
+            if self._headers_buffer:
+                buf = self._take_headers_buffer() + buf
             if not buf:
                 break
             try:
@@ -741,6 +767,8 @@ class ResponseWriter(object):
         """Flush the output. Returns False if the flush failed due to
         the socket being closed by the remote end."""
         try:
+            if self._headers_buffer:
+                self._wfile.write(self._take_headers_buffer())
             self._wfile.flush()
             return True
         except socket.error:
@@ -84,6 +84,75 @@ def compile_path_match(route_pattern):
 
     return compiler.compile(tokens)
 
+def path_match_literals(route_pattern):
+    """Get the literal parts of a route pattern that every matching path
+    must contain.
+
+    :param route_pattern: Route pattern as for compile_path_match
+    :returns: Tuple of (prefix, suffix, exact) where prefix is the literal
+              text before the first group or star, suffix is the literal
+              text after a star, or None if the pattern has no star or
+              has a group, and exact is True if the pattern is entirely
+              literal and so only matches the prefix itself.
+    """
+    tokens, unmatched = RouteTokenizer().scan(route_pattern)
+
+    assert unmatched == "", unmatched
+
+    if not tokens or tokens[0][0] != "slash":
+        tokens = [("slash", None)] + tokens
+
+    prefix = []
+    rest = None
+    for i, (token_type, value) in enumerate(tokens):
+        if token_type in ("group", "star"):
+            rest = tokens[i:]
+            break
+        prefix.append("/" if token_type == "slash" else value)
+
+    if rest is None:
+        return "".join(prefix), None, True
+
+    suffix = None
+    if rest[0][0] == "star":
+        suffix = "".join("/" if token_type == "slash" else value
+                         for token_type, value in rest[1:])
+    return "".join(prefix), suffix, False
+
+
+class RouteIndex(object):
+    """Index of routes for a single method, keyed by the literal prefix
+    that a path must start with for the route to match.
+
+    Entries are (order, regexp, suffix, exact, handler) tuples where order is
+    the position of the route in registration order."""
+
+    def __init__(self):
+        self.exact = {}
+        self.prefixes = {}
+        self.prefix_lengths = []
+
+    def add(self, prefix, entry):
+        if entry[3]:
+            self.exact.setdefault(prefix, []).append(entry)
+            return
+        if prefix not in self.prefixes:
+            self.prefixes[prefix] = []
+            self.prefix_lengths = sorted(set(self.prefix_lengths) | {len(prefix)})
+        self.prefixes[prefix].append(entry)
+
+    def candidates(self, path):
+        rv = list(self.exact.get(path, ()))
+        path_len = len(path)
+        for length in self.prefix_lengths:
+            if length > path_len:
+                break
+            entries = self.prefixes.get(path[:length])
+            if entries:
+                rv.extend(entries)
+        return rv
+
+
 class Router(object):
     """Object for matching handler functions to requests.
 
@@ -94,10 +163,15 @@ class Router(object):
                    as for register()
     """
 
+    #: Maximum number of recent (method, path) lookups to remember
+    cache_size = 4096
+
     def __init__(self, doc_root, routes):
         self.doc_root = doc_root
         self.routes = []
         self.logger = get_logger()
+        self._index = {}
+        self._cache = {}
         for route in reversed(routes):
             self.register(*route)
 
@@ -137,9 +211,37 @@ class Router(object):
         """
         if isinstance(methods, (binary_type, text_type)) or methods is any_method:
             methods = [methods]
+        prefix, suffix, exact = path_match_literals(path)
         for method in methods:
-            self.routes.append((method, compile_path_match(path), handler))
-            self.logger.debug("Route pattern: %s" % self.routes[-1][1].pattern)
+            regexp = compile_path_match(path)
+            entry = (len(self.routes), regexp, suffix, exact, handler)
+            self.routes.append((method, regexp, handler))
+            self.logger.debug("Route pattern: %s" % regexp.pattern)
+            key = any_method if method == "*" else method
+            if key not in self._index:
+                self._index[key] = RouteIndex()
+            self._index[key].add(prefix, entry)
+        self._cache = {}
+
+    def _find_route(self, method, path):
+        """Find the most recently registered route entry matching a method
+        and path, or None if nothing matches."""
+        keys = [method, any_method]
+        if method == "HEAD":
+            keys.append("GET")
+        candidates = []
+        for key in keys:
+            index = self._index.get(key)
+            if index is not None:
+                candidates.extend(index.candidates(path))
+        candidates.sort(key=lambda entry: entry[0], reverse=True)
+        for entry in candidates:
+            order, regexp, suffix, exact, handler = entry
+            if suffix and not path.endswith(suffix):
+                continue
+            if exact or regexp.match(path):
+                return entry
+        return None
 
     def get_handler(self, request):
         """Get a handler for a request or None if there is no handler.
@@ -147,22 +249,30 @@ class Router(object):
         :param request: Request to get a handler for.
         :rtype: Callable or None
         """
-        for method, regexp, handler in reversed(self.routes):
-            if (request.method == method or
-                method in (any_method, "*") or
-                (request.method == "HEAD" and method == "GET")):
-                m = regexp.match(request.url_parts.path)
-                if m:
-                    if not hasattr(handler, "__class__"):
-                        name = handler.__name__
-                    else:
-                        name = handler.__class__.__name__
-                    self.logger.debug("Found handler %s" % name)
-
-                    match_parts = m.groupdict().copy()
-                    if len(match_parts) < len(m.groups()):
-                        match_parts["*"] = m.groups()[-1]
-                    request.route_match = match_parts
-
-                    return handler
-        return None
+        path = request.url_parts.path
+        key = (request.method, path)
+        try:
+            entry = self._cache[key]
+        except KeyError:
+            entry = self._find_route(request.method, path)
+            if len(self._cache) >= self.cache_size:
+                self._cache = {}
+            self._cache[key] = entry
+
+        if entry is None:
+            return None
+
+        order, regexp, suffix, exact, handler = entry
+        if not hasattr(handler, "__class__"):
+            name = handler.__name__
+        else:
+            name = handler.__class__.__name__
+        self.logger.debug("Found handler %s" % name)
+
+        m = regexp.match(path)
+        match_parts = m.groupdict().copy()
+        if len(match_parts) < len(m.groups()):
+            match_parts["*"] = m.groups()[-1]
+        request.route_match = match_parts
+
+        return handler
@@ -2,7 +2,6 @@ from six.moves import BaseHTTPServer
 import errno
 import os
 import socket
-from six.moves.socketserver import ThreadingMixIn
 import ssl
 import sys
 import threading
@@ -10,22 +9,25 @@ import time
 import traceback
 from six import binary_type, text_type
 import uuid
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 
 from six.moves.queue import Queue
 
 from h2.config import H2Configuration
 from h2.connection import H2Connection
+from h2.errors import ErrorCodes
 from h2.events import RequestReceived, ConnectionTerminated, DataReceived, StreamReset, StreamEnded
 
 from six.moves.urllib.parse import urlsplit, urlunsplit
 
+from . import content_encoding
 from . import routes as default_routes
 from .config import ConfigBuilder
 from .logger import get_logger
 from .request import Server, Request, H2Request
 from .response import Response, H2Response
 from .router import Router
+from .threadpool import ThreadPool
 from .utils import HTTPException
 from .constants import h2_headers
 
@@ -111,14 +113,11 @@ class RequestRewriter(object):
                 request_handler.path = new_url
 
 
-class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+class WebTestServer(BaseHTTPServer.HTTPServer):
     allow_reuse_address = True
     acceptable_errors = (errno.EPIPE, errno.ECONNABORTED)
     request_queue_size = 2000
 
-    # Ensure that we don't hang on shutdown waiting for requests
-    daemon_threads = True
-
     def __init__(self, server_address, request_handler_cls,
                  router, rewriter, bind_address,
                  config=None, use_ssl=False, key_file=None, certificate=None,
@@ -156,6 +155,28 @@ class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
                             server_address parameter, but not to the address.
         :param latency: Delay in ms to wait before serving each response, or
                         callable that returns a delay in ms
+
+        Connections are handled by a fixed-size pool of worker threads
+        configured through the "server" section of the config:
+
+        max_workers: Maximum number of connections handled concurrently.
+
+        max_queued_connections: Maximum number of accepted connections
+                                waiting for a worker before new connections
+                                are refused with a 503.
+
+        max_connections_per_client: Maximum number of concurrent
+                                    connections from a single client
+                                    address, or None for no limit.
+
+        keep_alive_timeout: Seconds an HTTP/1.1 connection may be idle
+                            waiting for the next request before it is
+                            closed, or None to wait indefinitely.
+
+        max_h2_stream_workers: Maximum number of HTTP/2 streams handled
+                               concurrently. Up to the same number again
+                               are queued; further streams are refused
+                               with REFUSED_STREAM.
         """
         self.router = router
         self.rewriter = rewriter
@@ -182,7 +203,23 @@ class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
                 assert config["ssl_config"] is None
                 Server.config = config
 
-
+        options = ConfigBuilder._default["server"].copy()
+        if "server" in Server.config:
+            options.update(Server.config["server"])
+        self.keep_alive_timeout = options["keep_alive_timeout"]
+        self.max_connections_per_client = options["max_connections_per_client"]
+        self.pool = ThreadPool(options["max_workers"],
+                               options["max_queued_connections"],
+                               name="%s-worker" % self.scheme)
+        self.stream_pool = None
+        if http2:
+            # Streams get their own pool since connection workers block
+            # waiting on their streams to finish
+            self.stream_pool = ThreadPool(options["max_h2_stream_workers"],
+                                          options["max_h2_stream_workers"],
+                                          name="%s-stream" % self.scheme)
+        self._client_connections = defaultdict(int)
+        self._client_lock = threading.Lock()
 
         self.key_file = key_file
         self.certificate = certificate
@@ -202,6 +239,75 @@ class WebTestServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
                                               certfile=self.certificate,
                                               server_side=True)
 
+    def process_request(self, request, client_address):
+        """Hand a newly accepted connection to the worker pool, refusing
+        it if the client has too many connections open or the pool queue
+        is full."""
+        client = client_address[0]
+        with self._client_lock:
+            if (self.max_connections_per_client is not None and
+                self._client_connections[client] >= self.max_connections_per_client):
+                admitted = False
+            else:
+                self._client_connections[client] += 1
+                admitted = True
+
+        if admitted:
+            if self.pool.submit(self.process_request_thread, request, client_address) is not None:
+                return
+            self._release_client(client)
+            self.logger.warning("Refusing connection from %s: %i connections queued" %
+                                (client, self.pool.stats()["queued"]))
+        else:
+            self.logger.warning("Refusing connection from %s: too many connections" % client)
+        self.refuse_request(request)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._release_client(client_address[0])
+
+    def _release_client(self, client):
+        with self._client_lock:
+            self._client_connections[client] -= 1
+            if not self._client_connections[client]:
+                del self._client_connections[client]
+
+    def refuse_request(self, request):
+        if self.scheme != "http2":
+            try:
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\n"
+                                b"Connection: close\r\n"
+                                b"Content-Length: 0\r\n\r\n")
+            except (socket.error, IOError):
+                pass
+        self.shutdown_request(request)
+
+    def stats(self):
+        """Get a dictionary of connection metrics for the server.
+
+        This contains the worker pool counters (see ThreadPool.stats), the
+        HTTP/2 stream pool counters under "streams" where applicable, and
+        the number of open connections per client address under
+        "clients"."""
+        rv = self.pool.stats()
+        if self.stream_pool is not None:
+            rv["streams"] = self.stream_pool.stats()
+        with self._client_lock:
+            rv["clients"] = dict(self._client_connections)
+        return rv
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.pool.shutdown()
+        if self.stream_pool is not None:
+            self.stream_pool.shutdown()
+        content_encoding.gzip_cache.cleanup()
+
     def handle_error(self, request, client_address):
         error = sys.exc_info()[1]
 
@@ -281,6 +387,10 @@ class BaseWebTestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         # allows for backwards compatibility by accounting for these handlers that don't close streams
         if isinstance(response, H2Response) and not response.writer.stream_ended:
             response.writer.end_stream()
+        elif not isinstance(response, H2Response):
+            # Send anything still buffered by the writer, e.g. headers
+            # written by a handler that didn't go on to write a body
+            response.writer.flush()
 
         # If we want to remove this in the future, a solution is needed for
         # scripts that produce a non-string iterable of content, since these
@@ -350,6 +460,9 @@ class Http2WebTestRequestHandler(BaseWebTestRequestHandler):
 
         # Dict of { stream_id: (thread, queue) }
         stream_queues = {}
+        # Ids of streams refused for lack of a stream worker, whose
+        # remaining frames are dropped
+        refused_streams = set()
 
         try:
             while not self.close_connection:
@@ -375,9 +488,20 @@ class Http2WebTestRequestHandler(BaseWebTestRequestHandler):
                             queue.put(frame)
 
                     elif hasattr(frame, 'stream_id'):
+                        if frame.stream_id in refused_streams:
+                            if isinstance(frame, (StreamEnded, StreamReset)):
+                                refused_streams.discard(frame.stream_id)
+                            continue
                         if frame.stream_id not in stream_queues:
                             queue = Queue()
-                            stream_queues[frame.stream_id] = (self.start_stream_thread(frame, queue), queue)
+                            thread = self.start_stream_thread(frame, queue)
+                            if thread is None:
+                                self.refuse_stream(frame.stream_id)
+                                if not (isinstance(frame, StreamEnded) or
+                                        getattr(frame, "stream_ended", None)):
+                                    refused_streams.add(frame.stream_id)
+                                continue
+                            stream_queues[frame.stream_id] = (thread, queue)
                         stream_queues[frame.stream_id][1].put(frame)
 
                         if isinstance(frame, StreamEnded) or (hasattr(frame, "stream_ended") and frame.stream_ended):
@@ -393,21 +517,26 @@ class Http2WebTestRequestHandler(BaseWebTestRequestHandler):
             self.logger.error('(%s) Unexpected Error - \n%s' % (self.uid, str(e)))
         finally:
             for stream_id, (thread, queue) in stream_queues.items():
+                # Don't leave stream workers waiting for frames that will
+                # never arrive
+                queue.put(None)
                 thread.join()
 
     def start_stream_thread(self, frame, queue):
         """
-        This starts a new thread to handle frames for a specific stream.
+        This schedules a task on the server's stream pool to handle frames for a specific stream.
         :param frame: The first frame on the stream
-        :param queue: A queue object that the thread will use to check for new frames
-        :return: The thread object that has already been started
+        :param queue: A queue object that the task will use to check for new frames
+        :return: A joinable task object, or None if the stream pool refused the stream
         """
-        t = threading.Thread(
-            target=Http2WebTestRequestHandler._stream_thread,
-            args=(self, frame.stream_id, queue)
-        )
-        t.start()
-        return t
+        return self.server.stream_pool.submit(self._stream_thread, frame.stream_id, queue)
+
+    def refuse_stream(self, stream_id):
+        self.logger.warning('(%s - %s) Refusing stream: too many active streams' % (self.uid, stream_id))
+        with self.conn as connection:
+            connection.reset_stream(stream_id, error_code=ErrorCodes.REFUSED_STREAM)
+            data = connection.data_to_send()
+        self.request.sendall(data)
 
     def _stream_thread(self, stream_id, queue):
         """
@@ -556,11 +685,16 @@ class Http1WebTestRequestHandler(BaseWebTestRequestHandler):
             self.logger.error(err)
 
     def get_request_line(self):
+        # Only wait keep_alive_timeout for the next request so that idle
+        # connections don't hold on to a worker thread
+        self.connection.settimeout(self.server.keep_alive_timeout)
         try:
             self.raw_requestline = self.rfile.readline(65537)
         except socket.error:
             self.close_connection = True
             return False
+        finally:
+            self.connection.settimeout(self.timeout)
         if len(self.raw_requestline) > 65536:
             self.requestline = ''
             self.request_version = ''
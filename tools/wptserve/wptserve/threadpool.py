@@ -0,0 +1,148 @@
+import sys
+import threading
+import traceback
+
+from six.moves.queue import Queue
+
+from .logger import get_logger
+
+
+class Task(object):
+    """A unit of work submitted to a :class:`ThreadPool`.
+
+    Task objects are returned by :meth:`ThreadPool.submit` and can be
+    joined in the same way as a :class:`threading.Thread`."""
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self.func(*self.args, **self.kwargs)
+        finally:
+            self._done.set()
+
+    def is_alive(self):
+        return not self._done.is_set()
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+
+
+class ThreadPool(object):
+    """Fixed-size pool of worker threads consuming a bounded queue.
+
+    Worker threads are started lazily, so an idle pool costs nothing,
+    but there are never more than ``max_workers`` of them. Work that
+    can't be started immediately is queued; once ``max_queued`` items
+    are waiting further submissions are refused so that callers can
+    shed load rather than accumulating unbounded backlog.
+
+    :param max_workers: Maximum number of worker threads.
+    :param max_queued: Maximum number of tasks waiting for a worker, or
+                       0 for an unbounded queue.
+    :param name: Prefix used for naming worker threads.
+    """
+
+    def __init__(self, max_workers, max_queued=0, name="wptserve-worker"):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.name = name
+        self.logger = get_logger()
+
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._idle = 0
+        self._queued = 0
+        self._shutdown = False
+
+        self._max_queued_seen = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule ``func(*args, **kwargs)`` to run on a worker thread.
+
+        :returns: A :class:`Task`, or None if the pool is shut down or
+                  the queue is full and the work was refused.
+        """
+        task = Task(func, args, kwargs)
+        with self._lock:
+            if self._shutdown:
+                self._rejected += 1
+                return None
+            waiting = (self._queued - self._idle -
+                       (self.max_workers - len(self._workers)))
+            if self.max_queued and waiting >= self.max_queued:
+                self._rejected += 1
+                return None
+            self._queue.put(task)
+            self._queued += 1
+            self._max_queued_seen = max(self._max_queued_seen, self._queued)
+            if self._queued > self._idle and len(self._workers) < self.max_workers:
+                self._start_worker()
+        return task
+
+    def _start_worker(self):
+        thread = threading.Thread(target=self._worker,
+                                  name="%s-%i" % (self.name, len(self._workers)))
+        # Ensure that we don't hang on shutdown waiting for requests
+        thread.daemon = True
+        self._workers.append(thread)
+        self._idle += 1
+        thread.start()
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+                if task is not None:
+                    self._queued -= 1
+            if task is None:
+                return
+            try:
+                task.run()
+            except Exception:
+                self.logger.error("".join(traceback.format_exception(*sys.exc_info())))
+            with self._lock:
+                self._completed += 1
+                self._idle += 1
+
+    def stats(self):
+        """Get a dictionary of counters describing the pool state.
+
+        The keys are ``workers`` (threads started), ``active`` (threads
+        currently running a task), ``queued`` (tasks waiting for a
+        worker), ``max_queued`` (high-water mark of ``queued``),
+        ``completed`` and ``rejected``."""
+        with self._lock:
+            return {"workers": len(self._workers),
+                    "active": len(self._workers) - self._idle,
+                    "queued": self._queued,
+                    "max_queued": self._max_queued_seen,
+                    "completed": self._completed,
+                    "rejected": self._rejected}
+
+    def shutdown(self, wait=False):
+        """Stop accepting work and let the workers exit once the queue
+        has drained.
+
+        :param wait: Block until all the worker threads have exited.
+        """
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            workers = list(self._workers)
+        for _ in workers:
+            self._queue.put(None)
+        if wait:
+            for thread in workers:
+                thread.join()